@@ -0,0 +1,209 @@
+"""End to end sync throughput of CorpusServer against the in-process LocalCorpus stand-in.
+
+For each synthetic project shape the first upload, a resync with nothing changed, a resync with one changed file and a
+download into an empty project are timed. Request counts per endpoint and the peak traced memory of each phase are
+recorded and the results saved as json, so runs of different versions can be compared.
+
+Run with: python benchmarks/bench_sync.py [--latency 20 --bandwidth 100 --scale 0.1 --compare results/old.json]
+"""
+import asyncio
+import datetime
+import importlib.metadata
+import json
+import os
+import platform
+import re
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+from cinder.utils.common import CorpusServer, Project, ProjectDatabase, ProjectFile, load_settings
+from cinder.utils.local_corpus import LocalCorpus
+
+# name: list of (category, number of files, size of each file in bytes) at scale 1
+SHAPES = {
+    "many_small": [("other_files", 2000, 4 * 1024), ("sample_annotation", 200, 16 * 1024)],
+    "few_huge": [("unprocessed", 3, 256 * 1024 * 1024)],
+    "mixed": [("searched", 20, 8 * 1024 * 1024), ("other_files", 500, 64 * 1024),
+              ("comparison_matrix", 50, 1024)],
+}
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+WRITE_PIECE_SIZE = 4 * 1024 * 1024
+
+
+def cinder_version() -> str:
+    try:
+        return importlib.metadata.version("cinder")
+    except importlib.metadata.PackageNotFoundError:
+        with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pyproject.toml")) as f:
+            return re.search(r'^version = "([^"]+)"', f.read(), re.MULTILINE).group(1)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def write_file(path: str, size: int):
+    with open(path, "wb") as f:
+        while size > 0:
+            piece = os.urandom(min(size, WRITE_PIECE_SIZE))
+            f.write(piece)
+            size -= len(piece)
+
+
+def new_project(root: str, name: str) -> Project:
+    data_path = os.path.join(root, name, "data")
+    folders = load_settings()["project_folders"]
+    for folder in folders:
+        os.makedirs(os.path.join(data_path, folder), exist_ok=True)
+    return Project(project_id=0, description="", project_global_id=name, project_name=name,
+                   project_path=os.path.join(root, name), project_data_path=data_path, project_metadata={},
+                   project_files={folder: [] for folder in folders})
+
+
+def make_project(root: str, shape: str, scale: float) -> tuple[Project, int]:
+    """Write a synthetic project of a shape and return it refreshed with its total size"""
+    project = new_project(root, shape)
+    total = 0
+    for category, count, size in SHAPES[shape]:
+        size = max(1, int(size * scale))
+        for i in range(count):
+            write_file(os.path.join(project.project_data_path, category, f"{category}_{i:05d}.bin"), size)
+            total += size
+    project.refresh()
+    return project, total
+
+
+async def sync(corpus: CorpusServer, project: Project):
+    """Save a project to the server the way the project screen does"""
+    remote_category_hashes = None
+    if project.remote_id:
+        remote_category_hashes = (await corpus.get_project(project.remote_id)).category_hashes
+        await corpus.update_project(project)
+    else:
+        await corpus.create_project(project)
+    async for _ in corpus.upload_file(project, remote_category_hashes):
+        pass
+    project.refresh()
+    await corpus.update_project(project)
+
+
+async def download(corpus: CorpusServer, remote_id: int, root: str) -> Project:
+    """Download a remote project into an empty project the way project-download does"""
+    remote = await corpus.get_project(remote_id)
+    project = new_project(root, f"download_{remote_id}")
+    project.remote_id = remote.remote_id
+    files = (await corpus.get_project_files(remote_id)).json()
+    for f in files:
+        project.project_files.setdefault(f["file_category"], []).append(
+            ProjectFile(filename=f["filename"], path=tuple(f["path"]), sha1=f["hash"], remote_id=f["id"]))
+    async for _ in corpus.download_files(project):
+        pass
+    return project
+
+
+async def measure(local: LocalCorpus, phase, size: int) -> dict:
+    local.reset_stats()
+    tracemalloc.start()
+    start = time.perf_counter()
+    await phase()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": seconds,
+        "bytes": size,
+        "mb_per_second": size / seconds / 1e6 if seconds else 0.0,
+        "requests": sum(local.requests.values()),
+        "requests_by_endpoint": dict(sorted(local.requests.items())),
+        "bytes_uploaded": local.bytes_received,
+        "bytes_downloaded": local.bytes_sent,
+        "peak_memory_mb": peak / 1e6,
+    }
+
+
+async def run_shape(shape: str, root: str, scale: float, latency: float, bandwidth: float, chunk_size: int,
+                    concurrency: int) -> dict[str, dict]:
+    project, total = make_project(root, shape, scale)
+    local = LocalCorpus(os.path.join(root, "server"), latency=latency, bandwidth=bandwidth, chunk_size=chunk_size)
+    results = {}
+    async with CorpusServer("http://corpus.local", "", ProjectDatabase(), concurrency=concurrency,
+                            transport=local) as corpus:
+        results["upload"] = await measure(local, lambda: sync(corpus, project), total)
+        results["resync_unchanged"] = await measure(local, lambda: sync(corpus, project), 0)
+
+        changed = project.project_files[SHAPES[shape][0][0]][0]
+        changed_path = os.path.join(project.project_data_path, *changed.path, changed.filename)
+        changed_size = os.path.getsize(changed_path)
+        write_file(changed_path, changed_size)
+        project.refresh()
+        results["resync_one_changed"] = await measure(local, lambda: sync(corpus, project), changed_size)
+
+        results["download"] = await measure(local, lambda: download(corpus, project.remote_id, root), total)
+    return results
+
+
+def compare(current: dict, previous: dict):
+    """Print the ratio of the current results to a previous run, below 1 is faster or smaller"""
+    print(f"\nagainst {previous['version']} {previous['commit']} of {previous['created']}")
+    print(f"{'shape':<12} {'phase':<20} {'seconds':>9} {'requests':>9} {'peak mem':>9}")
+    for shape, phases in current["results"].items():
+        for phase, result in phases.items():
+            old = previous["results"].get(shape, {}).get(phase)
+            if old is None:
+                continue
+            ratios = [result[k] / old[k] if old[k] else float("nan")
+                      for k in ("seconds", "requests", "peak_memory_mb")]
+            print(f"{shape:<12} {phase:<20} " + " ".join(f"{r:>8.2f}x" for r in ratios))
+
+
+@click.command()
+@click.option("--shape", "shapes", multiple=True, type=click.Choice(list(SHAPES)), help="Shapes to run, all by default")
+@click.option("--scale", type=float, default=1.0, help="Multiplier of every file size")
+@click.option("--latency", type=float, default=20.0, help="Round trip latency of each request in ms")
+@click.option("--bandwidth", type=float, default=100.0, help="Link bandwidth in MB/s, 0 for unlimited")
+@click.option("--chunk-size", type=int, default=1024 * 1024, help="Chunk size handed out by the server in bytes")
+@click.option("--concurrency", type=int, default=None, help="Concurrent transfers, the upload setting by default")
+@click.option("--output", type=click.Path(), default=None, help="Results file, saved in benchmarks/results by default")
+@click.option("--compare", "compare_path", type=click.Path(exists=True), default=None,
+              help="Results file of an earlier run to compare with")
+def main(shapes, scale, latency, bandwidth, chunk_size, concurrency, output, compare_path):
+    settings = {"scale": scale, "latency_ms": latency, "bandwidth_mb_per_second": bandwidth, "chunk_size": chunk_size,
+                "concurrency": concurrency or load_settings().get("upload", {}).get("concurrency", 4)}
+    report = {"version": cinder_version(), "commit": git_commit(),
+              "created": datetime.datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "platform": platform.platform(), "settings": settings,
+              "results": {}}
+    print(f"{'shape':<12} {'phase':<20} {'seconds':>9} {'MB/s':>9} {'requests':>9} {'peak MB':>9}")
+    for shape in shapes or SHAPES:
+        with tempfile.TemporaryDirectory() as root:
+            results = asyncio.run(run_shape(shape, root, scale, latency / 1000, bandwidth * 1e6 or None, chunk_size,
+                                            settings["concurrency"]))
+        report["results"][shape] = results
+        for phase, result in results.items():
+            print(f"{shape:<12} {phase:<20} {result['seconds']:>9.3f} {result['mb_per_second']:>9.1f} "
+                  f"{result['requests']:>9} {result['peak_memory_mb']:>9.1f}")
+
+    if output is None:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_FOLDER, f"sync-{report['version']}-{report['commit'] or 'unknown'}-{stamp}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nsaved {output}")
+    if compare_path:
+        with open(compare_path, "rt") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Parity and timing of the vectorized dataframe helpers in cinder.utility against the previous row by row versions.
+
+Run with: python benchmarks/bench_utility.py
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from numpy.random import permutation
+
+from cinder.utility import round_all_number_in_dataframe, scramble_dataframe
+
+
+def legacy_scramble_dataframe(df: pd.DataFrame):
+    df = df.copy()
+    for col in df.columns:
+        df[col] = permutation(df[col])
+    return df
+
+
+def legacy_round_all_number_in_dataframe(df: pd.DataFrame):
+    df = df.copy()
+    for i, r in df.iterrows():
+        for c in df.columns:
+            if isinstance(r[c], float) and pd.notnull(r[c]):
+                df.at[i, c] = round(r[c])
+    return df
+
+
+def make_sample(rows: int, columns: int, seed: int = 0) -> pd.DataFrame:
+    """Header sample shaped like a wide DIA-NN report, a few text columns followed by intensities with missing values"""
+    rng = np.random.default_rng(seed)
+    data = {
+        "Protein.Group": [f"P{i:05d}" for i in range(rows)],
+        "Genes": [f"GENE{i}" for i in range(rows)],
+    }
+    intensities = rng.lognormal(20, 2, size=(rows, columns))
+    intensities[rng.random((rows, columns)) < 0.2] = np.nan
+    for i in range(columns):
+        data[f"/data/run_{i:05d}.raw"] = intensities[:, i]
+    return pd.DataFrame(data)
+
+
+def timed(function, *args, repeat: int = 3, **kwargs) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check_parity(df: pd.DataFrame):
+    pd.testing.assert_frame_equal(round_all_number_in_dataframe(df), legacy_round_all_number_in_dataframe(df))
+
+    scrambled = scramble_dataframe(df, seed=1)
+    pd.testing.assert_frame_equal(scrambled, scramble_dataframe(df, seed=1))
+    assert list(scrambled.columns) == list(df.columns)
+    assert (scrambled.dtypes == df.dtypes).all()
+    for column in df.columns:
+        # every column holds the same values in a different order
+        assert sorted(scrambled[column].astype(str)) == sorted(df[column].astype(str)), column
+
+    before = df.copy()
+    round_all_number_in_dataframe(df)
+    scramble_dataframe(df)
+    pd.testing.assert_frame_equal(df, before)
+
+
+def main():
+    print(f"{'rows':>6} {'columns':>8} {'function':<10} {'legacy s':>10} {'vectorized s':>13} {'speedup':>8}")
+    for rows, columns in [(5, 500), (5, 5000), (100, 1000), (1000, 200)]:
+        df = make_sample(rows, columns)
+        check_parity(df)
+        for name, legacy, vectorized in [
+            ("round", legacy_round_all_number_in_dataframe, round_all_number_in_dataframe),
+            ("scramble", legacy_scramble_dataframe, scramble_dataframe),
+        ]:
+            legacy_time = timed(legacy, df, repeat=1)
+            vectorized_time = timed(vectorized, df)
+            print(f"{rows:>6} {columns:>8} {name:<10} {legacy_time:>10.4f} {vectorized_time:>13.4f} "
+                  f"{legacy_time / vectorized_time:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,21 @@
+import asyncio
+import hashlib
 import json
 import os
+import random
+import time
 from typing import List
 
 import openai
 import pandas as pd
 from cinder.utility import scramble_dataframe, mask_column_name_with_number, round_all_number_in_dataframe
+from cinder.utils.common import app_dir, load_settings
+
+# bump when the column classification prompt changes so answers cached for the old prompt are not reused
+PROMPT_VERSION = 1
+
+SYSTEM_PROMPT = "Assume a bioinformatician role"
+JSON_COLUMNS_PROMPT = """The dataframe in json format below contains sample intensity data where each key is a column name. Can you identify the name of columns with only sample intensity data? Do not include any explanations and return only in a RFC8259 compliant json array without deviation following the example: ["column_name_1","column_name_2","column_name_3"]"""
 
 
 # data = openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=[
@@ -30,15 +41,131 @@ from cinder.utility import scramble_dataframe, mask_column_name_with_number, rou
 #     ])
 
 
-async def gpt_get_index(data: pd.DataFrame, api_key: str = "") -> List[int]:
-    data = round_all_number_in_dataframe(data)
+def get_api_key(api_key: str = "") -> str:
+    """Return the given OpenAI API key or the one from the OPENAI_API_KEY environment variable"""
+    if not api_key:
+        api_key = os.environ.get("OPENAI_API_KEY", "")
     if not api_key:
-        openai.api_key = os.environ.get("OPENAI_API_KEY", None)
-    if openai.api_key is None:
         raise ValueError("OPENAI_API_KEY not found")
-    res = await openai.ChatCompletion.acreate(model="gpt-3.5-turbo", messages=[
+    return api_key
+
+
+def retry_after(error: openai.APIStatusError) -> float | None:
+    """Return the delay in seconds the server asked for in the Retry-After header of a rate limited response"""
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ColumnClassifier:
+    """Find the sample intensity columns of wide tables by sending batches of columns to GPT concurrently.
+    The answer for each batch is cached on disk by a signature of its column names, so a table with a column
+    layout that was classified before does not need any API calls"""
+
+    def __init__(self, api_key: str = "", model: str = "gpt-3.5-turbo", batch_size: int = 25, concurrency: int = 4,
+                 max_retries: int = 5, cache_dir: str | None = None):
+        # retries are handled here so a rate limit on one batch also pauses the others
+        self.client = openai.AsyncOpenAI(api_key=get_api_key(api_key), max_retries=0)
+        self.model = model
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.cache_dir = cache_dir or os.path.join(app_dir.user_cache_dir, "gpt_columns")
+        self.resume_at = 0.0
+        self.api_calls = 0
+        self.cache_hits = 0
+
+    @classmethod
+    def from_settings(cls, api_key: str = "", settings: dict = None) -> "ColumnClassifier":
+        if settings is None:
+            settings = load_settings()
+        gpt_settings = settings.get("gpt", {})
+        return cls(api_key, model=gpt_settings.get("model", "gpt-3.5-turbo"),
+                   batch_size=gpt_settings.get("batch_size", 25), concurrency=gpt_settings.get("concurrency", 4),
+                   max_retries=gpt_settings.get("max_retries", 5))
+
+    def signature(self, columns: list[str]) -> str:
+        """Hash the column names of a batch together with the model and prompt version"""
+        key = json.dumps({"model": self.model, "prompt": PROMPT_VERSION, "columns": [str(c) for c in columns]})
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def cache_path(self, signature: str) -> str:
+        return os.path.join(self.cache_dir, signature[:2], f"{signature}.json")
+
+    def get_cached(self, columns: list[str]) -> list[str] | None:
+        path = self.cache_path(self.signature(columns))
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rt") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_cached(self, columns: list[str], sample_columns: list[str]):
+        path = self.cache_path(self.signature(columns))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "wt") as f:
+            json.dump(sample_columns, f)
+        os.replace(f"{path}.tmp", path)
+
+    async def classify(self, data: pd.DataFrame) -> List[str]:
+        """Return the names of the sample intensity columns of a header sample in column order"""
+        data = round_all_number_in_dataframe(data)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batches = [data.iloc[:, i:i + self.batch_size] for i in range(0, len(data.columns), self.batch_size)]
+        results = await asyncio.gather(*(self.classify_batch(batch, semaphore) for batch in batches))
+        return [column for result in results for column in result]
+
+    async def classify_batch(self, data: pd.DataFrame, semaphore: asyncio.Semaphore) -> List[str]:
+        columns = [str(c) for c in data.columns]
+        cached = self.get_cached(columns)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        async with semaphore:
+            answer = await self.request([
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": JSON_COLUMNS_PROMPT},
+                {"role": "user", "content": json.dumps(scramble_dataframe(data).to_dict())},
+            ])
+        answer = set(map(str, answer))
+        sample_columns = [c for c in columns if c in answer]
+        self.put_cached(columns, sample_columns)
+        return sample_columns
+
+    async def request(self, messages: list[dict]) -> list:
+        """Send a chat completion and parse its json array answer, retrying with exponential backoff"""
+        for attempt in range(self.max_retries + 1):
+            delay = min(30.0, 2 ** attempt) + random.random()
+            wait = self.resume_at - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                self.api_calls += 1
+                res = await self.client.chat.completions.create(model=self.model, messages=messages)
+                answer = json.loads(res.choices[0].message.content)
+                if not isinstance(answer, list):
+                    raise ValueError("GPT answer is not a json array")
+                return answer
+            except openai.RateLimitError as e:
+                if attempt == self.max_retries:
+                    raise
+                # every batch waits until the rate limit has passed, not only the one that hit it
+                self.resume_at = max(self.resume_at, time.monotonic() + (retry_after(e) or delay))
+            except (openai.APIConnectionError, openai.InternalServerError, ValueError):
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(delay)
+
+
+async def gpt_get_index(data: pd.DataFrame, api_key: str = "") -> List[int]:
+    data = round_all_number_in_dataframe(data)
+    client = openai.AsyncOpenAI(api_key=get_api_key(api_key))
+    res = await client.chat.completions.create(model="gpt-3.5-turbo", messages=[
         {
-            "role": "system", "content": "Assume a bioinformatician role",
+            "role": "system", "content": SYSTEM_PROMPT,
         },
         {
             "role": "user", "content": f"""The tabulated data below has {data.shape[0]+1} rows and {len(data.columns)} columns with the first row being header. Each row is separated by a newline symbol '\\n'. Can you identify the name of columns with only sample intensity data?
@@ -49,46 +176,24 @@ async def gpt_get_index(data: pd.DataFrame, api_key: str = "") -> List[int]:
         }
     ])
     result = []
-    for i in json.loads(res["choices"][0]["message"]["content"]):
+    for i in json.loads(res.choices[0].message.content):
         result.append(data.columns[int(i)])
     return result
 
-async def gpt_index_with_json(data: pd.DataFrame, api_key: str = "") -> List[int]:
-    if not api_key:
-        openai.api_key = os.environ.get("OPENAI_API_KEY", None)
-    if openai.api_key is None:
-        raise ValueError("OPENAI_API_KEY not found")
-    meta = f"""The dataframe in json format below contains sample intensity data where each key is a column name. Can you identify the name of columns with only sample intensity data? Do not include any explanations and return only in a RFC8259 compliant json array without deviation following the example: ["column_name_1","column_name_2","column_name_3"]"""
-    result = []
-    # separate dataframe into smaller chunks to fit into openai api token limit
-    for i in range(0, len(data), 30):
-        res = await openai.ChatCompletion.acreate(model="gpt-3.5-turbo", messages=[
-            {
-                "role": "system", "content": "Assume a bioinformatician role",
-            },
-            {
-                "role": "user", "content": meta
-            },
-            {
-                "role": "user", "content": json.dumps(scramble_dataframe(data).to_dict())
-            }
-        ])
-
-        for i in json.loads(res["choices"][0]["message"]["content"]):
-            result.append(i)
-    return result
+
+async def gpt_index_with_json(data: pd.DataFrame, api_key: str = "") -> List[str]:
+    """Find the sample intensity columns of a header sample with concurrent, cached batch requests"""
+    return await ColumnClassifier.from_settings(api_key).classify(data)
+
 
 def get_index(data: pd.DataFrame, api_key: str = "") -> List[int]:
     data = round_all_number_in_dataframe(data)
-    if not api_key:
-        openai.api_key = os.environ.get("OPENAI_API_KEY", None)
-    if openai.api_key is None:
-        raise ValueError("OPENAI_API_KEY not found")
+    client = openai.OpenAI(api_key=get_api_key(api_key))
     meta = f"""The tabulated data below has {data.shape[0] + 1} rows and {len(data.columns)} columns with the first row being header. Each row is separated by a newline symbol '\\n'. Can you identify the name of columns with only sample intensity data? Do not include any explanations and return only in a RFC8259 compliant json array without deviation following the example: ["column_name_1", "column_name_2", "column_name_3"]"""
 
-    res = openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=[
+    res = client.chat.completions.create(model="gpt-3.5-turbo", messages=[
         {
-            "role": "system", "content": "Assume a bioinformatician role",
+            "role": "system", "content": SYSTEM_PROMPT,
         },
         {
             "role": "user", "content": meta},
@@ -96,35 +201,9 @@ def get_index(data: pd.DataFrame, api_key: str = "") -> List[int]:
             "role": "user", "content": scramble_dataframe(data).to_csv(index=False, sep="\t")
         }
     ])
-    return json.loads(res["choices"][0]["message"]["content"])
+    return json.loads(res.choices[0].message.content)
 
-def get_index_json(data: pd.DataFrame, api_key: str = "") -> List[int]:
-    data = round_all_number_in_dataframe(data)
-    if not api_key:
-        openai.api_key = os.environ.get("OPENAI_API_KEY", None)
-    if openai.api_key is None:
-        raise ValueError("OPENAI_API_KEY not found")
-    meta = f"""The dataframe in json format below contains sample intensity data where each key is a column name. Please identify the column name of those with only sample intensity data. Do not include any explanations and return only in a RFC8259 compliant json array without deviation following the example: [column_number_1, column_number_2, column_number_3]"""
-    result = []
-    for i in range(0, len(data.columns), 25):
-        if i+25 > len(data.columns):
-            columns = data.columns[i:]
-        else:
-            columns = data.columns[i:i+25]
-        res = openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=[
-            {
-                "role": "system", "content": "Assume a bioinformatician role",
-            },
-            {
-                "role": "user", "content": meta
-            },
-            {
-                "role": "user", "content": json.dumps(scramble_dataframe(data[columns]).to_dict())
-            }
-        ])
-        print(res)
-        for c in json.loads(res["choices"][0]["message"]["content"]):
-            if c in data.columns:
-                result.append(c)
-        print(len(result))
-    return result
+
+def get_index_json(data: pd.DataFrame, api_key: str = "") -> List[str]:
+    """Synchronous version of gpt_index_with_json"""
+    return asyncio.run(gpt_index_with_json(data, api_key))
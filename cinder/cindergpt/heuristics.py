@@ -0,0 +1,94 @@
+import re
+import warnings
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+# column names of quantification reports that hold per sample intensities
+SAMPLE_NAME_PATTERN = re.compile(
+    r"^(?:lfq intensity|intensity|ibaq|abundance|reporter intensity corrected|reporter intensity)[ _.:]\S"
+    r"|\.(?:raw|d|wiff|wiff2|mzml|mzxml|dia)$"
+    r"|^(?:/|[a-z]:[\\/])",
+    re.IGNORECASE)
+
+# column names of identifiers, annotations, statistics and counts that are never samples
+META_NAME_PATTERN = re.compile(
+    r"^(?:intensity|lfq intensity|ibaq|abundance)$"
+    r"|^[ctn]: "
+    r"|protein|gene|peptide|sequence|precursor\.id|modified|uniprot|accession|description|fasta|organism"
+    r"|q[ ._-]?value|p[ ._-]?value|fdr|\bpep\b|score|fold|log2fc|\bfc\b|ratio"
+    r"|count|number|length|mass|weight|charge|m/z|\bmz\b|\brt\b|retention|\bid\b|index|site|position|localization"
+    r"|razor|unique|coverage|reverse|contaminant|decoy|only identified",
+    re.IGNORECASE)
+
+REPLICATE_PATTERN = r"^(?P<stem>.+?)[._-](?P<replicate>\d{1,3})$"
+
+
+@dataclass
+class ColumnDetection:
+    """Result of the offline sample column detector, columns whose score is not decisive are left ambiguous"""
+    samples: list[str] = field(default_factory=list)
+    non_samples: list[str] = field(default_factory=list)
+    ambiguous: list[str] = field(default_factory=list)
+    scores: dict[str, float] = field(default_factory=dict)
+
+
+def score_columns(data: pd.DataFrame) -> pd.Series:
+    """Score every column of a header sample, positive scores look like sample intensities and negative ones like
+    identifiers, annotations or statistics"""
+    names = pd.Series([str(c) for c in data.columns], dtype=object)
+    scores = np.zeros(len(names))
+
+    # dtype, text columns are never intensities
+    numeric = np.array([pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+                        for dtype in data.dtypes])
+    scores[~numeric] -= 5
+
+    # value distribution of the numeric columns, intensities are large non negative values with a wide range
+    if numeric.any():
+        values = data.iloc[:, np.flatnonzero(numeric)].to_numpy(dtype="float64")
+        observed = ~np.isnan(values)
+        has_values = observed.any(axis=0)
+        with warnings.catch_warnings():
+            # columns without any value in the sample rows give all nan slices, they are masked by has_values
+            warnings.simplefilter("ignore", RuntimeWarning)
+            minimum = np.nanmin(values, axis=0)
+            maximum = np.nanmax(values, axis=0)
+            median = np.nanmedian(values, axis=0)
+        integer = (np.where(observed, values, 0) % 1 == 0).all(axis=0)
+        numeric_scores = np.zeros(values.shape[1])
+        numeric_scores += np.where(has_values & (minimum >= 0) & (median >= 1000), 1.5, 0)
+        numeric_scores -= np.where(has_values & (minimum < 0), 1, 0)
+        numeric_scores -= np.where(has_values & (minimum >= 0) & (maximum <= 1), 2, 0)
+        numeric_scores -= np.where(has_values & integer & (maximum < 1000), 1.5, 0)
+        scores[numeric] += numeric_scores
+
+    # naming patterns of MaxQuant, DIA-NN, Spectronaut and Proteome Discoverer outputs
+    sample_name = names.str.contains(SAMPLE_NAME_PATTERN).to_numpy(dtype=bool)
+    meta_name = names.str.contains(META_NAME_PATTERN).to_numpy(dtype=bool)
+    scores += np.where(sample_name, 2, 0)
+    scores -= np.where(meta_name & ~sample_name, 3, 0)
+
+    # replicate structure, several columns sharing a stem and differing only by a replicate number like .01 .02
+    replicates = names.str.extract(REPLICATE_PATTERN)
+    stem_sizes = replicates["stem"].map(replicates["stem"].value_counts())
+    scores += np.where(replicates["stem"].notna() & (stem_sizes >= 2), 1, 0)
+
+    return pd.Series(scores, index=names)
+
+
+def detect_sample_columns(data: pd.DataFrame, sample_threshold: float = 2.5,
+                          non_sample_threshold: float = -1.5) -> ColumnDetection:
+    """Split the columns of a header sample into confident sample columns, confident non sample columns and the
+    ambiguous rest that needs another opinion"""
+    scores = score_columns(data)
+    result = ColumnDetection(scores=scores.to_dict())
+    for name, score in scores.items():
+        if score >= sample_threshold:
+            result.samples.append(name)
+        elif score <= non_sample_threshold:
+            result.non_samples.append(name)
+        else:
+            result.ambiguous.append(name)
+    return result
@@ -0,0 +1,166 @@
+import os
+
+from textual import on, work
+from textual.app import ComposeResult
+from textual.binding import Binding
+from textual.containers import Horizontal, Vertical
+from textual.message import Message
+from textual.widgets import Header, Footer, Label, Input, Button, Select, SelectionList, DataTable, Log
+from textual.widgets.selection_list import Selection
+
+from cinder.base_screen import BaseScreen
+from cinder.utils.common import Job, load_settings
+from cinder.utils.differential_analysis import CORAL_IMAGE, DifferentialAnalysis, StaleOutput
+from cinder.utils.jobs import JobScheduler
+
+
+class JobUpdated(Message):
+    """State change of a job, posted from the scheduler threads"""
+
+    def __init__(self, job: Job):
+        super().__init__()
+        self.job = job
+
+
+class JobLog(Message):
+    """Log output of a running job, posted from the scheduler threads"""
+
+    def __init__(self, job: Job, text: str):
+        super().__init__()
+        self.job = job
+        self.text = text
+
+
+def get_scheduler(app) -> JobScheduler:
+    """Return the job scheduler of the app, started with recovery of the jobs of a previous session on first use"""
+    if getattr(app, "scheduler", None) is None:
+        app.scheduler = JobScheduler.from_settings(app.db, load_settings())
+        app.scheduler.start()
+    return app.scheduler
+
+
+class JobScreen(BaseScreen):
+    """Queue differential analyses of the open project and follow their status and logs"""
+    CSS_PATH = "jobs_screen.tcss"
+    BINDINGS = [
+        Binding("ctrl+x", "cancel_job", "Cancel selected job"),
+        Binding("ctrl+o", "stale_outputs", "Show stale outputs"),
+        Binding("escape", "back", "Back to project"),
+    ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.selected_job: int | None = None
+
+    def compose(self) -> ComposeResult:
+        files = self.app.data.project_files
+        yield Header(True, name="Cinder")
+        yield Horizontal(
+            Vertical(Label("Unprocessed files"), SelectionList(
+                *[Selection(f.filename, f.filename) for f in files.get("unprocessed", []) if not f.filename.endswith(".json")],
+                id="jobs-unprocessed-files")),
+            Vertical(Label("Comparison matrices"), SelectionList(
+                *[Selection(f.filename, f.filename) for f in files.get("comparison_matrix", []) if not f.filename.endswith(".json")],
+                id="jobs-comparison-matrices")),
+            Vertical(
+                Label("Sample annotation"),
+                Select([(f.filename, f.filename) for f in files.get("sample_annotation", []) if not f.filename.endswith(".json")],
+                       id="jobs-annotation-file", prompt="Select annotation file"),
+                Input(placeholder="Index columns", id="jobs-index-cols"),
+                Button("Queue", id="jobs-queue", variant="primary")),
+            id="jobs-form")
+        yield DataTable(id="jobs-table", cursor_type="row")
+        yield Log(id="jobs-log")
+        yield Footer()
+
+    def on_mount(self) -> None:
+        super().on_mount()
+        table = self.query_one("#jobs-table", DataTable)
+        for column in ["Job", "Unprocessed", "Comparison matrix", "Output", "Status", "CPUs", "Memory", "Started",
+                       "Finished", "Error"]:
+            table.add_column(column, key=column.lower())
+        scheduler = get_scheduler(self.app)
+        scheduler.on_update = lambda job: self.post_message(JobUpdated(job))
+        scheduler.on_log = lambda job, text: self.post_message(JobLog(job, text))
+        for job in self.app.db.get_jobs(project_id=self.app.data.project_id):
+            self.show_job(job)
+
+    def show_job(self, job: Job):
+        table = self.query_one("#jobs-table", DataTable)
+        row = [str(job.job_id), job.analysis.unprocessed_file, job.analysis.comparison_matrix_file,
+               job.analysis.output_file, job.status, f"{job.cpus:g}", f"{job.memory} MB", job.started_at or "",
+               job.finished_at or "", job.error]
+        key = str(job.job_id)
+        if key in table.rows:
+            for column, value in zip(table.columns, row):
+                table.update_cell(key, column, value)
+        else:
+            table.add_row(*row, key=key)
+
+    @on(Button.Pressed, "#jobs-queue")
+    def queue_jobs(self, event: Button.Pressed):
+        """Queue one job per selected unprocessed file and comparison matrix"""
+        if not self.app.data.project_id:
+            self.notify("Save the project before queueing jobs.", severity="error")
+            return
+        unprocessed = self.query_one("#jobs-unprocessed-files", SelectionList).selected
+        matrices = self.query_one("#jobs-comparison-matrices", SelectionList).selected
+        annotation = self.query_one("#jobs-annotation-file", Select).value
+        index_cols = self.query_one("#jobs-index-cols", Input).value.strip()
+        if not unprocessed or not matrices or annotation == Select.BLANK or not index_cols:
+            self.notify("Select unprocessed files, comparison matrices, an annotation file and index columns.",
+                        severity="error")
+            return
+        job_settings = load_settings().get("jobs", {})
+        scheduler = get_scheduler(self.app)
+        for unprocessed_file in unprocessed:
+            for matrix in matrices:
+                analysis = DifferentialAnalysis(
+                    unprocessed_file=unprocessed_file, annotation_file=annotation, comparison_matrix_file=matrix,
+                    output_file=f"{os.path.splitext(unprocessed_file)[0]}_{os.path.splitext(matrix)[0]}",
+                    index_cols=index_cols)
+                scheduler.submit(self.app.data, analysis, cpus=job_settings.get("cpus", 2),
+                                 memory=job_settings.get("memory", 4096),
+                                 docker_image=job_settings.get("docker_image", CORAL_IMAGE))
+        self.notify(f"Queued {len(unprocessed) * len(matrices)} jobs")
+
+    def on_job_updated(self, message: JobUpdated):
+        if message.job.project_id == self.app.data.project_id:
+            self.show_job(message.job)
+
+    def on_job_log(self, message: JobLog):
+        if message.job.job_id == self.selected_job:
+            self.query_one("#jobs-log", Log).write(message.text)
+
+    @on(DataTable.RowHighlighted, "#jobs-table")
+    def job_highlighted(self, event: DataTable.RowHighlighted):
+        self.selected_job = int(event.row_key.value)
+        log = self.query_one("#jobs-log", Log)
+        log.clear()
+        job = self.app.db.get_job(self.selected_job)
+        if job.log_path and os.path.exists(job.log_path):
+            with open(job.log_path, "rt") as f:
+                log.write(f.read())
+
+    def action_cancel_job(self):
+        if self.selected_job is not None:
+            get_scheduler(self.app).cancel(self.selected_job)
+
+    @work(thread=True, exclusive=True, group="stale", name="Checking outputs", exit_on_error=False)
+    def action_stale_outputs(self):
+        """List the analysis outputs whose inputs changed since they were made"""
+        stale = self.app.data.stale_analyses()
+        self.app.call_from_thread(self.show_stale_outputs, stale)
+
+    def show_stale_outputs(self, stale: list[StaleOutput]):
+        self.selected_job = None
+        log = self.query_one("#jobs-log", Log)
+        log.clear()
+        if not stale:
+            log.write_line("All differential analysis outputs are up to date")
+        for output in stale:
+            reasons = [f"changed {f}" for f in output.changed] + [f"missing {f}" for f in output.missing]
+            log.write_line(f"{output.output_file}: {', '.join(reasons)}")
+
+    def action_back(self):
+        self.app.pop_screen()
@@ -1,4 +1,5 @@
 import dataclasses
+import asyncio
 import json
 import os
 from io import BytesIO
@@ -8,18 +9,25 @@ import httpx
 import pandas as pd
 from textual_plotext import PlotextPlot
 from cinder.util_screen.modal_quit import ModalQuitScreen
-from cinder.utils.common import app_dir, load_settings, ProjectFile, Project, QueryResult, ProjectDatabase, CorpusServer
-from textual import on, events
+from cinder.util_screen.worker_progress import WorkerProgress
+from cinder.utils.common import app_dir, load_settings, ProjectFile, Project, QueryResult, ProjectDatabase, CorpusServer, \
+    ProjectSummary, load_local_db, load_table_cache
+from cinder.utils.blob_store import atomic_write
+from cinder.utils.table_cache import read_table_header
+from cinder.utils.table_index import TableIndex
+from textual import on, events, work
 from textual.app import App, ComposeResult
 from textual.binding import Binding
 from textual.containers import Horizontal, Grid, VerticalScroll, Vertical
 from textual.screen import Screen
+from textual.worker import Worker, WorkerCancelled, WorkerState, get_current_worker
 from textual.widgets import Label, Header, Input, Placeholder, Button, OptionList, Footer, Markdown, Static, Select, \
     SelectionList, TabbedContent, TabPane, TextArea, Checkbox
 from textual.widgets.selection_list import Selection
 from textual.widgets.option_list import Option
 
 from cinder.base_screen import BaseScreen
+from cinder.cinderproject.jobs import JobScreen
 from cinder.utility import detect_delimiter_from_extension
 
 
@@ -58,15 +66,16 @@ class ProjectManagerScreen(BaseScreen):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.project_list: list[Project] = []
+        self.project_list: list[ProjectSummary] = []
         self.project: Project | None = None
         self.query: QueryResult | None = None
+        self.search_term: str = ""
 
     def compose(self) -> ComposeResult:
         yield Header(True)
         yield Grid(
             Vertical(
-                Input(),
+                Input(placeholder="Search projects", id="project-search"),
                 VerticalScroll(OptionList(id="project-selection-list"), id="project-selection-list-container"),
                 Horizontal(id="pagination-container"), id="project-selection-container"),
             Vertical(Horizontal(Label("Select a project", id="project-name"), Button("Open project", "error", id="open-project", classes="button-hide"), classes="align-middle h-3"), VerticalScroll(Static(id="project-data"),id="project-data-container"), id="project-detail-container"),
@@ -77,7 +86,7 @@ class ProjectManagerScreen(BaseScreen):
         self.set_project_list_pagination()
 
     def set_project_list_pagination(self, offset=0, limit=10):
-        self.query = self.app.db.search_projects(offset=offset, limit=limit)
+        self.query = self.app.db.search_projects(term=self.search_term, offset=offset, limit=limit)
         self.project_list = self.query.data
         self.query_one("#project-selection-list", OptionList).clear_options()
         for i in self.project_list:
@@ -99,6 +108,11 @@ class ProjectManagerScreen(BaseScreen):
         current_page = Label(f"Page {current_page_number} of {total_pages}", id="pagination-label")
         pagination.mount(left_button, current_page, right_button)
 
+    @on(Input.Changed, "#project-search")
+    async def search_projects(self, event: Input.Changed):
+        self.search_term = event.value
+        self.set_project_list_pagination()
+
     @on(Button.Pressed, "#pagination-left")
     async def pagination_left(self, event):
         self.set_project_list_pagination(offset=self.query.offset - self.query.limit)
@@ -131,18 +145,25 @@ class ProjectScreen(BaseScreen):
         Binding("ctrl+r", "refresh", "Refresh project data"),
         Binding("ctrl+s", "save", "Save project data"),
         Binding("ctrl+r", "save_to_server", "Save project data to server"),
+        Binding("escape", "cancel_workers", "Cancel running task"),
+        Binding("ctrl+j", "jobs", "Differential analysis jobs"),
     ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.project_df_dict: dict[str, pd.DataFrame|None] = {}
+        self.project_header_dict: dict[str, pd.DataFrame|None] = {}
 
         self.project_selected_file_dict: dict[str, ProjectFile|None] = {}
+        # file whose header fills the pickers of each tab, the loaded columns and index belong to it
+        self.project_loaded_file_dict: dict[str, ProjectFile|None] = {}
 
         self.index_column: str | None = None
         self.meta_data_columns: list[str] = []
         self.current_tab: str = "unprocessed"
         self.selected_index_value_dict: dict[str, str] = {}
+        self.project_index_dict: dict[str, TableIndex|None] = {}
+        self.table_cache = load_table_cache()
 
     def compose(self) -> ComposeResult:
         yield Header(True, name="Cinder")
@@ -247,8 +268,9 @@ class ProjectScreen(BaseScreen):
                         Label("Select sample columns"),
                         VerticalScroll(SelectionList(*[], id=f"{self.current_tab}-sample-columns", classes="ml-4"), )
                     ),
-                    Horizontal(Select(options=[], id=f"{self.current_tab}-index-value-selection", prompt="Select index value",
-                               classes="ml-4"),Button("View Plot", id=f"{self.current_tab}-view-plot", variant="primary", classes="ml-4")),
+                    Horizontal(Vertical(Input(placeholder="Search index value", id=f"{self.current_tab}-index-value-search", classes="ml-4"),
+                                        OptionList(id=f"{self.current_tab}-index-value-selection", classes="ml-4")),
+                               Button("View Plot", id=f"{self.current_tab}-view-plot", variant="primary", classes="ml-4")),
                     Barchart("Bar Plot", id=f"{self.current_tab}-plot", classes="row-span-2 col-span-3")
                     #PlotextPlot(id=f"{self.current_tab}-plot", classes="row-span-2 col-span-2")
                 ])
@@ -267,14 +289,42 @@ class ProjectScreen(BaseScreen):
                         Checkbox("-Log10 Transform", id=f"{self.current_tab}-log10-p-value", value=False),
                         VerticalScroll(SelectionList(*[], id=f"{self.current_tab}-p-value", classes="ml-4"), )),
                     Horizontal(
-                        Select(options=[], id=f"{self.current_tab}-index-value-selection", prompt="Select index value",
-                               classes="ml-4"),
+                        Vertical(Input(placeholder="Search index value", id=f"{self.current_tab}-index-value-search", classes="ml-4"),
+                                 OptionList(id=f"{self.current_tab}-index-value-selection", classes="ml-4")),
                         Button("View Plot", id=f"{self.current_tab}-view-plot", variant="primary", classes="ml-4"),
                     ),
 
                     PlotextPlot(id=f"{self.current_tab}-plot", classes="row-span-2 col-span-3")
                 ])
 
+    def load_columns(self, tab: str, file: ProjectFile, columns: list[str]) -> pd.DataFrame:
+        """Return the table of a file shown in a tab with at least the given columns, reading only the columns that were not read before.
+        Rows keep the order of the file so row positions of the tab's TableIndex stay valid.
+        Runs in a worker thread, the columns are kept for the tab on the event loop unless the worker was cancelled"""
+        df = self.project_df_dict.get(tab) if self.project_loaded_file_dict.get(tab) == file else None
+        missing = [c for c in dict.fromkeys(columns) if df is None or c not in df.columns]
+        if missing:
+            loaded = self.table_cache.load_columns(
+                os.path.join(self.app.data.project_data_path, *file.path, file.filename),
+                file.sha1,
+                detect_delimiter_from_extension(file.filename),
+                missing,
+                sample=self.project_header_dict.get(tab))
+            df = loaded if df is None else pd.concat([df, loaded], axis=1)
+            if not get_current_worker().is_cancelled:
+                self.app.call_from_thread(self.store_columns, tab, file, loaded)
+        return df
+
+    def store_columns(self, tab: str, file: ProjectFile, loaded: pd.DataFrame):
+        """Add columns read by a worker to the table of a tab if the tab still shows the file they were read from"""
+        if self.project_loaded_file_dict.get(tab) != file:
+            return
+        df = self.project_df_dict.get(tab)
+        if df is None:
+            self.project_df_dict[tab] = loaded
+        else:
+            self.project_df_dict[tab] = pd.concat([df, loaded[[c for c in loaded.columns if c not in df.columns]]], axis=1)
+
     @on(TabbedContent.TabActivated, "#project-screen-tabs")
     async def tab_activated(self, event: TabbedContent.TabActivated):
         self.current_tab = event.tab.id
@@ -283,7 +333,7 @@ class ProjectScreen(BaseScreen):
 
     @on(OptionList.OptionSelected)
     async def file_selected(self, event: OptionList.OptionSelected):
-        if event.option.id is not None:
+        if event.option_list.id == f"{self.current_tab}-file-selection" and event.option.id is not None:
             current_file_label = self.query_one(f"#{self.current_tab}-selected-file-label", Label)
             current_file_label.update(f"Selected File: {event.option.prompt}")
             self.project_selected_file_dict[self.current_tab] = self.app.data.project_files[self.current_tab][int(event.option.id)]
@@ -292,212 +342,214 @@ class ProjectScreen(BaseScreen):
     async def button_action(self, event: Button.Pressed):
         if event.button.id is not None:
             if event.button.id.endswith("view-plot"):
-                plot = self.query_one(f"#{self.current_tab}-plot", Barchart)
                 if self.current_tab != "differential_analysis":
-                    df = self.project_df_dict[self.current_tab]
                     index_column = self.query_one(f"#{self.current_tab}-index-column-selection", Select).value
+                    meta_columns = self.query_one(f"#{self.current_tab}-additional-meta-index-columns", SelectionList).selected
                     samples = self.query_one(f"#{self.current_tab}-sample-columns", SelectionList).selected
-                    index_value = self.selected_index_value_dict[self.current_tab]
-                    data = list(df[df[index_column] == index_value][samples].fillna(0).astype(float).values[0])
-                    plot.draw(samples, data)
-                    plot.set_title("Data distribution for " + index_value)
+                    index_value = self.selected_index_value_dict.get(self.current_tab)
+                    if index_value is None:
+                        self.notify("Select an index value to plot", severity="warning")
+                        return
+                    plot = self.query_one(f"#{self.current_tab}-plot", Barchart)
+                    self.plot_index_value(self.current_tab, self.project_loaded_file_dict[self.current_tab],
+                                          index_column, meta_columns, samples, index_value, plot)
             else:
                 delimiter = detect_delimiter_from_extension(self.project_selected_file_dict[self.current_tab].filename)
                 if delimiter:
-                    self.project_df_dict[self.current_tab] = pd.read_csv(
-                        os.path.join(
-                            self.app.data.project_data_path,
-                            *self.project_selected_file_dict[self.current_tab].path,
-                            self.project_selected_file_dict[self.current_tab].filename),
-                        sep=delimiter
-                    )
-                    index_selection = self.query_one(f"#{self.current_tab}-index-column-selection", Select)
-                    index_selection.set_options([(i, i) for i in self.project_df_dict[self.current_tab].columns])
-                    additional_meta_index_columns = self.query_one(f"#{self.current_tab}-additional-meta-index-columns", SelectionList)
-                    additional_meta_index_columns.clear_options()
-                    additional_meta_index_columns.add_options([Selection(i, i) for i in self.project_df_dict[self.current_tab].columns])
-                    if self.current_tab != "differential_analysis":
-                        sample_columns = self.query_one(f"#{self.current_tab}-sample-columns", SelectionList)
-                        sample_columns.clear_options()
-                        sample_columns.add_options([Selection(i, i) for i in self.project_df_dict[self.current_tab].columns])
-                    self.notify("Loaded " + self.project_selected_file_dict[self.current_tab].filename)
+                    self.read_header(self.current_tab, self.project_selected_file_dict[self.current_tab], delimiter)
                 else:
                     self.notify("File can only be in csv, tsv, or txt format")
 
+    @work(thread=True, exclusive=True, group="table", name="Loading file", exit_on_error=False)
+    def read_header(self, tab: str, file: ProjectFile, delimiter: str):
+        """Read the header and a few rows of a table off the event loop and fill the column pickers of a tab"""
+        self.post_message(WorkerProgress(f"Reading {file.filename}"))
+        # only the header and a few rows are read to fill the pickers,
+        # the chosen columns are loaded by load_columns when they are used
+        file_path = os.path.join(self.app.data.project_data_path, *file.path, file.filename)
+        header = read_table_header(file_path, delimiter)
+        # index and meta columns saved next to the file by an earlier session
+        saved = {}
+        if os.path.exists(f"{file_path}.json"):
+            try:
+                with open(f"{file_path}.json", "rt") as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                pass
+        if get_current_worker().is_cancelled:
+            return
+        search = self.app.call_from_thread(self.show_columns, tab, file, header, saved)
+        if search is not None:
+            self.show_index_column(tab, file, saved["index_column"], search)
+
+    def show_columns(self, tab: str, file: ProjectFile, header: pd.DataFrame, saved: dict = None) -> str | None:
+        """Fill the column pickers of a tab, return the index value search text if a saved index column was selected"""
+        self.project_loaded_file_dict[tab] = file
+        self.project_header_dict[tab] = header
+        self.project_df_dict[tab] = None
+        self.project_index_dict[tab] = None
+        self.selected_index_value_dict.pop(tab, None)
+        index_selection = self.query_one(f"#{tab}-index-column-selection", Select)
+        index_selection.set_options([(i, i) for i in header.columns])
+        saved = saved or {}
+        if tab != "differential_analysis":
+            additional_meta_index_columns = self.query_one(f"#{tab}-additional-meta-index-columns", SelectionList)
+            additional_meta_index_columns.clear_options()
+            additional_meta_index_columns.add_options([Selection(i, i) for i in header.columns])
+            for column in saved.get("meta_data_columns", []):
+                if column in header.columns:
+                    additional_meta_index_columns.select(column)
+            sample_columns = self.query_one(f"#{tab}-sample-columns", SelectionList)
+            sample_columns.clear_options()
+            sample_columns.add_options([Selection(i, i) for i in header.columns])
+        self.notify("Loaded " + file.filename)
+        if saved.get("index_column") in header.columns:
+            # setting the value does not post Select.Changed so the caller reads the index values
+            index_selection.value = saved["index_column"]
+            return self.query_one(f"#{tab}-index-value-search", Input).value
+        return None
+
+    @work(thread=True, exclusive=True, group="table", name="Plotting", exit_on_error=False)
+    def plot_index_value(self, tab: str, file: ProjectFile, index_column: str, meta_columns: list[str], samples: list[str],
+                         index_value: str, plot: Barchart):
+        """Load the chosen columns off the event loop and draw the sample values of one index value.
+        Widgets are resolved on the event loop and only updated through call_from_thread"""
+        self.post_message(WorkerProgress("Loading columns", 0, len(samples) + len(meta_columns) + 1))
+        df = self.load_columns(tab, file, [index_column] + meta_columns + samples)
+        index = self.get_table_index(tab, file, index_column)
+        position = index.get(index_value)
+        if position is None:
+            self.app.call_from_thread(self.notify, f"{index_value} not found in {index_column}", severity="warning")
+            return
+        data = list(df.iloc[position, df.columns.get_indexer(samples)].fillna(0).astype(float).values)
+        if get_current_worker().is_cancelled:
+            return
+        self.app.call_from_thread(plot.draw, samples, data)
+        self.app.call_from_thread(plot.set_title, "Data distribution for " + index_value)
+
     @on(Select.Changed)
     async def index_column_selected(self, event: Select.Changed):
         if event.select.id is not None:
             if event.select.id.endswith("index-column-selection"):
-                index_value_selection = self.query_one(f"#{self.current_tab}-index-value-selection", Select)
-                index_value_selection.set_options([(i, i) for i in self.project_df_dict[self.current_tab][event.select.value]])
-            else:
-                self.selected_index_value_dict[self.current_tab] = event.select.value
+                if event.value == Select.BLANK:
+                    return
+                search = self.query_one(f"#{self.current_tab}-index-value-search", Input).value
+                self.read_index_values(self.current_tab, self.project_loaded_file_dict[self.current_tab], event.value,
+                                       search)
+
+    @work(thread=True, exclusive=True, group="table", name="Loading index column", exit_on_error=False)
+    def read_index_values(self, tab: str, file: ProjectFile, index_column: str, search: str = ""):
+        """Load the index column and build its hash index off the event loop, then fill the index value picker of a tab
+        with the values matching the search text read on the event loop"""
+        self.show_index_column(tab, file, index_column, search)
+
+    def show_index_column(self, tab: str, file: ProjectFile, index_column: str, search: str):
+        """Build the hash index of an index column in the current worker thread and show the matching values"""
+        self.post_message(WorkerProgress(f"Reading index column {index_column}"))
+        index = self.get_table_index(tab, file, index_column)
+        if get_current_worker().is_cancelled:
+            return
+        self.app.call_from_thread(self.show_index_values, tab, index.search(search))
+
+    def get_table_index(self, tab: str, file: ProjectFile, index_column: str) -> TableIndex:
+        """Return the hash index of the index column of a file shown in a tab, building it once per column"""
+        index = self.project_index_dict.get(tab) if self.project_loaded_file_dict.get(tab) == file else None
+        if index is None or index.column != index_column:
+            index = TableIndex(self.load_columns(tab, file, [index_column])[index_column])
+            if not get_current_worker().is_cancelled:
+                self.app.call_from_thread(self.store_index, tab, file, index)
+        return index
+
+    def store_index(self, tab: str, file: ProjectFile, index: TableIndex):
+        """Keep the index built by a worker for a tab if the tab still shows the file it was built from"""
+        if self.project_loaded_file_dict.get(tab) == file:
+            self.project_index_dict[tab] = index
+
+    def show_index_values(self, tab: str, values: list[str]):
+        index_value_selection = self.query_one(f"#{tab}-index-value-selection", OptionList)
+        index_value_selection.clear_options()
+        index_value_selection.add_options([Option(i) for i in values])
+
+    @on(Input.Changed)
+    async def search_index_values(self, event: Input.Changed):
+        if event.input.id == f"{self.current_tab}-index-value-search":
+            index = self.project_index_dict.get(self.current_tab)
+            if index is not None:
+                self.show_index_values(self.current_tab, index.search(event.value))
 
+    @on(OptionList.OptionSelected)
+    async def index_value_selected(self, event: OptionList.OptionSelected):
+        if event.option_list.id == f"{self.current_tab}-index-value-selection":
+            self.selected_index_value_dict[self.current_tab] = str(event.option.prompt)
+
+    def refresh_progress(self, worker: Worker):
+        """Return a Project.refresh progress callback that reports to this screen and stops hashing once the worker is cancelled"""
+        def progress(done: int, total: int):
+            if worker.is_cancelled:
+                raise WorkerCancelled("Refresh cancelled")
+            self.post_message(WorkerProgress("Hashing project files", done, total))
+        return progress
+
+    def on_worker_progress(self, message: WorkerProgress):
+        self.app.sub_title = message.text
+
+    def on_worker_state_changed(self, event: Worker.StateChanged):
+        if event.state not in (WorkerState.SUCCESS, WorkerState.ERROR, WorkerState.CANCELLED):
+            return
+        if not any(w.is_running for w in self.workers if w.node is self):
+            self.app.sub_title = ""
+        if event.state == WorkerState.ERROR:
+            self.notify(f"{event.worker.name} failed: {event.worker.error}", severity="error")
+        elif event.state == WorkerState.CANCELLED:
+            self.notify(f"{event.worker.name} cancelled", severity="warning")
+
+    def action_cancel_workers(self):
+        self.workers.cancel_node(self)
 
     @on(SelectionList.OptionSelected, "#additional-meta-index-columns")
     async def additional_meta_index_columns_selected(self, event):
         if self.project_df_dict["unprocessed"] is not None:
             self.meta_data_columns = event
 
-    @on(Select.Changed, "#searched-index-column-selection")
-    async def searched_index_column_selected(self, event):
-        if self.project_df_dict["searched"] is not None:
-            self.notify(f"Selected {event.value} as index column")
-            markdown = self.query_one("#searched-file-markdown", Markdown)
-            markdown_text = f"""# {self.project_selected_file_dict["searched"].filename}
-- rows: {self.project_df_dict["searched"].shape[0]}
-- columns: {self.project_df_dict["searched"].shape[1]}
-- index column: {event.value}
-                    """
-            await markdown.update(markdown_text)
-
-    @on(Select.Changed, "#differential-analysis-index-column-selection")
-    async def differential_analysis_index_column_selected(self, event):
-        if self.project_df_dict["differential_analysis"] is not None:
-            self.notify(f"Selected {event.value} as index column")
-            markdown = self.query_one("#differential-analysis-file-markdown", Markdown)
-            markdown_text = f"""# {self.project_selected_file_dict["differential_analysis"].filename}
-- rows: {self.project_df_dict["differential_analysis"].shape[0]}
-- columns: {self.project_df_dict["differential_analysis"].shape[1]}
-- index column: {event.value}
-                        """
-            await markdown.update(markdown_text)
-
-    @on(OptionList.OptionSelected, "#differential-analysis-file-selection")
-    async def differential_analysis_file_selected(self, event: OptionList.OptionSelected):
-        self.project_selected_file_dict["differential_analysis"] = self.app.data.project_files["differential_analysis"][int(event.option.id)]
-        self.project_df_dict["differential_analysis"] = pd.read_csv(
-            os.path.join(
-                self.app.data.project_data_path,
-                *self.project_selected_file_dict["differential_analysis"].path,
-                self.project_selected_file_dict["differential_analysis"].filename),
-            sep=detect_delimiter_from_extension(self.project_selected_file_dict["differential_analysis"].filename)
-        )
-        index_selection = self.query_one("#differential-analysis-index-column-selection", Select)
-        index_selection.set_options([(i, i) for i in self.project_df_dict["differential_analysis"].columns])
-        additional_meta_index_columns = self.query_one("#searched-additional-meta-index-columns", SelectionList)
-        additional_meta_index_columns.clear_options()
-        additional_meta_index_columns.add_options([Selection(i, i) for i in self.project_df_dict["differential_analysis"].columns])
-        json_path = [self.app.data.project_data_path] + list(self.project_selected_file_dict["differential_analysis"].path) + [
-            self.project_selected_file_dict["differential_analysis"].filename + ".json"]
-        json_path = os.path.join(*json_path)
-        if os.path.exists(json_path):
-            with open(json_path, "r") as f:
-                settings = json.load(f)
-                index_column = settings["index_column"]
-                index_selection.value = index_column
-                meta_data_columns = settings["meta_data_columns"]
-                for i in meta_data_columns:
-                    additional_meta_index_columns.select(i)
-
-        markdown = self.query_one("#differential-analysis-file-markdown", Markdown)
-        markdown_text = f"""# {event.option.prompt}
-- rows: {self.project_df_dict["searched"].shape[0]}
-- columns: {self.project_df_dict["searched"].shape[1]}
-            """
-        await markdown.update(markdown_text)
-        markdown.refresh()
-        self.notify(f"Selected {event.option.prompt}")
-
-    @on(OptionList.OptionSelected, "#searched-file-selection")
-    async def searched_file_selected(self, event: OptionList.OptionSelected):
-        self.project_selected_file_dict["searched"] = self.app.data.project_files["searched"][int(event.option.id)]
-        self.project_df_dict["searched"] = pd.read_csv(
-            os.path.join(
-                self.app.data.project_data_path,
-                *self.project_selected_file_dict["searched"].path,
-                self.project_selected_file_dict["searched"].filename),
-            sep=detect_delimiter_from_extension(self.project_selected_file_dict["searched"].filename)
-        )
-        index_selection = self.query_one("#searched-index-column-selection", Select)
-        index_selection.set_options([(i, i) for i in self.project_df_dict["searched"].columns])
-        additional_meta_index_columns = self.query_one("#searched-additional-meta-index-columns", SelectionList)
-        additional_meta_index_columns.clear_options()
-        additional_meta_index_columns.add_options([Selection(i, i) for i in self.project_df_dict["searched"].columns])
-        json_path = [self.app.data.project_data_path] + list(self.project_selected_file_dict["searched"].path) + [self.project_selected_file_dict["searched"].filename + ".json"]
-        json_path = os.path.join(*json_path)
-        if os.path.exists(json_path):
-            with open(json_path, "r") as f:
-                settings = json.load(f)
-                index_column = settings["index_column"]
-                index_selection.value = index_column
-                meta_data_columns = settings["meta_data_columns"]
-                for i in meta_data_columns:
-                    additional_meta_index_columns.select(i)
-
-
-        markdown = self.query_one("#searched-file-markdown", Markdown)
-        markdown_text = f"""# {event.option.prompt}
-- rows: {self.project_df_dict["searched"].shape[0]}
-- columns: {self.project_df_dict["searched"].shape[1]}
-        """
-        await markdown.update(markdown_text)
-        markdown.refresh()
-        self.notify(f"Selected {event.option.prompt}")
-
-    @on(OptionList.OptionSelected, "#sample-annotation-file-selection")
-    async def sample_annotation_file_selected(self, event):
-        self.project_selected_file_dict["sample_annotation"] = self.app.data.project_files["sample_annotation"][int(event.option.id)]
-        self.project_df_dict["sample_annotation"] = pd.read_csv(
-            os.path.join(
-                self.app.data.project_data_path,
-                os.sep.join(self.project_selected_file_dict["sample_annotation"].path),
-                self.project_selected_file_dict["sample_annotation"].filename),
-            sep=detect_delimiter_from_extension(self.project_selected_file_dict["sample_annotation"].filename)
-        )
-        markdown = self.query_one("#sample-annotation-file-markdown", Markdown)
-        markdown_text = f"""# {event.option.prompt}
-- unique groups: {len(self.project_df_dict["sample_annotation"]["condition"].unique())}
-- samples: {len(self.project_df_dict["sample_annotation"]["sample"].unique())}
-        """
-        await markdown.update(markdown_text)
-        self.notify(f"Selected {event.option.prompt}")
-
-    @on(OptionList.OptionSelected, "#comparison-matrix-file-selection")
-    async def comparison_matrix_file_selected(self, event):
-        self.project_selected_file_dict["comparison_matrix"] = self.app.data.project_files["comparison_matrix"][int(event.option.id)]
-        self.project_df_dict["comparison_matrix"] = pd.read_csv(
-            os.path.join(
-                self.app.data.project_data_path,
-                os.sep.join(self.project_selected_file_dict["comparison_matrix"].path),
-                self.project_selected_file_dict["comparison_matrix"].filename),
-            sep=detect_delimiter_from_extension(self.project_selected_file_dict["comparison_matrix"].filename)
-        )
-        markdown = self.query_one("#comparison-matrix-file-markdown", Markdown)
-        markdown_text = f"""# {event.option.prompt}
-- comparisons: {len(self.project_df_dict["comparison_matrix"]["comparison_label"].unique())}
-        """
-        await markdown.update(markdown_text)
-        self.notify(f"Selected {event.option.prompt}")
-
     @on(Button.Pressed, "#add-unprocessed-file")
     async def add_unprocessed_file(self, event):
         await self.query_one("#unprocessed-file-scroll", VerticalScroll).mount(Input(value="", classes="small-input"))
         self.notify("Added unprocessed file")
 
+    async def action_jobs(self):
+        await self.app.push_screen(JobScreen())
+
     async def action_refresh(self):
-        self.app.data.refresh()
-        self.notify("Refreshed project data")
-        # update the unprocessed file list widget, sample annotation file list widget, and comparison matrix file list widget
-        searched = self.query_one("#searched-file-selection", OptionList)
-        searched.clear_options()
-        searched.add_options([Option(i[1].filename, id=str(i[0])) for i in enumerate(self.app.data.project_files["searched"])])
-        unprocessed = self.query_one("#unprocessed-file-selection", OptionList)
-        unprocessed.clear_options()
-        unprocessed.add_options([Option(i[1].filename, id=str(i[0])) for i in enumerate(self.app.data.project_files["unprocessed"])])
-        sample_annotation = self.query_one("#sample-annotation-file-selection", OptionList)
-        sample_annotation.clear_options()
-        sample_annotation.add_options([Option(i[1].filename, id=str(i[0])) for i in enumerate(self.app.data.project_files["sample_annotation"])])
-        comparison_matrix = self.query_one("#comparison-matrix-file-selection", OptionList)
-        comparison_matrix.clear_options()
-        comparison_matrix.add_options([Option(i[1].filename, id=str(i[0])) for i in enumerate(self.app.data.project_files["comparison_matrix"])])
-        differential_analysis = self.query_one("#differential-analysis-file-selection", OptionList)
-        differential_analysis.clear_options()
-        differential_analysis.add_options([Option(i[1].filename, id=str(i[0])) for i in enumerate(self.app.data.project_files["differential_analysis"])])
+        self.refresh_project()
+
+    @work(thread=True, exclusive=True, group="project", name="Refreshing project", exit_on_error=False)
+    def refresh_project(self):
+        """Rescan and hash the project files off the event loop"""
+        self.app.data.refresh(self.app.db, self.refresh_progress(get_current_worker()))
+        self.app.call_from_thread(self.update_file_lists)
+        self.app.call_from_thread(
+            self.notify,
+            f"Refreshed project data ({self.app.data.hash_cache_hits} cached, {self.app.data.hash_cache_misses} hashed)")
+
+    def update_file_lists(self):
+        """Update the file list widgets of the tabs that have been opened"""
+        for cat in self.app.data.project_files:
+            for file_list in self.query(f"#{cat}-file-selection").results(OptionList):
+                file_list.clear_options()
+                file_list.add_options([Option(i[1].filename, id=str(i[0])) for i in enumerate(self.app.data.project_files[cat])
+                                       if not i[1].filename.endswith(".json")])
 
     async def action_save(self):
-        # save the project data to the project.json file
-        self.app.data.refresh()
+        self.save_project()
+
+    @work(exclusive=True, group="project", name="Saving project", exit_on_error=False)
+    async def save_project(self):
+        await self.write_project()
+        self.notify("Saved project data")
+
+    async def write_project(self):
+        """Refresh the project in a thread and save it to the local database and project.json"""
+        await asyncio.to_thread(self.app.data.refresh, None, self.refresh_progress(get_current_worker()))
         with open(os.path.join(self.app.data.project_path, "project.sha1"), "rt") as f:
             sha1 = f.read()
         if self.app.data.project_id == 0:
@@ -507,29 +559,34 @@ class ProjectScreen(BaseScreen):
             self.app.data.project_global_id = result["global_id"]
         else:
             self.app.db.update_project(project_id=self.app.data.project_id, name=self.app.data.project_name, description=self.app.data.description, location=self.app.data.project_path, hash=sha1)
+        self.app.db.sync_project_files(self.app.data.project_id, self.app.data.get_catalog_files())
 
-        with open(os.path.join(self.app.data.project_path, "project.json"), "w") as f:
+        with atomic_write(os.path.join(self.app.data.project_path, "project.json")) as f:
             json.dump(self.app.data.to_dict(), f, indent=2)
         if self.project_selected_file_dict["unprocessed"] is not None:
-            with open(
-                    os.path.join(self.app.data.project_data_path, "unprocessed", f"{self.project_selected_file_dict['unprocessed'].filename}.json"),
-                    "w") as f:
+            with atomic_write(
+                    os.path.join(self.app.data.project_data_path, "unprocessed", f"{self.project_selected_file_dict['unprocessed'].filename}.json")) as f:
                 json.dump({"index_column": self.index_column, "meta_data_columns": self.meta_data_columns}, f)
-        self.notify("Saved project data")
 
     async def action_save_to_server(self):
-        await self.action_save()
+        self.save_to_server()
+
+    @work(exclusive=True, group="project", name="Saving to server", exit_on_error=False)
+    async def save_to_server(self):
+        await self.write_project()
         host = f"{self.app.config['central_rest_api']['protocol']}://{self.app.config['central_rest_api']['host']}:{self.app.config['central_rest_api']['port']}"
-        corpus = CorpusServer(host, self.app.config["central_rest_api"]["api_key"], self.app.db)
-        if self.app.data.remote_id:
+        async with CorpusServer(host, self.app.config["central_rest_api"]["api_key"], self.app.db) as corpus:
+            remote_category_hashes = None
+            if self.app.data.remote_id:
+                # subtree hashes of the last completed sync, read before the metadata is overwritten
+                remote_category_hashes = (await corpus.get_project(self.app.data.remote_id)).category_hashes
+                await corpus.update_project(self.app.data)
+            else:
+                await corpus.create_project(self.app.data)
+            async for file in corpus.upload_file(self.app.data, remote_category_hashes):
+                self.post_message(WorkerProgress(f"Uploaded {file.filename}"))
+            await self.write_project()
             await corpus.update_project(self.app.data)
-        else:
-            await corpus.create_project(self.app.data)
-        async for file in corpus.upload_file(self.app.data):
-            self.notify(f"Uploaded {file.filename}")
-        self.app.data.refresh()
-        await self.action_save()
-        await corpus.update_project(self.app.data)
 
         self.notify("Saved project data to server")
 
@@ -591,7 +648,8 @@ def manage_project(project_name: str):
                 project = Project(**project_dict)
         else:
             raise FileNotFoundError("No project.json file found")
-    project.refresh()
+    db = load_local_db()
+    project.refresh(db)
     app = CinderProject()
     app.data = project
 
@@ -599,5 +657,5 @@ def manage_project(project_name: str):
     app.config_dir = app_dir
     app.config = settings
 
-    app.db = ProjectDatabase(os.path.join(app_dir.user_config_dir, "data_manager.db"))
+    app.db = db
     app.run()
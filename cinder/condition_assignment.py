@@ -6,6 +6,8 @@ from textual.app import ComposeResult
 from textual.containers import VerticalScroll, Horizontal, Vertical, Container
 from textual.widgets import Input, Static, Label, OptionList
 
+from cinder.utility import condition_from_sample_name
+
 
 class ConditionAssignment(VerticalScroll):
     CSS_PATH = "condition_assignment.tcss"
@@ -29,11 +31,7 @@ class ConditionAssignment(VerticalScroll):
 
     async def add_sample(self, samples: List[str]):
         for sample in samples:
-            cond = sample.split(".")
-            if len(cond) > 1:
-                condition = ".".join(cond[:-1])
-            else:
-                condition = cond[0]
+            condition = condition_from_sample_name(sample)
             if sample not in self.sample_dict:
                 self.sample_dict[sample] = {"name": sample, "group": condition, "option-text": f"{sample} ({condition})"}
 
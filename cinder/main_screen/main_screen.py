@@ -11,7 +11,7 @@ from cinder.base_screen import BaseScreen
 from appdirs import AppDirs
 import sqlite3
 
-from cinder.utils.common import ProjectDatabase
+from cinder.utils.common import load_local_db
 
 
 class MainScreen(BaseScreen):
@@ -61,7 +61,7 @@ class MainScreen(BaseScreen):
             with open(os.path.join(self.app.config_dir.user_config_dir, "data_manager_config.json"), "w") as f:
                 json.dump(self.app.config, f)
 
-        self.app.db = ProjectDatabase(os.path.join(self.app.config_dir.user_config_dir, "data_manager.db"))
+        self.app.db = load_local_db()
 
     @on(Button.Pressed, "#go-to-upload-raw")
     async def go_to_upload_raw(self, event):
@@ -0,0 +1,19 @@
+import click
+
+from cinder.utils.common import load_settings, load_blob_store
+
+
+@click.command()
+@click.option("-n", "--dry-run", is_flag=True, help="Only report blobs that would be removed")
+def main(dry_run):
+    """Remove blobs of the shared project data store that are no longer linked from any project"""
+    settings = load_settings()
+    blob_store = load_blob_store(settings)
+    if blob_store is None:
+        print("Blob store is not enabled")
+        return
+    removed, reclaimed = blob_store.garbage_collect(dry_run=dry_run)
+    if dry_run:
+        print(f"{removed} unreferenced blobs ({reclaimed} bytes) would be removed")
+    else:
+        print(f"Removed {removed} unreferenced blobs ({reclaimed} bytes)")
@@ -3,11 +3,58 @@ import os
 
 import click
 
-from cinder.utils.common import load_local_db, load_settings, ProjectFile, CorpusServer
+from cinder.utils.blob_store import atomic_write
+from cinder.utils.common import load_local_db, load_settings, ProjectFile, CorpusServer, load_project
+from cinder.utils.hash_index import LocalHashIndex
 import asyncio
 import requests
-db = load_local_db()
 settings = load_settings()
+
+
+async def download_project(corpus: CorpusServer, project_id: int, output_path: str = None, jobs: int = None):
+    """Fetch a remote project and download its files concurrently on a single event loop"""
+    project = await corpus.get_project(project_id)
+    if output_path:
+        project.project_path = output_path
+    else:
+
+        project.project_path = os.path.join(os.getcwd(), project.project_name)
+
+    os.makedirs(project.project_path, exist_ok=True)
+    os.makedirs(os.path.join(project.project_path, "data"), exist_ok=True)
+
+    project.project_data_path = os.path.join(project.project_path, "data")
+    file_list = await corpus.get_project_files(project.remote_id)
+    file_list = file_list.json()
+    temp = {}
+    for file in file_list:
+        if file["file_category"] not in temp:
+            temp[file["file_category"]] = []
+        f = ProjectFile(filename=file["name"], path=file["path"], sha1=file["hash"], remote_id=file["id"])
+        temp[file["file_category"]].append(f)
+    project.project_files = temp
+    local_category_hashes = {}
+    if os.path.exists(os.path.join(project.project_path, "project.json")):
+        local_project = load_project(project.project_path)
+        local_project.project_path = project.project_path
+        local_project.project_data_path = project.project_data_path
+        # the hashes saved in project.json can be older than the files on disk, the hash cache keeps this cheap
+        await asyncio.to_thread(local_project.refresh)
+        local_category_hashes = local_project.category_hashes
+        if corpus.hash_index is not None:
+            corpus.hash_index.add_project(local_project.project_path, local_project.project_data_path)
+    categories = []
+    for i in project.project_files:
+        os.makedirs(os.path.join(project.project_data_path, i), exist_ok=True)
+        if i in project.category_hashes and local_category_hashes.get(i) == project.category_hashes[i]:
+            print(f"Skipping unchanged category {i}")
+            continue
+        categories.append(i)
+    async for file in corpus.download_files(project, categories, jobs):
+        print(f"Downloaded {file.filename}")
+    return project
+
+
 @click.command()
 @click.option("-p", "--project-id", type=int, help="Remote Project ID", required=True)
 @click.option("--hostname", type=str, help="Remote Server Hostname", required=False)
@@ -15,7 +62,8 @@ settings = load_settings()
 @click.option("--protocol", type=str, help="Remote Server Protocol", required=False)
 @click.option("-a", "--api-key", type=str, help="Authentication API Key", required=False)
 @click.option("-o", "--output-path", type=str, help="Project Location Path", required=False)
-def main(project_id, hostname, port, protocol, api_key, output_path):
+@click.option("-j", "--jobs", type=int, help="Number of files downloaded concurrently", required=False)
+def main(project_id, hostname, port, protocol, api_key, output_path, jobs):
     print(settings)
     print(project_id, hostname, port, protocol, api_key, output_path)
     if api_key:
@@ -27,39 +75,22 @@ def main(project_id, hostname, port, protocol, api_key, output_path):
     if protocol:
         settings["central_rest_api"]["protocol"] = protocol
     base_url = f"{settings['central_rest_api']['protocol']}://{settings['central_rest_api']['host']}:{settings['central_rest_api']['port']}"
+    db = load_local_db()
 
-    corpus = CorpusServer(base_url, settings["central_rest_api"]["api_key"], db)
-    project = asyncio.run(corpus.get_project(project_id))
-    if output_path:
-        project.project_path = output_path
-    else:
-
-        project.project_path = os.path.join(os.getcwd(), project.project_name)
+    corpus = CorpusServer(base_url, settings["central_rest_api"]["api_key"], db, concurrency=jobs,
+                          hash_index=LocalHashIndex.from_database(db))
 
-    os.makedirs(project.project_name, exist_ok=True)
-    os.makedirs(os.path.join(project.project_name, "data"), exist_ok=True)
+    async def run():
+        async with corpus:
+            return await download_project(corpus, project_id, output_path, jobs)
 
-    project.project_data_path = os.path.join(project.project_path, "data")
-    file_list = asyncio.run(corpus.get_project_files(project.remote_id))
-    file_list = file_list.json()
-    temp = {}
-    for file in file_list:
-        if file["file_category"] not in temp:
-            temp[file["file_category"]] = []
-        f = ProjectFile(filename=file["name"], path=file["path"], sha1=file["hash"], remote_id=file["id"])
-        temp[file["file_category"]].append(f)
-    project.project_files = temp
-    for i in project.project_files:
-        os.makedirs(os.path.join(project.project_data_path, i), exist_ok=True)
-        file_list = project.project_files[i]
-        for file in file_list:
-            asyncio.run(corpus.download_file(file, project))
-    with open(os.path.join(project.project_path, "project.json"), "w") as f:
+    project = asyncio.run(run())
+    with atomic_write(os.path.join(project.project_path, "project.json")) as f:
         json.dump(project.to_dict(), f, indent=2)
     project.refresh()
     created = db.create_project(project.project_name, project.description, project.project_path,
                                 project.get_project_hash())
     db.update_remote_id(project_id, created["id"])
-    project.id = created["id"]
+    project.project_id = created["id"]
     project.project_global_id = created["global_id"]
-    project.refresh()
+    project.refresh(db)
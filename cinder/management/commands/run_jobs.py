@@ -0,0 +1,48 @@
+import time
+
+import click
+
+from cinder.utils.common import load_settings, load_local_db, load_project
+from cinder.utils.jobs import JobScheduler
+
+
+@click.command()
+@click.option("-l", "--list", "list_jobs", is_flag=True, help="Only list the jobs and their status")
+@click.option("-c", "--cancel", "cancel", type=int, multiple=True, help="Cancel a job by id")
+@click.option("-s", "--stale", "stale", type=click.Path(exists=True, file_okay=False),
+              help="Only report the differential analysis outputs of a project folder whose inputs changed")
+@click.option("--no-cache", is_flag=True, help="Run every job even if a result of the same inputs and parameters exists")
+@click.option("-p", "--pull", is_flag=True, help="Only pull the configured coral image and print the digest it is pinned to")
+def main(list_jobs, cancel, stale, no_cache, pull):
+    """Run the queued differential analysis jobs until the queue is empty, jobs left running by an earlier session are reattached"""
+    db = load_local_db()
+    if stale:
+        outputs = load_project(stale).stale_analyses()
+        for output in outputs:
+            reasons = [f"changed {f}" for f in output.changed] + [f"missing {f}" for f in output.missing]
+            print(f"{output.output_file}\t{', '.join(reasons)}")
+        print(f"{len(outputs)} stale outputs")
+        return
+    if list_jobs:
+        for job in db.get_jobs():
+            print(f"{job.job_id}\t{job.status}\t{job.analysis.unprocessed_file}\t{job.analysis.comparison_matrix_file}\t{job.error}")
+        return
+    scheduler = JobScheduler.from_settings(
+        db, load_settings(), use_cache=not no_cache,
+        on_update=lambda job: print(f"job {job.job_id} {job.status} {job.error}".rstrip()))
+    if pull:
+        scheduler.prepare()
+        for image in scheduler.images:
+            print(f"{image}\t{scheduler.pinned.get(image, 'not pulled')}")
+        return
+    for job_id in cancel:
+        scheduler.cancel(job_id)
+    if cancel:
+        return
+    scheduler.start()
+    try:
+        while not scheduler.idle():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopped, running containers keep running and are reattached by the next run")
+    scheduler.stop(close_pool=True)
@@ -0,0 +1,67 @@
+import os
+
+import click
+import pandas as pd
+
+from cinder.utils.common import load_settings, load_local_db, load_project
+from cinder.utils.differential_analysis import CORAL_IMAGE, DifferentialAnalysis
+from cinder.utils.jobs import JobScheduler
+from cinder.utils.sweep import parse_grid, submit_sweep, summarize_sweep, wait_for_jobs
+
+
+@click.command()
+@click.argument("project_folder", type=click.Path(exists=True, file_okay=False))
+@click.option("-u", "--unprocessed", required=True, help="Unprocessed file in the unprocessed folder")
+@click.option("-a", "--annotation", required=True, help="Sample annotation file in the sample_annotation folder")
+@click.option("-c", "--comparison-matrix", required=True, help="Comparison matrix file in the comparison_matrix folder")
+@click.option("-x", "--index-cols", required=True, help="Index columns of the unprocessed file")
+@click.option("-g", "--grid", "grid_items", multiple=True, required=True,
+              help="Swept parameter and its values, e.g. imputation_method=knn,min or column_na_filter_threshold=0.5,0.7")
+@click.option("-o", "--output", default="", help="Base name of the outputs, by default the unprocessed file and comparison matrix")
+@click.option("--p-value", default=0.05, show_default=True, help="Adjusted p-value cutoff of a significant hit")
+@click.option("--log2-fold-change", default=1.0, show_default=True, help="Absolute log2 fold change cutoff of a significant hit")
+@click.option("-s", "--summary", "summary_path", default="", help="Summary table path, by default next to the outputs")
+def main(project_folder, unprocessed, annotation, comparison_matrix, index_cols, grid_items, output, p_value,
+         log2_fold_change, summary_path):
+    """Run a differential analysis for every combination of a parameter grid in parallel and summarize the significant hits per setting"""
+    try:
+        grid = parse_grid(list(grid_items))
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--grid")
+    project = load_project(project_folder)
+    settings = load_settings()
+    job_settings = settings.get("jobs", {})
+    base = DifferentialAnalysis(
+        unprocessed_file=unprocessed, annotation_file=annotation, comparison_matrix_file=comparison_matrix,
+        output_file=output or f"{os.path.splitext(unprocessed)[0]}_{os.path.splitext(comparison_matrix)[0]}",
+        index_cols=index_cols)
+    db = load_local_db()
+    # jobs queued by the app or cinder-jobs are left to them
+    scheduler = JobScheduler.from_settings(db, settings, own_jobs_only=True)
+    jobs = submit_sweep(scheduler, project, base, grid, cpus=job_settings.get("cpus", 2),
+                        memory=job_settings.get("memory", 4096),
+                        docker_image=job_settings.get("docker_image", CORAL_IMAGE))
+    print(f"Queued {len(jobs)} combinations")
+    scheduler.start()
+    reported = {}
+
+    def report(current):
+        for job in current:
+            if reported.get(job.job_id) != job.status:
+                reported[job.job_id] = job.status
+                print(f"{job.analysis.output_file}\t{job.status}\t{job.error}".rstrip())
+
+    try:
+        jobs = wait_for_jobs(db, [j.job_id for j in jobs], on_poll=report)
+    except KeyboardInterrupt:
+        print("Stopped, running containers keep running and are reattached by cinder-jobs")
+        scheduler.stop()
+        return
+    scheduler.stop(close_pool=True)
+    summary = summarize_sweep(jobs, grid, p_value=p_value, log2_fold_change=log2_fold_change)
+    if not summary_path:
+        summary_path = os.path.join(project.project_data_path, "differential_analysis", f"{base.output_file}__sweep.tsv")
+    summary.to_csv(summary_path, sep="\t")
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(summary)
+    print(f"Summary written to {summary_path}")
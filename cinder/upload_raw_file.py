@@ -1,20 +1,29 @@
+import asyncio
 import json
-import tempfile
 from typing import Type
 
 import httpx
-from textual import on
+import openai
+from textual import on, work
 from textual.app import ComposeResult
 from textual.binding import Binding
 from textual.screen import Screen, ModalScreen, ScreenResultType
+from textual.worker import Worker, WorkerState, get_current_worker
 from textual.widgets import Footer, Header, Input, Markdown, Button, Static, SelectionList, Label, OptionList, Select, \
-    LoadingIndicator
+    LoadingIndicator, DataTable
 from textual.containers import Vertical, Horizontal, VerticalScroll, Container, Grid
 import logging
 import pandas as pd
 
 from cinder.cindergpt.gpt import gpt_get_index, gpt_index_with_json
+from cinder.cindergpt.heuristics import detect_sample_columns
 from cinder.condition_assignment import ConditionAssignment
+from cinder.util_screen.worker_progress import WorkerProgress
+from cinder.utils.batch_import import BatchItem, ImportTemplate, load_templates, parse_headers, save_template, \
+    scan_tables, submit_batch
+from cinder.utils.common import CorpusServer, app_dir, load_settings
+from cinder.utils.streaming import TableSource
+from cinder.utils.table_cache import read_table_header, read_table_columns
 import os
 
 
@@ -22,23 +31,33 @@ host = os.environ.get("CLAVICLE_HOST", "localhost")
 port = os.environ.get("CLAVICLE_PORT", "8000")
 protocol = os.environ.get("CLAVICLE_PROTOCOL", "http")
 
+TEMPLATES_PATH = os.path.join(app_dir.user_config_dir, "import_templates.json")
 
-class FolderWalk(ModalScreen[str]):
+
+class FolderWalk(ModalScreen[dict]):
     def compose(self) -> ComposeResult:
         yield Grid(
             Input(placeholder="Folder path", id="folder-path-input"),
+            Select([], id="template-selection", prompt="Import template"),
             Button("Cancel", id="cancel-modal-button", variant="error"),
             Button("Load", id="load-modal-button", variant="primary"),
             id="folder-input-section"
         )
 
+    def on_screen_resume(self) -> None:
+        # templates saved since the screen was last shown
+        self.query_one("#template-selection", Select).set_options(
+            [(name, name) for name in load_templates(TEMPLATES_PATH)])
+
     @on(Button.Pressed, "#cancel-modal-button")
     async def cancel(self, event: Button.Pressed):
-        self.dismiss("")
+        self.dismiss({})
 
     @on(Button.Pressed, "#load-modal-button")
     async def load(self, event: Button.Pressed):
-        self.dismiss(self.query_one("#folder-path-input", Input).value)
+        template = self.query_one("#template-selection", Select).value
+        self.dismiss({"folder": self.query_one("#folder-path-input", Input).value.replace('"', ""),
+                      "template": None if template == Select.BLANK else template})
 
 
 class FolderWalkOneByOne(ModalScreen):
@@ -50,12 +69,78 @@ class FolderWalkOneByOne(ModalScreen):
             id="folder-input-section"
         )
 
+class BatchImportScreen(Screen):
+    """Import every table of a folder with a saved template, showing the state of each file in a table"""
+    BINDINGS = [
+        Binding(key="escape", action="cancel_import", description="Cancel import"),
+        Binding(key="ctrl+t", action="back", description="Back to upload screen"),
+    ]
+
+    def __init__(self, folder: str, template: ImportTemplate, **kwargs):
+        super().__init__(**kwargs)
+        self.folder = folder
+        self.template = template
+        self.items: list[BatchItem] = []
+
+    def compose(self) -> ComposeResult:
+        yield Header(True, name="Cinder")
+        yield Label(f"Importing {self.folder} with template {self.template.name}", id="batch-import-label")
+        yield DataTable(id="batch-import-table")
+        yield Footer()
+
+    def on_mount(self) -> None:
+        self.styles.background = "darkred"
+        self.styles.border = ("heavy", "white")
+        table = self.query_one("#batch-import-table", DataTable)
+        for column in ["File", "Status", "Index", "Samples", "Progress", "Error"]:
+            table.add_column(column, key=column.lower())
+        self.run_import()
+
+    def update_item(self, item: BatchItem):
+        table = self.query_one("#batch-import-table", DataTable)
+        progress = f"{item.sent * 100 // item.total}%" if item.total else ""
+        for column, value in [("status", item.status), ("index", item.index_col), ("samples", len(item.sample_cols)),
+                              ("progress", progress), ("error", item.error)]:
+            table.update_cell(item.file_path, column, value)
+
+    @work(exclusive=True, group="batch-import", name="Batch import", exit_on_error=False)
+    async def run_import(self):
+        files = await asyncio.to_thread(scan_tables, self.folder)
+        table = self.query_one("#batch-import-table", DataTable)
+        self.items = [BatchItem(file_path=f) for f in files]
+        for item in self.items:
+            table.add_row(os.path.relpath(item.file_path, self.folder), item.status, "", "", "", "", key=item.file_path)
+        settings = load_settings()
+        upload_settings = settings.get("upload", {})
+        await parse_headers(self.items, self.template, os.cpu_count() or 4, self.update_item)
+        async with CorpusServer(f"{protocol}://{host}:{port}", "") as corpus:
+            await submit_batch(corpus, self.items, upload_settings.get("concurrency", 4),
+                               upload_settings.get("gzip_raw_data", False), self.update_item)
+        submitted = sum(item.status == "submitted" for item in self.items)
+        self.notify(f"Submitted {submitted} of {len(self.items)} files.", severity="information")
+
+    def on_worker_state_changed(self, event: Worker.StateChanged):
+        if event.state == WorkerState.ERROR:
+            self.notify(f"{event.worker.name} failed: {event.worker.error}", severity="error")
+        elif event.state == WorkerState.CANCELLED:
+            self.notify(f"{event.worker.name} cancelled.", severity="warning")
+
+    def action_cancel_import(self):
+        self.workers.cancel_node(self)
+
+    def action_back(self):
+        self.workers.cancel_node(self)
+        self.app.pop_screen()
+
+
 class UploadScreen(Screen):
     BINDINGS = [
         Binding(key="ctrl+q", action="quit", description="Exit the application"),
         Binding(key="ctrl+s", action="submit_data", description="Submit data to server"),
         Binding(key="ctrl+l", action="directory_walk", description="Walk directory for input files"),
-        Binding(key="ctrl+t", action="go_to_title", description="Go to title screen")
+        Binding(key="ctrl+e", action="save_template", description="Save selection as import template"),
+        Binding(key="ctrl+t", action="go_to_title", description="Go to title screen"),
+        Binding(key="escape", action="cancel_workers", description="Cancel running task"),
     ]
 
     def compose(self) -> ComposeResult:
@@ -107,38 +192,46 @@ class UploadScreen(Screen):
 
     @on(Button.Pressed, "#load-button")
     async def load_file(self, event: Button.Pressed) -> None:
-        self.loading_indicator.remove_class("loading-indicator-inactive")
-        self.loading_indicator.add_class("loading-indicator-active")
-
         self.file_path = self.query_one("#input-file", Input).value.replace('"', "").replace("\\", "/")
+        self.df = None
         if self.file_path.endswith(".csv"):
-            self.df = pd.read_csv(self.file_path)
-        elif self.file_path.endswith(".tsv"):
-            self.df = pd.read_csv(self.file_path, sep="\t")
-        elif self.file_path.endswith(".txt"):
-            self.df = pd.read_csv(self.file_path, sep="\t")
+            self.sep = ","
+        elif self.file_path.endswith(".tsv") or self.file_path.endswith(".txt"):
+            self.sep = "\t"
         else:
             self.notify("File type not supported.", severity="error")
-
-        if getattr(self, "df", None) is not None:
-            self.columns = self.df.columns.tolist()
-            selection_list_container = self.query_one("#selection-list-container", VerticalScroll)
-            await selection_list_container.remove_children()
-            await selection_list_container.mount(SelectionList[str](id="selection-list"))
-            selection = self.query_one("#selection-list", SelectionList)
-            index_column_container = self.query_one("#select-index-column-container", Vertical)
-            await index_column_container.remove_children()
-            await index_column_container.mount(Select(id="index-column-selection", options=[(i, i) for i in self.columns]))
-            selection.add_options([(f"{n} {i}", i) for n, i in enumerate(self.columns)])
-            condition_assignment = self.query_one("#condition-assignment", ConditionAssignment)
-            condition_assignment.sample_dict = {}
-            condition_assignment.selected_sample = ""
-            await condition_assignment.update_view()
-            self.query_one("#group-name-input", Input).value = ""
-            self.query_one("#main-uploading-view", Vertical).remove_class("main-uploading-view-inactive")
-            self.query_one("#main-uploading-view", Vertical).add_class("main-uploading-view-active")
-        self.query_one("#loading-indicator", LoadingIndicator).remove_class("loading-indicator-active")
-        self.query_one("#loading-indicator", LoadingIndicator).add_class("loading-indicator-inactive")
+            return
+        self.turn_on_loading_indicator()
+        self.read_header(self.file_path, self.sep)
+
+    @work(thread=True, exclusive=True, group="load", name="Loading file", exit_on_error=False)
+    def read_header(self, file_path: str, sep: str):
+        """Read the header and a few rows of the input file off the event loop"""
+        self.post_message(WorkerProgress(f"Reading {os.path.basename(file_path)}"))
+        # only the header and a few rows are needed to fill the column pickers,
+        # the chosen columns are read from the file when they are used
+        df = read_table_header(file_path, sep, sample_rows=5)
+        if not get_current_worker().is_cancelled:
+            self.app.call_from_thread(self.show_columns, df)
+
+    async def show_columns(self, df: pd.DataFrame):
+        self.df = df
+        self.columns = self.df.columns.tolist()
+        selection_list_container = self.query_one("#selection-list-container", VerticalScroll)
+        await selection_list_container.remove_children()
+        await selection_list_container.mount(SelectionList[str](id="selection-list"))
+        selection = self.query_one("#selection-list", SelectionList)
+        index_column_container = self.query_one("#select-index-column-container", Vertical)
+        await index_column_container.remove_children()
+        await index_column_container.mount(Select(id="index-column-selection", options=[(i, i) for i in self.columns]))
+        selection.add_options([(f"{n} {i}", i) for n, i in enumerate(self.columns)])
+        condition_assignment = self.query_one("#condition-assignment", ConditionAssignment)
+        condition_assignment.sample_dict = {}
+        condition_assignment.selected_sample = ""
+        await condition_assignment.update_view()
+        self.query_one("#group-name-input", Input).value = ""
+        self.query_one("#main-uploading-view", Vertical).remove_class("main-uploading-view-inactive")
+        self.query_one("#main-uploading-view", Vertical).add_class("main-uploading-view-active")
 
     @on(Input.Submitted, "#input-file")
     async def on_file_input_submit(self, event: Input.Submitted) -> None:
@@ -194,80 +287,136 @@ class UploadScreen(Screen):
 
     @on(Select.Changed, "#index-column-selection")
     async def update_index_summary(self, event: Select.Changed):
-        print(event.value)
-        index_count = len(self.df[event.value])
-        unique_count = len(self.df[event.value].unique())
+        if event.value == Select.BLANK:
+            return
+        self.summarize_index(event.value)
+
+    @work(thread=True, exclusive=True, group="index-summary", name="Index summary", exit_on_error=False)
+    def summarize_index(self, index_col: str):
+        """Read the index column and count its unique entries off the event loop"""
+        self.post_message(WorkerProgress(f"Reading index column {index_col}"))
+        index = self.load_columns([index_col])[index_col]
+        index_count = len(index)
+        unique_count = len(index.unique())
         unique = index_count == unique_count
+        if get_current_worker().is_cancelled:
+            return
         md = self.query_one("#index-summary", Markdown)
-        await md.update(f"""
+        self.app.call_from_thread(md.update, f"""
         Index Summary
         -------------
-        1. Index column: {event.value}
+        1. Index column: {index_col}
         2. Total entries: {index_count}
         3. Is unique: {unique}""")
 
     async def action_submit_data(self):
-        self.loading_indicator.remove_class("loading-indicator-inactive")
-        self.loading_indicator.add_class("loading-indicator-active")
         selected = self.query_one("#selection-list", SelectionList).selected
         sample_dict = self.query_one("#condition-assignment", ConditionAssignment).sample_dict
         sample_cols = []
         for s in selected:
             if s in sample_dict:
                 sample_cols.append({"name": s, "group": sample_dict[s]["group"]})
-        temp = tempfile.NamedTemporaryFile(suffix=".tsv")
-        self.df.fillna("").to_csv(temp, sep="\t", index=False)
-        self.notify("Submitting data...", severity="information")
-        async with httpx.AsyncClient() as client:
+        self.turn_on_loading_indicator()
+        self.submit_data(self.query_one("#index-column-selection", Select).value, sample_cols)
+
+    @work(exclusive=True, group="submit", name="Data submission", exit_on_error=False)
+    async def submit_data(self, index_col: str, sample_cols: list[dict]):
+        """Stream the whole table to the server, the index and sample columns are named in the submission.
+        Only the column pickers and plots read a subset of the columns"""
+        settings = load_settings()
+        # nothing is transformed, so the original csv or tsv file is sent as it is with its own file type
+        source = TableSource(self.file_path, self.sep,
+                             compress=settings.get("upload", {}).get("gzip_raw_data", False))
+
+        def progress(sent: int, total: int):
+            self.post_message(WorkerProgress("Submitting data", sent, total))
+
+        self.post_message(WorkerProgress("Preparing data"))
+        async with CorpusServer(f"{protocol}://{host}:{port}", "") as corpus:
             try:
-                req = await client.post(f"{protocol}://{host}:{port}/api/rawdata/", data={
-                    "name": "",
-                    "description": "",
-                    "index_col": self.query_one("#index-column-selection", Select).value,
-                    "sample_cols": json.dumps(sample_cols),
-                    "metadata": json.dumps({}),
-                    "file_type": "tsv",
-                }, files={"file": ("file.tsv", temp)})
+                req = await corpus.submit_raw_data(source, index_col, sample_cols, progress=progress)
                 if req.status_code == 201:
                     self.notify("Data submitted.", severity="information")
                 else:
                     self.notify("Data submission failed.", severity="error")
-            except Exception as e:
+            except httpx.HTTPError as e:
                 self.notify("Data submission failed.", severity="error")
                 logging.exception(e)
-        self.loading_indicator.remove_class("loading-indicator-active")
-        self.loading_indicator.add_class("loading-indicator-inactive")
 
     @on(Button.Pressed, "#auto-select-button")
     async def auto_select(self, event: Button.Pressed):
+        selection = self.query_one("#selection-list", SelectionList)
+        # columns with a standard sample layout are settled offline, only the ambiguous rest is sent to GPT
+        detection = detect_sample_columns(self.df)
+        for i in detection.samples:
+            selection.select(i)
+        if not detection.ambiguous:
+            self.notify(f"Selected {len(detection.samples)} sample columns.", severity="information")
+            return
         try:
-            result = await gpt_index_with_json(self.df.head(5))
-            print(result)
+            result = await gpt_index_with_json(self.df[detection.ambiguous])
             if result is not None:
-                selection = self.query_one("#selection-list", SelectionList)
                 for i in result:
                     if i in self.columns:
                         selection.select(i)
-        except ValueError as e:
-            self.notify("Auto select failed.", severity="error")
+        except (ValueError, openai.OpenAIError) as e:
+            self.notify(f"Selected {len(detection.samples)} sample columns, {len(detection.ambiguous)} ambiguous columns "
+                        f"could not be checked with ChatGPT.", severity="warning")
             logging.exception(e)
 
     async def action_directory_walk(self):
-        def call_back_get_path(file_path: str) -> None:
-            if file_path != "":
-                self.turn_on_loading_indicator()
-                self.directory_walk_path = file_path
-                file_lists = []
-                for root, dirs, files in os.walk(self.directory_walk_path):
-                    for file in files:
-                        if file.endswith(".csv") or file.endswith(".tsv") or file.endswith(".txt"):
-                            file_lists.append(os.path.join(root, file))
-                self.notify(f"Found eligible {len(file_lists)} files.", severity="information")
-                if file_lists:
-                    self.directory_walk_file_lists = file_lists
-                self.turn_off_loading_indicator()
+        def call_back_get_path(result: dict) -> None:
+            if result and result["folder"]:
+                if not os.path.isdir(result["folder"]):
+                    self.notify("Folder not found.", severity="error")
+                    return
+                templates = load_templates(TEMPLATES_PATH)
+                if result["template"] not in templates:
+                    self.notify("Select an import template, save one from a loaded file with ctrl+e.", severity="error")
+                    return
+                self.directory_walk_path = result["folder"]
+                self.app.push_screen(BatchImportScreen(result["folder"], templates[result["template"]]))
         await self.app.push_screen("directory_walk_upload", call_back_get_path)
 
+    def action_save_template(self):
+        if getattr(self, "df", None) is None:
+            self.notify("Load a file first.", severity="error")
+            return
+        index_col = self.query_one("#index-column-selection", Select).value
+        if index_col == Select.BLANK:
+            self.notify("Select an index column first.", severity="error")
+            return
+        sample_dict = self.query_one("#condition-assignment", ConditionAssignment).sample_dict
+        template = ImportTemplate(
+            name=os.path.basename(self.file_path),
+            index_col=index_col,
+            sample_cols=list(sample_dict.keys()),
+            conditions={name: sample["group"] for name, sample in sample_dict.items()})
+        save_template(TEMPLATES_PATH, template)
+        self.notify(f"Saved import template {template.name}.", severity="information")
+
+    def load_columns(self, columns: list[str]) -> pd.DataFrame:
+        """Read only the given columns of the loaded file"""
+        return read_table_columns(self.file_path, self.sep, columns, sample=self.df)
+
+    def on_worker_progress(self, message: WorkerProgress):
+        self.app.sub_title = message.text
+
+    def on_worker_state_changed(self, event: Worker.StateChanged):
+        if event.state not in (WorkerState.SUCCESS, WorkerState.ERROR, WorkerState.CANCELLED):
+            return
+        if not any(w.is_running for w in self.workers if w.node is self):
+            self.turn_off_loading_indicator()
+            self.app.sub_title = ""
+        if event.state == WorkerState.ERROR:
+            self.notify(f"{event.worker.name} failed: {event.worker.error}", severity="error")
+            logging.exception(event.worker.error)
+        elif event.state == WorkerState.CANCELLED:
+            self.notify(f"{event.worker.name} cancelled.", severity="warning")
+
+    def action_cancel_workers(self):
+        self.workers.cancel_node(self)
+
     def turn_off_loading_indicator(self):
         self.query_one("#loading-indicator", LoadingIndicator).remove_class("loading-indicator-active")
         self.query_one("#loading-indicator", LoadingIndicator).add_class("loading-indicator-inactive")
@@ -0,0 +1,17 @@
+from textual.message import Message
+
+
+class WorkerProgress(Message):
+    """Progress of a background worker, posted from the worker thread to the screen that started it"""
+
+    def __init__(self, description: str, done: int = 0, total: int | None = None):
+        super().__init__()
+        self.description = description
+        self.done = done
+        self.total = total
+
+    @property
+    def text(self) -> str:
+        if self.total:
+            return f"{self.description} ({self.done}/{self.total})"
+        return self.description
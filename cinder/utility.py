@@ -1,13 +1,30 @@
-from numpy.random import permutation
+import numpy as np
 import pandas as pd
 
 
-def scramble_dataframe(df: pd.DataFrame):
-    """Scramble each cell in each column of a dataframe"""
-    df = df.copy()
-    for col in df.columns:
-        df[col] = permutation(df[col])
-    return df
+def _dtype_groups(df: pd.DataFrame) -> dict:
+    """Group column positions by dtype so each group can be handled as one 2D NumPy block"""
+    groups = {}
+    for position, dtype in enumerate(df.dtypes):
+        groups.setdefault(dtype, []).append(position)
+    return groups
+
+
+def scramble_dataframe(df: pd.DataFrame, seed: int | np.random.Generator | None = None):
+    """Scramble each cell in each column of a dataframe, columns of the same dtype are permuted together as one block.
+    Pass a seed to get the same scramble on every call"""
+    rng = np.random.default_rng(seed)
+    order = []
+    blocks = []
+    for positions in _dtype_groups(df).values():
+        order.extend(positions)
+        blocks.append(pd.DataFrame(rng.permuted(df.iloc[:, positions].to_numpy(), axis=0), index=df.index, copy=False))
+    if not blocks:
+        return df.copy(deep=False)
+    # a new frame built from the permuted blocks, put back in the original column order
+    result = pd.concat(blocks, axis=1).iloc[:, np.argsort(order)]
+    result.columns = df.columns
+    return result
 
 
 def mask_column_name_with_number(df: pd.DataFrame):
@@ -18,13 +35,25 @@ def mask_column_name_with_number(df: pd.DataFrame):
 
 
 def round_all_number_in_dataframe(df: pd.DataFrame):
-    """Round all numbers in a dataframe"""
-    df = df.copy()
-    for i, r in df.iterrows():
-        for c in df.columns:
-            if isinstance(r[c], float) and pd.notnull(r[c]):
-                df.at[i, c] = round(r[c])
-    return df
+    """Round all floats in a dataframe to whole numbers, half to even like round"""
+    result = df.copy(deep=False)
+    for dtype, positions in _dtype_groups(df).items():
+        if pd.api.types.is_float_dtype(dtype):
+            result.isetitem(positions, np.round(df.iloc[:, positions].to_numpy()))
+        elif pd.api.types.is_object_dtype(dtype):
+            # floats mixed with text in an object column are rounded one by one
+            for position in positions:
+                result.isetitem(position, df.iloc[:, position].map(
+                    lambda v: round(v) if isinstance(v, float) and pd.notnull(v) else v))
+    return result
+
+
+def condition_from_sample_name(sample: str) -> str:
+    """Guess the condition of a sample column from its name by dropping a replicate suffix such as .01"""
+    cond = sample.split(".")
+    if len(cond) > 1:
+        return ".".join(cond[:-1])
+    return cond[0]
 
 
 def detect_delimiter_from_extension(file_name: str):
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import re
+from dataclasses import dataclass, field, asdict
+from typing import Callable
+
+import httpx
+import pandas as pd
+
+from cinder.cindergpt.heuristics import detect_sample_columns
+from cinder.utility import condition_from_sample_name, detect_delimiter_from_extension
+from cinder.utils.streaming import TableSource
+from cinder.utils.table_cache import read_table_header
+
+TABLE_EXTENSIONS = (".csv", ".tsv", ".txt")
+
+
+def scan_tables(root: str, extensions: tuple[str, ...] = TABLE_EXTENSIONS) -> list[str]:
+    """Walk a folder tree with os.scandir and return the paths of all delimited tables in it, sorted"""
+    found = []
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and entry.name.endswith(extensions):
+                        found.append(entry.path)
+        except PermissionError:
+            continue
+    return sorted(found)
+
+
+@dataclass
+class ImportTemplate:
+    """Saved index column, sample columns and condition assignment applied to every table of a batch import.
+    Sample columns are taken by exact name or by sample_pattern, groups fall back to the replicate suffix rule"""
+    name: str
+    index_col: str
+    sample_cols: list[str] = field(default_factory=list)
+    sample_pattern: str = ""
+    conditions: dict[str, str] = field(default_factory=dict)
+
+    def apply(self, columns: list[str], header: pd.DataFrame = None) -> tuple[str, list[dict]] | None:
+        """Return the index column and sample columns with their groups for a table header, or None if the template
+        does not fit the table. Without template samples the offline sample column detector is used"""
+        if self.index_col not in columns:
+            return None
+        samples = [c for c in columns if c in set(self.sample_cols)]
+        if self.sample_pattern:
+            pattern = re.compile(self.sample_pattern)
+            samples += [c for c in columns if c not in samples and pattern.search(c)]
+        if not samples and not self.sample_cols and not self.sample_pattern and header is not None:
+            samples = detect_sample_columns(header).samples
+        samples = [c for c in columns if c in set(samples) and c != self.index_col]
+        if not samples:
+            return None
+        return self.index_col, [
+            {"name": c, "group": self.conditions.get(c, condition_from_sample_name(c))} for c in samples]
+
+
+def load_templates(path: str) -> dict[str, ImportTemplate]:
+    """Read the saved import templates"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rt") as f:
+        return {name: ImportTemplate(**template) for name, template in json.load(f).items()}
+
+
+def save_template(path: str, template: ImportTemplate):
+    """Add or replace an import template in the saved templates"""
+    templates = load_templates(path)
+    templates[template.name] = template
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "wt") as f:
+        json.dump({name: asdict(t) for name, t in templates.items()}, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+@dataclass
+class BatchItem:
+    """State of one table in a batch import"""
+    file_path: str
+    status: str = "queued"
+    index_col: str = ""
+    sample_cols: list[dict] = field(default_factory=list)
+    sent: int = 0
+    total: int = 0
+    error: str = ""
+
+    @property
+    def sep(self) -> str | None:
+        return detect_delimiter_from_extension(self.file_path)
+
+
+async def parse_headers(items: list[BatchItem], template: ImportTemplate, jobs: int,
+                        on_update: Callable[[BatchItem], None] | None = None):
+    """Read the headers of all tables concurrently in threads and apply the template to each"""
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def parse(item: BatchItem):
+        async with semaphore:
+            item.status = "reading header"
+            if on_update:
+                on_update(item)
+            try:
+                header = await asyncio.to_thread(read_table_header, item.file_path, item.sep)
+            except (OSError, ValueError, pd.errors.ParserError) as e:
+                item.status = "failed"
+                item.error = str(e)
+            else:
+                applied = template.apply([str(c) for c in header.columns], header)
+                if applied is None:
+                    item.status = "skipped"
+                    item.error = "template does not fit"
+                else:
+                    item.index_col, item.sample_cols = applied
+                    item.status = "ready"
+            if on_update:
+                on_update(item)
+
+    await asyncio.gather(*(parse(item) for item in items))
+
+
+async def submit_batch(corpus, items: list[BatchItem], jobs: int, compress: bool = False,
+                       on_update: Callable[[BatchItem], None] | None = None):
+    """Stream every ready table to the server, at most jobs at a time"""
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def submit(item: BatchItem):
+        async with semaphore:
+            item.status = "uploading"
+            if on_update:
+                on_update(item)
+
+            def progress(sent: int, total: int):
+                item.sent, item.total = sent, total
+                if on_update:
+                    on_update(item)
+
+            # the whole original file is sent, the index and sample columns are named in the submission
+            source = TableSource(item.file_path, item.sep, compress=compress)
+            try:
+                result = await corpus.submit_raw_data(source, item.index_col, item.sample_cols,
+                                                      name=os.path.basename(item.file_path), progress=progress)
+                item.status = "submitted" if result.status_code == 201 else "failed"
+                if result.status_code != 201:
+                    item.error = f"server returned {result.status_code}"
+            except (httpx.HTTPError, OSError, ValueError) as e:
+                item.status = "failed"
+                item.error = str(e)
+            if on_update:
+                on_update(item)
+
+    await asyncio.gather(*(submit(item) for item in items if item.status == "ready"))
@@ -0,0 +1,110 @@
+import contextlib
+import os
+import shutil
+import stat
+import tempfile
+
+
+def _make_writable_and_retry(function, path, exc_info):
+    """shutil.rmtree error handler for read only blob links on platforms that refuse to delete them"""
+    os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+    function(path)
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "wt"):
+    """Open a temporary file in the folder of path for writing and move it over path once it is written.
+    The directory entry is replaced instead of the file being written through, so a project file that is a read only
+    link to a blob gets new content without the blob and the other projects linking to it changing"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f".{os.path.basename(path)}.",
+                                     suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.chmod(temp_path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+
+
+class BlobStore:
+    """Content-addressed store of project data files keyed by sha1. Project data folders hold hardlinks into the store
+    so a file imported into several projects is kept on disk once. Blobs are read only, which makes an in place write to
+    a linked project file fail for regular users, but root can still write through the link and change every project
+    sharing the blob. Files the app rewrites are therefore replaced with atomic_write and never ingested"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def blob_path(self, sha1: str) -> str:
+        return os.path.join(self.root, sha1[:2], sha1)
+
+    def ingest(self, file_path: str, sha1: str) -> bool:
+        """Move a project file into the store, leaving a hardlink to the blob in its place.
+        Return True if the file on disk was replaced or added to the store"""
+        blob = self.blob_path(sha1)
+        if os.path.exists(blob):
+            if os.path.samefile(blob, file_path):
+                return False
+            temp_path = f"{file_path}.blob"
+            try:
+                os.link(blob, temp_path)
+            except OSError:
+                # the store is on another filesystem or links are not supported, keep the plain file
+                return False
+            os.replace(temp_path, file_path)
+            return True
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(file_path, blob)
+        except OSError:
+            return False
+        os.chmod(blob, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+        return True
+
+    def release(self, sha1: str) -> bool:
+        """Delete a blob once no project folder links to it anymore"""
+        blob = self.blob_path(sha1)
+        try:
+            if os.stat(blob).st_nlink > 1:
+                return False
+        except FileNotFoundError:
+            return False
+        os.chmod(blob, stat.S_IREAD | stat.S_IWRITE)
+        os.remove(blob)
+        return True
+
+    def remove_link(self, file_path: str, sha1: str):
+        """Remove a project file that may be a link into the store and release its blob"""
+        try:
+            os.remove(file_path)
+        except PermissionError:
+            os.chmod(file_path, stat.S_IREAD | stat.S_IWRITE)
+            os.remove(file_path)
+            if os.path.exists(self.blob_path(sha1)):
+                os.chmod(self.blob_path(sha1), stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+        self.release(sha1)
+
+    def remove_tree(self, folder: str):
+        """Remove a project folder that may contain read only links into the store"""
+        shutil.rmtree(folder, onerror=_make_writable_and_retry)
+
+    def garbage_collect(self, dry_run: bool = False) -> tuple[int, int]:
+        """Delete blobs that are no longer linked from any project folder and return the number of blobs and bytes reclaimed"""
+        removed = 0
+        reclaimed = 0
+        for root, dirs, files in os.walk(self.root):
+            for file in files:
+                blob = os.path.join(root, file)
+                blob_stat = os.stat(blob)
+                if blob_stat.st_nlink > 1:
+                    continue
+                removed += 1
+                reclaimed += blob_stat.st_size
+                if not dry_run:
+                    os.chmod(blob, stat.S_IREAD | stat.S_IWRITE)
+                    os.remove(blob)
+        return removed, reclaimed
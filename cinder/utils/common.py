@@ -1,20 +1,36 @@
+import asyncio
+import contextlib
 import dataclasses
 import hashlib
+import importlib.util
 import json
 import os
 import shutil
 import sqlite3
+import threading
 import uuid
 from dataclasses import dataclass
 from io import BytesIO
+from typing import Callable, Iterator
 
 import httpx
 import requests
 from appdirs import AppDirs
 from python_on_whales import docker
 
+from cinder.utils.blob_store import BlobStore, atomic_write
+from cinder.utils.differential_analysis import CORAL_IMAGE, AnalysisCache, DifferentialAnalysis, StaleOutput, \
+    remove_outputs
+from cinder.utils.hash_index import LocalHashIndex, link_or_copy
+from cinder.utils.table_cache import TableCache
+from cinder.utils.hashing import HashCache, sha1_file, hash_files, tree_hash, HASH_CHUNK_SIZE
+from cinder.utils.streaming import TableSource, rechunk
+
 app_dir = AppDirs("Cinder", "Cinder")
 
+# times a chunked upload may be restarted from the offset reported by the server before it is given up
+MAX_UPLOAD_RESTARTS = 5
+
 
 def load_settings():
     settings = {
@@ -24,7 +40,29 @@ def load_settings():
             "protocol": "http",
             "api_key": ""},
         "project_folders": ["unprocessed", "searched", "differential_analysis", "sample_annotation", "other_files",
-                        "comparison_matrix"]
+                        "comparison_matrix"],
+        "upload": {
+            "concurrency": 4,
+            "chunks_in_flight": 2,
+            "http2": False,
+            "gzip_raw_data": False},
+        "blob_store": False,
+        "gpt": {
+            "model": "gpt-3.5-turbo",
+            "batch_size": 25,
+            "concurrency": 4,
+            "max_retries": 5},
+        "jobs": {
+            "max_jobs": 2,
+            "max_cpus": os.cpu_count() or 1,
+            "max_memory": 8192,
+            "cpus": 2,
+            "memory": 4096,
+            "docker_image": CORAL_IMAGE,
+            "pin_image": True,
+            "mode": "container",
+            "batch_size": 1,
+            "pool_size": 2}
     }
     if os.path.exists(os.path.join(app_dir.user_config_dir, "data_manager_config.json")):
         with open(os.path.join(app_dir.user_config_dir, "data_manager_config.json"), "r") as f:
@@ -36,8 +74,38 @@ def load_settings():
     return settings
 
 
+_local_db = None
+
+
 def load_local_db():
-    return ProjectDatabase(os.path.join(app_dir.user_config_dir, "data_manager.db"))
+    """Return the local project database, opened once per process and shared by every screen and command"""
+    global _local_db
+    if _local_db is None:
+        os.makedirs(app_dir.user_config_dir, exist_ok=True)
+        _local_db = ProjectDatabase(os.path.join(app_dir.user_config_dir, "data_manager.db"))
+    return _local_db
+
+
+def load_table_cache() -> TableCache:
+    """Return the app level cache of parsed project tables"""
+    return TableCache(os.path.join(app_dir.user_cache_dir, "tables"))
+
+
+def load_blob_store(settings: dict = None) -> BlobStore | None:
+    """Return the shared content-addressed blob store if it is enabled in the settings"""
+    if settings is None:
+        settings = load_settings()
+    if not settings.get("blob_store"):
+        return None
+    return BlobStore(os.path.join(app_dir.user_data_dir, "blobs"))
+
+
+def is_sidecar(category: str, relative_path: str, relative_paths: set[str]) -> bool:
+    """Whether a project file is a json the app keeps next to a data file and rewrites, the column choices of an
+    unprocessed file or the record of a differential analysis output"""
+    if not relative_path.endswith(".json"):
+        return False
+    return category == "differential_analysis" or (category == "unprocessed" and relative_path[:-5] in relative_paths)
 
 
 @dataclass
@@ -53,6 +121,19 @@ class ProjectFile:
         return d
 
 
+@dataclass
+class CatalogFile:
+    project_id: int
+    category: str
+    path: tuple[str, ...]
+    filename: str
+    sha1: str
+    size: int
+    mtime: int
+    remote_id: int = None
+    project_path: str = None
+
+
 @dataclass
 class Project:
     project_id: int
@@ -65,6 +146,7 @@ class Project:
     project_files: dict[str, list[ProjectFile]]
     remote_id: int = None
     project_hash: str = None
+    category_hashes: dict[str, str] = dataclasses.field(default_factory=dict)
 
     def to_dict(self):
         d = dataclasses.asdict(self)
@@ -73,100 +155,211 @@ class Project:
 
     def calculate_sha1_hash_of_file(self, file: str) -> str:
         """Calculate sha1 hash of a file"""
+        return sha1_file(file)
 
-        sha1_hash = hashlib.sha1()
-        with open(file, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha1_hash.update(chunk)
-        return sha1_hash.hexdigest()
-
-    def refresh(self):
-        """Walk through the project data subfolders and update the file lists for unprocessed, differential analysis, sample annotation, other files, and comparison matrix"""
-        sha1_list = []
+    def refresh(self, db=None, progress: Callable[[int, int], None] | None = None):
+        """Walk through the project data subfolders and update the file lists for unprocessed, differential analysis, sample annotation, other files, and comparison matrix.
+        If a project database is given the file catalog of a saved project is updated as well.
+        progress is called with the number of hashed files and the number of files that need hashing"""
         temp = {
             i: [] for i in self.project_files
         }
         settings = load_settings()
+        hash_cache = self.get_hash_cache()
+        hash_cache.reset_counters()
+        scanned = []
         for root, dirs, files in os.walk(self.project_data_path):
             item_data_path = root.replace(self.project_data_path, "").lstrip(os.sep)
             for cat in temp:
                 if item_data_path.startswith(cat):
                     for file in files:
-                        data = ProjectFile(
-                            filename=file,
-                            path=tuple(item_data_path.split(os.sep)),
-                            sha1=self.calculate_sha1_hash_of_file(
-                                os.path.join(self.project_data_path, root, file))
-                        )
-                        for j in self.project_files[cat]:
-                            if data.sha1 == j.sha1 and data.filename == j.filename and data.path == j.path:
-                                data.remote_id = j.remote_id
-                        sha1_list.append(data.sha1)
-                        temp[cat].append(data)
-                        print(files)
+                        path = tuple(item_data_path.split(os.sep))
+                        file_path = os.path.join(self.project_data_path, root, file)
+                        relative_path = "/".join(path + (file,))
+                        scanned.append((relative_path, cat, path, file, file_path, os.stat(file_path)))
+        scanned.sort(key=lambda x: x[0])
+
+        # only files whose stat changed since the last refresh are hashed, concurrently
+        hashes = {}
+        to_hash = []
+        previous_hashes = {}
+        for relative_path, cat, path, file, file_path, stat in scanned:
+            sha1 = hash_cache.get(relative_path, stat)
+            if sha1 is None:
+                to_hash.append(file_path)
+                if relative_path in hash_cache.entries:
+                    previous_hashes[file_path] = hash_cache.entries[relative_path]["sha1"]
+            else:
+                hashes[file_path] = sha1
+        hashes.update(hash_files(to_hash, settings.get("hash_workers"), progress))
+
+        # cached tables of file contents that changed or disappeared are no longer valid
+        table_cache = load_table_cache()
+        for file_path, sha1 in previous_hashes.items():
+            if hashes[file_path] != sha1:
+                table_cache.invalidate(sha1)
+        scanned_paths = {i[0] for i in scanned}
+        for relative_path, entry in hash_cache.entries.items():
+            if relative_path not in scanned_paths:
+                table_cache.invalidate(entry["sha1"])
+
+        previous_files = {cat: {(tuple(i.path), i.filename, i.sha1): i for i in self.project_files[cat]}
+                          for cat in temp}
+        file_hashes = {i: [] for i in temp}
+        blob_store = load_blob_store(settings)
+        for relative_path, cat, path, file, file_path, stat in scanned:
+            data = ProjectFile(
+                filename=file,
+                path=path,
+                sha1=hashes[file_path]
+            )
+            if blob_store and not is_sidecar(cat, relative_path, scanned_paths) and \
+                    blob_store.ingest(file_path, data.sha1):
+                # the file is now a link to a blob other projects may share, so its inode and mtime changed
+                stat = os.stat(file_path)
+            hash_cache.put(relative_path, stat, data.sha1)
+            previous = previous_files[cat].get((data.path, data.filename, data.sha1))
+            if previous is not None:
+                data.remote_id = previous.remote_id
+            file_hashes[cat].append((relative_path, data.sha1))
+            temp[cat].append(data)
+        hash_cache.prune(scanned_paths)
+        hash_cache.save()
+        self.hash_cache_hits = hash_cache.hits
+        self.hash_cache_misses = hash_cache.misses
 
         # check and remove from array if file is not in project folder
         removed_file = []
         for cat in temp:
-            for i in self.project_files[cat]:
-                if i not in temp[cat]:
-                    removed_file.append(i)
+            kept = {(i.path, i.filename, i.sha1) for i in temp[cat]}
+            removed_file += [i for key, i in previous_files[cat].items() if key not in kept]
             if cat not in self.project_files:
                 os.makedirs(os.path.join(self.project_data_path, cat), exist_ok=True)
             self.project_files[cat] = temp[cat]
-        s1 = hashlib.sha1()
-        for s in sha1_list:
-            s1.update(s.encode('utf-8'))
-        self.project_hash = s1.hexdigest()
-        with open(os.path.join(self.project_path, "project.sha1"), "w") as f:
+        # file digests roll up into one digest per category which roll up into the project digest
+        self.category_hashes = {cat: tree_hash(file_hashes[cat]) for cat in file_hashes}
+        self.project_hash = tree_hash(list(self.category_hashes.items()))
+        with atomic_write(os.path.join(self.project_path, "project.sha1")) as f:
             f.write(self.project_hash)
 
-        with open(os.path.join(self.project_path, "project.json"), "w") as f:
+        with atomic_write(os.path.join(self.project_path, "project.json")) as f:
             json.dump(self.to_dict(), f, indent=2)
 
         self.project_json_hash = self.calculate_sha1_hash_of_file(os.path.join(self.project_path, "project.json"))
+        if db is not None and self.project_id:
+            db.sync_project_files(self.project_id, self.get_catalog_files(hash_cache))
         return removed_file
 
+    def get_catalog_files(self, hash_cache: HashCache = None) -> list[CatalogFile]:
+        """Build catalog rows for the project files using the size and mtime recorded in the hash cache"""
+        if hash_cache is None:
+            hash_cache = self.get_hash_cache()
+        files = []
+        for cat in self.project_files:
+            for file in self.project_files[cat]:
+                entry = hash_cache.entries.get("/".join(tuple(file.path) + (file.filename,)), {})
+                files.append(CatalogFile(project_id=self.project_id, category=cat, path=tuple(file.path),
+                                         filename=file.filename, sha1=file.sha1, size=entry.get("size"),
+                                         mtime=entry.get("mtime_ns"), remote_id=file.remote_id,
+                                         project_path=self.project_path))
+        return files
+
+
+    def get_hash_cache(self) -> HashCache:
+        """Get the persistent file hash cache stored next to project.sha1"""
+        return HashCache(os.path.join(self.project_path, "project.sha1.cache"))
 
     def get_project_hash(self):
         """Get project hash"""
         with open(os.path.join(self.project_path, "project.sha1"), "rt") as f:
             return f.read()
 
-    @staticmethod
     def perform_differential_analysis(self, data_path: str, unprocessed_file: str, annotation_file: str,
                                       comparison_matrix_file: str, output_differential_analysis_file: str,
                                       index_cols: str, column_na_filter_threshold: float = 0.7,
                                       row_na_filter_threshold: float = 0.7, imputation_method: str = "knn",
                                       normalization_method: str = "quantiles.robust",
                                       aggregation_method: str = "MsCoreUtils::robustSummary",
-                                      aggregation_column: str = "", docker_image="noatgnu/coral:0.0.1"):
-        """Perform differential analysis on the unprocessed files using annotation files and comparison matrix files with docker image noatgnu/coral:0.0.1"""
-        unprocessed_file = os.path.join("/data", "unprocessed", unprocessed_file)
-        annotation_file = os.path.join("/data", "sample_annotation", annotation_file)
-        comparison_matrix_file = os.path.join("/data", "comparison_matrix", comparison_matrix_file)
-        output_differential_analysis_file = os.path.join("/data", "differential_analysis",
-                                                         output_differential_analysis_file)
-        command = ["-u", unprocessed_file, "-a", annotation_file, "-c", comparison_matrix_file, "-o",
-                   output_differential_analysis_file, "-x", index_cols, "-f", column_na_filter_threshold, "-r",
-                   row_na_filter_threshold, "-i", imputation_method, "-n", normalization_method]
-        if aggregation_column != "":
-            command += ["-g", aggregation_method, "-t", aggregation_column]
-        docker.run(image=docker_image, volumes=[(data_path, "/data")], command=command, remove=True, tty=True,
-                   interactive=False)
-        with open(os.path.join(self.project_data_path, "differential_analysis",
-                               f"{output_differential_analysis_file}.json"), "w") as f:
-            json.dump(command, f, indent=2)
+                                      aggregation_column: str = "", docker_image=CORAL_IMAGE,
+                                      use_cache: bool = True) -> bool:
+        """Perform differential analysis on the unprocessed files using annotation files and comparison matrix files with docker image noatgnu/coral:0.0.1.
+        This blocks until the container exits, use JobScheduler to run several analyses in parallel.
+        A result of the same inputs and parameters is reused instead of running coral again, return True if it was"""
+        analysis = DifferentialAnalysis(
+            unprocessed_file=unprocessed_file, annotation_file=annotation_file,
+            comparison_matrix_file=comparison_matrix_file, output_file=output_differential_analysis_file,
+            index_cols=index_cols, column_na_filter_threshold=column_na_filter_threshold,
+            row_na_filter_threshold=row_na_filter_threshold, imputation_method=imputation_method,
+            normalization_method=normalization_method, aggregation_method=aggregation_method,
+            aggregation_column=aggregation_column)
+        cache = AnalysisCache(load_local_db(), self.get_hash_cache())
+        key, inputs = cache.key(data_path, analysis, docker_image)
+        if use_cache and cache.reuse(key, inputs, self.project_id, self.project_data_path, analysis, docker_image):
+            return True
+        remove_outputs(data_path, analysis)
+        docker.run(image=docker_image, volumes=[(data_path, "/data")], command=analysis.command(), remove=True,
+                   tty=True, interactive=False)
+        cache.store(key, inputs, self.project_id, self.project_data_path, analysis, docker_image)
+        return False
+
+    def stale_analyses(self) -> list[StaleOutput]:
+        """Differential analysis outputs of the project whose inputs changed since they were made"""
+        return AnalysisCache(load_local_db(), self.get_hash_cache()).stale(self.project_data_path)
 
     def remove_file(self, file: ProjectFile):
-        """Remove file from project"""
-        os.remove(os.path.join(self.project_data_path, *file.path, file.filename))
+        """Remove file from project, releasing its blob if the shared blob store is enabled"""
+        blob_store = load_blob_store()
+        if blob_store:
+            blob_store.remove_link(os.path.join(self.project_data_path, *file.path, file.filename), file.sha1)
+        else:
+            os.remove(os.path.join(self.project_data_path, *file.path, file.filename))
 
     def remove_project(self, db):
         """Remove project from database and delete project folder"""
         if self.project_id:
             db.delete_project(self.project_id)
-        shutil.rmtree(self.project_path)
+        blob_store = load_blob_store()
+        if blob_store:
+            blob_store.remove_tree(self.project_path)
+            for cat in self.project_files:
+                for file in self.project_files[cat]:
+                    blob_store.release(file.sha1)
+        else:
+            shutil.rmtree(self.project_path)
+
+
+@dataclass
+class Job:
+    job_id: int
+    project_id: int
+    data_path: str
+    analysis: DifferentialAnalysis
+    docker_image: str
+    status: str = "queued"
+    cpus: float = 1
+    memory: int = 0
+    container: str = ""
+    exit_code: int = None
+    error: str = ""
+    log_path: str = ""
+    created_at: str = None
+    started_at: str = None
+    finished_at: str = None
+
+
+@dataclass
+class ProjectSummary:
+    project_id: int
+    project_name: str
+    description: str
+    project_path: str
+    project_global_id: str
+    project_hash: str = None
+    remote_id: int = None
+
+    def load(self) -> Project:
+        """Load the full project from its project folder"""
+        return load_project(self.project_path)
 
 
 @dataclass
@@ -174,40 +367,109 @@ class QueryResult:
     total: int
     offset: int
     limit: int
-    data: list[Project]
+    data: list[ProjectSummary]
 
 
 class ProjectDatabase:
     def __init__(self, path=":memory:"):
         self.path = path
-        self.conn = sqlite3.connect(path)
-        self.conn.execute(
-            "CREATE TABLE IF NOT EXISTS projects (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, description TEXT, location TEXT, global_id TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, sha1_hash TEXT, remote_id INTEGER)")
+        # one connection shared by the UI, Textual workers and background threads, serialized by the lock
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._transaction_depth = 0
+        self.configure()
+        self.migrate()
+        self.detect_fts()
+
+    def detect_fts(self):
+        """Check whether the FTS5 project index exists and whether it uses the trigram tokenizer"""
+        row = self.execute_one("SELECT sql FROM sqlite_master WHERE name='projects_fts'")
+        self.fts_enabled = row is not None
+        self.fts_trigram = row is not None and "trigram" in row[0]
+
+    def configure(self):
+        """Apply connection pragmas, WAL lets several Cinder processes read while one writes"""
+        with self.lock:
+            if self.path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA busy_timeout=30000")
+            self.conn.execute("PRAGMA temp_store=MEMORY")
+            self.conn.execute("PRAGMA cache_size=-16000")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run statements in one transaction, nested calls become savepoints of the outermost transaction"""
+        with self.lock:
+            depth = self._transaction_depth
+            if depth == 0:
+                self.conn.execute("BEGIN IMMEDIATE")
+            else:
+                self.conn.execute(f"SAVEPOINT sp{depth}")
+            self._transaction_depth += 1
+            try:
+                yield self.conn
+            except BaseException:
+                self._transaction_depth -= 1
+                if depth == 0:
+                    self.conn.execute("ROLLBACK")
+                else:
+                    self.conn.execute(f"ROLLBACK TO sp{depth}")
+                    self.conn.execute(f"RELEASE sp{depth}")
+                raise
+            self._transaction_depth -= 1
+            if depth == 0:
+                self.conn.execute("COMMIT")
+            else:
+                self.conn.execute(f"RELEASE sp{depth}")
+
+    def execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """Run a statement under the connection lock and return all rows"""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def execute_one(self, sql: str, params: tuple = ()) -> tuple | None:
+        """Run a statement under the connection lock and return the first row"""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    def batch(self, sql: str, rows: list[tuple]):
+        """Run a statement for many rows in a single transaction"""
+        with self.transaction() as conn:
+            conn.executemany(sql, rows)
+
+    def migrate(self):
+        """Apply pending schema migrations, each migration runs once and the applied version is recorded in PRAGMA user_version"""
+        with self.transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(conn)
+                conn.execute(f"PRAGMA user_version={i}")
 
     def create_project(self, name: str, description: str, location: str, hash: str) -> dict:
         """Create project and return project id"""
         uu = str(uuid.uuid4())
-        self.conn.execute(
-            "INSERT INTO projects (name, description, location, global_id, sha1_hash) VALUES (?, ?, ?, ?, ?)",
-            (name, description, location, uu, hash))
-        self.conn.commit()
-        id = self.conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        with self.transaction() as conn:
+            id = conn.execute(
+                "INSERT INTO projects (name, description, location, global_id, sha1_hash) VALUES (?, ?, ?, ?, ?)",
+                (name, description, location, uu, hash)).lastrowid
         return {"id": id, "global_id": uu}
 
     def update_project(self, project_id: int, name: str, description: str, location: str, hash: str):
         """Update project name and description"""
-        self.conn.execute("UPDATE projects SET name=?, description=?, location=?, sha1_hash=? WHERE id=?",
-                          (name, description, project_id, location, hash))
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute("UPDATE projects SET name=?, description=?, location=?, sha1_hash=? WHERE id=?",
+                         (name, description, location, hash, project_id))
 
     def delete_project(self, project_id: int):
         """Delete project"""
-        self.conn.execute("DELETE FROM projects WHERE id=?", (project_id,))
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM projects WHERE id=?", (project_id,))
+            conn.execute("DELETE FROM project_files WHERE project_id=?", (project_id,))
 
     def get_project(self, project_id: int) -> Project:
         """Get project by id and load as a Project object"""
-        data = self.conn.execute("SELECT * FROM projects WHERE id=?", (project_id,)).fetchone()
+        data = self.execute_one("SELECT * FROM projects WHERE id=?", (project_id,))
         if data:
             project_dir = data[3]
             project = load_project(project_dir)
@@ -215,30 +477,293 @@ class ProjectDatabase:
         else:
             raise ValueError(f"Project with id {project_id} not found")
 
+    def get_project_locations(self) -> list[str]:
+        """Get the folders of all local projects"""
+        return [d[0] for d in self.execute("SELECT location FROM projects ORDER BY id") if d[0]]
+
     def search_projects(self, term: str = "", offset: int = 0, limit: int = 20) -> QueryResult:
-        """Search for projects by name or description with offset and limit of how many entries to return, also return total number of entries"""
-        data = self.conn.execute("SELECT * FROM projects WHERE name LIKE ? OR description LIKE ? LIMIT ? OFFSET ?",
-                                 (f"%{term}%", f"%{term}%", limit, offset)).fetchall()
-        projects = []
-        for d in data:
-            project_dir = d[3]
-            project = load_project(project_dir)
-            projects.append(project)
-        total = self.conn.execute("SELECT COUNT(*) FROM projects WHERE name LIKE ? OR description LIKE ?",
-                                  (f"%{term}%", f"%{term}%")).fetchone()[0]
+        """Search for projects by name or description with offset and limit of how many entries to return, also return total number of entries.
+        Only the summary columns stored in the database are returned, use ProjectSummary.load to get the full project"""
+        columns = "p.id, p.name, p.description, p.location, p.global_id, p.sha1_hash, p.remote_id, COUNT(*) OVER ()"
+        term = term.strip()
+        if not term:
+            query = f"SELECT {columns} FROM projects p ORDER BY p.id LIMIT ? OFFSET ?"
+            params = (limit, offset)
+        elif self.fts_trigram and len(term) >= 3:
+            # the trigram index matches the term anywhere in the name or description like LIKE '%term%' does,
+            # terms shorter than one trigram are searched with LIKE
+            match = '"' + term.replace('"', '""') + '"'
+            query = f"SELECT {columns} FROM projects p JOIN projects_fts f ON f.rowid = p.id WHERE projects_fts MATCH ? ORDER BY p.id LIMIT ? OFFSET ?"
+            params = (match, limit, offset)
+        else:
+            query = f"SELECT {columns} FROM projects p WHERE p.name LIKE ? OR p.description LIKE ? ORDER BY p.id LIMIT ? OFFSET ?"
+            params = (f"%{term}%", f"%{term}%", limit, offset)
+        data = self.execute(query, params)
+        projects = [ProjectSummary(project_id=d[0], project_name=d[1], description=d[2], project_path=d[3],
+                                   project_global_id=d[4], project_hash=d[5], remote_id=d[6]) for d in data]
+        if data:
+            total = data[0][7]
+        elif offset > 0:
+            # the window count is not available past the last page
+            total = self.execute_one(f"SELECT COUNT(*) FROM ({query.replace(' LIMIT ? OFFSET ?', '')})",
+                                     params[:-2])[0]
+        else:
+            total = 0
         return QueryResult(total=total, offset=offset, limit=limit, data=projects)
 
     def recreate_database(self):
         """Recreate database"""
-        self.conn.execute("DROP TABLE IF EXISTS projects")
-        self.conn.execute(
-            "CREATE TABLE IF NOT EXISTS projects (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, description TEXT, location TEXT, global_id TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, sha1_hash TEXT)")
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute("DROP TABLE IF EXISTS projects_fts")
+            conn.execute("DROP TABLE IF EXISTS projects")
+            conn.execute("DROP TABLE IF EXISTS project_files")
+            conn.execute("PRAGMA user_version=0")
+        self.migrate()
+        self.detect_fts()
 
     def update_remote_id(self, remote_id: int, project_id: int):
         """Update remote id"""
-        self.conn.execute("UPDATE projects SET remote_id=? WHERE id=?", (remote_id, project_id))
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute("UPDATE projects SET remote_id=? WHERE id=?", (remote_id, project_id))
+
+    def sync_project_files(self, project_id: int, files: list[CatalogFile]):
+        """Bring the catalog rows of a project in line with its current file list, only writing rows that changed"""
+        with self.transaction() as conn:
+            existing = {}
+            for category, path, filename, sha1, size, mtime, remote_id in conn.execute(
+                    "SELECT category, path, filename, sha1, size, mtime, remote_id FROM project_files WHERE project_id=?",
+                    (project_id,)).fetchall():
+                existing[(category, path, filename)] = (sha1, size, mtime, remote_id)
+            changed = []
+            current = set()
+            for f in files:
+                key = (f.category, json.dumps(list(f.path)), f.filename)
+                current.add(key)
+                if existing.get(key) != (f.sha1, f.size, f.mtime, f.remote_id):
+                    changed.append((project_id, *key, f.sha1, f.size, f.mtime, f.remote_id))
+            removed = [(project_id, *key) for key in existing if key not in current]
+            if changed:
+                conn.executemany(
+                    "INSERT INTO project_files (project_id, category, path, filename, sha1, size, mtime, remote_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (project_id, category, path, filename) DO UPDATE SET sha1=excluded.sha1, size=excluded.size, mtime=excluded.mtime, remote_id=excluded.remote_id",
+                    changed)
+            if removed:
+                conn.executemany(
+                    "DELETE FROM project_files WHERE project_id=? AND category=? AND path=? AND filename=?", removed)
+
+    def _query_catalog(self, where: str, params: tuple) -> list[CatalogFile]:
+        data = self.execute(
+            "SELECT f.project_id, f.category, f.path, f.filename, f.sha1, f.size, f.mtime, f.remote_id, p.location "
+            f"FROM project_files f JOIN projects p ON p.id = f.project_id WHERE {where} ORDER BY f.project_id, f.path, f.filename",
+            params)
+        return [CatalogFile(project_id=d[0], category=d[1], path=tuple(json.loads(d[2])), filename=d[3], sha1=d[4],
+                            size=d[5], mtime=d[6], remote_id=d[7], project_path=d[8]) for d in data]
+
+    def find_files_by_sha1(self, sha1: str) -> list[CatalogFile]:
+        """Find files with the given sha1 across all projects"""
+        return self._query_catalog("f.sha1=?", (sha1,))
+
+    def find_files_by_filename(self, filename: str) -> list[CatalogFile]:
+        """Find files with the given filename across all projects"""
+        return self._query_catalog("f.filename=?", (filename,))
+
+    def get_project_file_catalog(self, project_id: int) -> list[CatalogFile]:
+        """Get the catalog rows of a project"""
+        return self._query_catalog("f.project_id=?", (project_id,))
+
+    def get_category_sizes(self, project_id: int = None) -> dict[str, int]:
+        """Get the total size of files per category for one project or across all projects"""
+        if project_id is None:
+            data = self.execute("SELECT category, SUM(size) FROM project_files GROUP BY category")
+        else:
+            data = self.execute(
+                "SELECT category, SUM(size) FROM project_files WHERE project_id=? GROUP BY category",
+                (project_id,))
+        return {d[0]: d[1] for d in data}
+
+    def get_projects_containing(self, sha1: str) -> list[int]:
+        """Get the ids of projects holding a file with the given sha1"""
+        return [d[0] for d in self.execute(
+            "SELECT DISTINCT project_id FROM project_files WHERE sha1=? ORDER BY project_id", (sha1,))]
+
+    def get_upload_journal(self, project_remote_id: int, category: str, path: tuple[str, ...], filename: str) -> dict | None:
+        """Get the journal entry of an unfinished chunked upload"""
+        data = self.execute_one(
+            "SELECT sha1, upload_id, offset, chunk_size FROM upload_journal WHERE project_remote_id=? AND category=? AND path=? AND filename=?",
+            (project_remote_id, category, json.dumps(list(path)), filename))
+        if data:
+            return {"sha1": data[0], "upload_id": data[1], "offset": data[2], "chunk_size": data[3]}
+        return None
+
+    def save_upload_journal(self, project_remote_id: int, category: str, path: tuple[str, ...], filename: str,
+                            sha1: str, upload_id: str, offset: int, chunk_size: int):
+        """Record the last offset acknowledged by the server for a chunked upload"""
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO upload_journal (project_remote_id, category, path, filename, sha1, upload_id, offset, chunk_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (project_remote_id, category, path, filename) DO UPDATE SET sha1=excluded.sha1, upload_id=excluded.upload_id, offset=excluded.offset, chunk_size=excluded.chunk_size, updated_at=CURRENT_TIMESTAMP",
+                (project_remote_id, category, json.dumps(list(path)), filename, sha1, upload_id, offset, chunk_size))
+
+    def delete_upload_journal(self, project_remote_id: int, category: str, path: tuple[str, ...], filename: str):
+        """Remove the journal entry of a finished chunked upload"""
+        with self.transaction() as conn:
+            conn.execute(
+                "DELETE FROM upload_journal WHERE project_remote_id=? AND category=? AND path=? AND filename=?",
+                (project_remote_id, category, json.dumps(list(path)), filename))
+
+    def save_analysis_result(self, key: str, project_id: int, data_path: str, analysis: DifferentialAnalysis):
+        """Add a differential analysis result to the result cache, replacing an earlier result at the same output"""
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO analysis_results (key, project_id, data_path, output_file, parameters) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (data_path, output_file) DO UPDATE SET key=excluded.key, project_id=excluded.project_id, parameters=excluded.parameters, created_at=CURRENT_TIMESTAMP",
+                (key, project_id, data_path, analysis.output_file, json.dumps(analysis.to_dict())))
+
+    def find_analysis_results(self, key: str) -> list[tuple[str, dict]]:
+        """Get the data folders and parameters of the cached results of a key, newest first"""
+        return [(d[0], json.loads(d[1])) for d in self.execute(
+            "SELECT data_path, parameters FROM analysis_results WHERE key=? ORDER BY created_at DESC, id DESC", (key,))]
+
+    _job_columns = "id, project_id, data_path, parameters, docker_image, status, cpus, memory, container, exit_code, error, log_path, created_at, started_at, finished_at"
+
+    @staticmethod
+    def _job_from_row(d: tuple) -> Job:
+        return Job(job_id=d[0], project_id=d[1], data_path=d[2], analysis=DifferentialAnalysis(**json.loads(d[3])),
+                   docker_image=d[4], status=d[5], cpus=d[6], memory=d[7], container=d[8], exit_code=d[9],
+                   error=d[10], log_path=d[11], created_at=d[12], started_at=d[13], finished_at=d[14])
+
+    def create_job(self, project_id: int, data_path: str, analysis: DifferentialAnalysis, docker_image: str,
+                   cpus: float, memory: int) -> Job:
+        """Queue a differential analysis job"""
+        with self.transaction() as conn:
+            job_id = conn.execute(
+                "INSERT INTO jobs (project_id, data_path, parameters, docker_image, status, cpus, memory) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (project_id, data_path, json.dumps(analysis.to_dict()), docker_image, cpus, memory)).lastrowid
+        return self.get_job(job_id)
+
+    def update_job(self, job_id: int, **fields):
+        """Update the state columns of a job, started_at and finished_at are set to the current time when passed as True"""
+        allowed = {"status", "container", "exit_code", "error", "log_path", "started_at", "finished_at"}
+        if not set(fields) <= allowed:
+            raise ValueError(f"Cannot update job columns {set(fields) - allowed}")
+        assignments = []
+        params = []
+        for column, value in fields.items():
+            if column in ("started_at", "finished_at") and value is True:
+                assignments.append(f"{column}=CURRENT_TIMESTAMP")
+            else:
+                assignments.append(f"{column}=?")
+                params.append(value)
+        with self.transaction() as conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(assignments)} WHERE id=?", (*params, job_id))
+
+    def claim_job(self, job_id: int) -> bool:
+        """Move a queued job to starting, False if another scheduler claimed or cancelled it first"""
+        with self.transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status='starting', started_at=CURRENT_TIMESTAMP WHERE id=? AND status='queued'",
+                (job_id,)).rowcount == 1
+
+    def get_stale_claims(self, seconds: float) -> list[int]:
+        """Get the jobs claimed more than seconds ago whose container was never recorded"""
+        return [d[0] for d in self.execute(
+            "SELECT id FROM jobs WHERE status='starting' AND started_at < datetime('now', ?) ORDER BY id",
+            (f"-{seconds} seconds",))]
+
+    def requeue_job(self, job_id: int) -> bool:
+        """Queue again a claimed job that did not start, False if it moved on in the meantime"""
+        with self.transaction() as conn:
+            return conn.execute("UPDATE jobs SET status='queued', started_at=NULL WHERE id=? AND status='starting'",
+                                (job_id,)).rowcount == 1
+
+    def get_job(self, job_id: int) -> Job:
+        """Get a job by id"""
+        data = self.execute_one(f"SELECT {self._job_columns} FROM jobs WHERE id=?", (job_id,))
+        if data is None:
+            raise ValueError(f"Job with id {job_id} not found")
+        return self._job_from_row(data)
+
+    def get_jobs(self, statuses: tuple[str, ...] = None, project_id: int = None) -> list[Job]:
+        """Get jobs in queue order, optionally only those with the given statuses or of one project"""
+        where = []
+        params = []
+        if statuses:
+            where.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params += list(statuses)
+        if project_id is not None:
+            where.append("project_id=?")
+            params.append(project_id)
+        query = f"SELECT {self._job_columns} FROM jobs"
+        if where:
+            query += f" WHERE {' AND '.join(where)}"
+        return [self._job_from_row(d) for d in self.execute(f"{query} ORDER BY id", tuple(params))]
+
+
+def _migrate_projects(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS projects (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, description TEXT, location TEXT, global_id TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, sha1_hash TEXT, remote_id INTEGER)")
+    # databases rebuilt by the old recreate_database lost the remote_id column
+    columns = [c[1] for c in conn.execute("PRAGMA table_info(projects)").fetchall()]
+    if "remote_id" not in columns:
+        conn.execute("ALTER TABLE projects ADD COLUMN remote_id INTEGER")
+
+
+def _migrate_upload_journal(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS upload_journal (id INTEGER PRIMARY KEY AUTOINCREMENT, project_remote_id INTEGER, category TEXT, path TEXT, filename TEXT, sha1 TEXT, upload_id TEXT, offset INTEGER, chunk_size INTEGER, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP, UNIQUE (project_remote_id, category, path, filename))")
+
+
+def _migrate_project_files(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS project_files (id INTEGER PRIMARY KEY AUTOINCREMENT, project_id INTEGER, category TEXT, path TEXT, filename TEXT, sha1 TEXT, size INTEGER, mtime INTEGER, remote_id INTEGER, UNIQUE (project_id, category, path, filename))")
+    conn.execute("CREATE INDEX IF NOT EXISTS project_files_sha1 ON project_files (sha1)")
+    conn.execute("CREATE INDEX IF NOT EXISTS project_files_filename ON project_files (filename)")
+
+
+def _migrate_projects_fts(conn: sqlite3.Connection):
+    """Create the FTS5 index over project name and description kept in sync by triggers, skipped if FTS5 is unavailable.
+    The trigram tokenizer lets searches match substrings, SQLite builds without it get a word index and searches use LIKE"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='projects_fts'").fetchone():
+        return
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE projects_fts USING fts5(name, description, content='projects', content_rowid='id', tokenize='trigram')")
+    except sqlite3.OperationalError:
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE projects_fts USING fts5(name, description, content='projects', content_rowid='id')")
+        except sqlite3.OperationalError:
+            return
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS projects_fts_insert AFTER INSERT ON projects BEGIN INSERT INTO projects_fts (rowid, name, description) VALUES (new.id, new.name, new.description); END")
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS projects_fts_delete AFTER DELETE ON projects BEGIN INSERT INTO projects_fts (projects_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); END")
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS projects_fts_update AFTER UPDATE ON projects BEGIN INSERT INTO projects_fts (projects_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); INSERT INTO projects_fts (rowid, name, description) VALUES (new.id, new.name, new.description); END")
+    conn.execute("INSERT INTO projects_fts (projects_fts) VALUES ('rebuild')")
+
+
+def _migrate_jobs(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, project_id INTEGER, data_path TEXT, parameters TEXT, docker_image TEXT, status TEXT, cpus REAL, memory INTEGER, container TEXT DEFAULT '', exit_code INTEGER, error TEXT DEFAULT '', log_path TEXT DEFAULT '', created_at DATETIME DEFAULT CURRENT_TIMESTAMP, started_at DATETIME, finished_at DATETIME)")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+
+
+def _migrate_analysis_results(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS analysis_results (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, project_id INTEGER, data_path TEXT, output_file TEXT, parameters TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, UNIQUE (data_path, output_file))")
+    conn.execute("CREATE INDEX IF NOT EXISTS analysis_results_key ON analysis_results (key)")
+
+
+# schema migrations in order, the position of a migration in this list is its schema version
+MIGRATIONS = [
+    _migrate_projects,
+    _migrate_upload_journal,
+    _migrate_project_files,
+    _migrate_projects_fts,
+    _migrate_jobs,
+    _migrate_analysis_results,
+]
 
 
 def load_project(project_folder: str) -> Project:
@@ -246,16 +771,60 @@ def load_project(project_folder: str) -> Project:
     with open(os.path.join(project_folder, "project.json"), "r") as f:
         project_dict = json.load(f)
         project = Project(**project_dict)
+    project.project_files = {cat: [ProjectFile(filename=i["filename"], path=tuple(i["path"]), sha1=i["sha1"])
+                                   for i in files] for cat, files in project.project_files.items()}
     return project
 
 
 class CorpusServer:
-    def __init__(self, host: str, api_key: str, local_db: ProjectDatabase = None):
+    def __init__(self, host: str, api_key: str, local_db: ProjectDatabase = None, concurrency: int = None,
+                 chunks_in_flight: int = None, http2: bool = None, hash_index: LocalHashIndex = None,
+                 transport: httpx.AsyncBaseTransport = None):
         self.host = host
         self.api_key = api_key
         self.post_project_path = f"{host}/api/projects"
         self.db = local_db
+        self.hash_index = hash_index
         self.settings = load_settings()
+        upload_settings = self.settings.get("upload", {})
+        self.concurrency = concurrency or upload_settings.get("concurrency", 4)
+        self.chunks_in_flight = chunks_in_flight or upload_settings.get("chunks_in_flight", 2)
+        if http2 is None:
+            http2 = upload_settings.get("http2", False)
+        # http2 support in httpx needs the optional h2 package
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        # requests go through this transport instead of the network when given, such as a LocalCorpus
+        self.transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self._client_loop = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared pooled client, created on first use and recreated if the event loop changes"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                headers={"X-API-Key": f"{self.api_key}"},
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=self.concurrency * 2,
+                                    max_keepalive_connections=self.concurrency * 2),
+                timeout=httpx.Timeout(60.0),
+                follow_redirects=True,
+                transport=self.transport)
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        """Close the shared client"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
 
     async def create_project(self, project: Project):
         """Create project on server"""
@@ -266,63 +835,56 @@ class CorpusServer:
             "metadata": project.to_dict(),
             "global_id": project.project_global_id
         }
-        async with httpx.AsyncClient(
-                headers={"X-API-Key": f"{self.api_key}", "content-type": "application/json"}) as client:
-            d = await client.post(self.post_project_path, json=payload)
-            project.remote_id = d.json()["id"]
-            project.refresh()
-            self.db.update_remote_id(project_id=project.project_id, remote_id=project.remote_id)
-            return project
+        d = await self.client.post(self.post_project_path, json=payload)
+        project.remote_id = d.json()["id"]
+        project.refresh()
+        self.db.update_remote_id(project_id=project.project_id, remote_id=project.remote_id)
+        return project
 
     async def update_project(self, project: Project):
         """Update project on server"""
-        async with httpx.AsyncClient(
-                headers={"X-API-Key": f"{self.api_key}", "content-type": "application/json"}) as client:
-            d = await client.patch(f"{self.post_project_path}/{project.remote_id}", json={
-                "name": project.project_name,
-                "description": project.description,
-                "hash": open(os.path.join(project.project_path, "project.sha1"), "rt").read(),
-                "metadata": json.dumps(project.to_dict()),
-                "global_id": project.project_global_id}
-                                   )
+        d = await self.client.patch(f"{self.post_project_path}/{project.remote_id}", json={
+            "name": project.project_name,
+            "description": project.description,
+            "hash": open(os.path.join(project.project_path, "project.sha1"), "rt").read(),
+            "metadata": json.dumps(project.to_dict()),
+            "global_id": project.project_global_id}
+                                    )
 
     async def get_project(self, project_id: int):
         """Get project from server"""
-        async with httpx.AsyncClient(headers={"X-API-Key": f"{self.api_key}"}) as client:
-            d = await client.get(f"{self.post_project_path}/{project_id}")
-            d = d.json()
-            print(d)
-            project = Project(
-                project_id=d["metadata"]["project_id"],
-                project_path=d["metadata"]["project_path"],
-                project_data_path=d["metadata"]["project_data_path"],
-                project_metadata={},
-                project_name=d["name"],
-                description=d["description"],
-                project_global_id=d["global_id"],
-                project_files=d["metadata"]["project_files"],
-                remote_id=d["id"],
-                project_hash=d["hash"]
-            )
-            return project
+        d = await self.client.get(f"{self.post_project_path}/{project_id}")
+        d = d.json()
+        project = Project(
+            project_id=d["metadata"]["project_id"],
+            project_path=d["metadata"]["project_path"],
+            project_data_path=d["metadata"]["project_data_path"],
+            project_metadata={},
+            project_name=d["name"],
+            description=d["description"],
+            project_global_id=d["global_id"],
+            project_files=d["metadata"]["project_files"],
+            remote_id=d["id"],
+            project_hash=d["hash"],
+            category_hashes=d["metadata"].get("category_hashes", {})
+        )
+        return project
 
     async def get_project_files(self, project_id: int):
         """Get project files from server"""
-        async with httpx.AsyncClient(headers={"X-API-Key": f"{self.api_key}"}) as client:
-            d = await client.get(f"{self.post_project_path}/{project_id}/files")
-            return d
+        d = await self.client.get(f"{self.post_project_path}/{project_id}/files")
+        return d
 
     async def remove_file(self, file: ProjectFile):
         """Remove file from server"""
-        async with httpx.AsyncClient(headers={"X-API-Key": f"{self.api_key}"}) as client:
-            d = await client.delete(f"{self.host}/api/files/{file.remote_id}")
-            if d.status_code == 204:
-                return True
-            else:
-                return False
+        d = await self.client.delete(f"{self.host}/api/files/{file.remote_id}")
+        if d.status_code == 204:
+            return True
+        else:
+            return False
 
-    async def remove_remote_file_not_in_local_project(self, project: Project):
-        """Check if file exists in project"""
+    async def remove_remote_file_not_in_local_project(self, project: Project, categories: list[str] = None):
+        """Check if file exists in project, only considering files of the given categories if provided"""
         files = await self.get_project_files(project.remote_id)
         files = files.json()
         result = {}
@@ -331,6 +893,8 @@ class CorpusServer:
             if f["path"]:
                 path = tuple(f["path"])
             cat = f["file_category"]
+            if categories is not None and cat not in categories:
+                continue
             p_f = ProjectFile(filename=f["filename"], sha1=f["hash"], remote_id=f["id"], path=path)
             if p_f not in project.project_files[cat]:
                 await self.remove_file(p_f)
@@ -340,76 +904,279 @@ class CorpusServer:
                 result[cat].append(f)
         return result
 
-    async def upload_file(self, project: Project):
-        """Get remote file lists. Check if file exists on server using ProjectFile.remote_id, if not, upload file, if they are, check if hash matches, if not, upload file"""
-        result = await self.remove_remote_file_not_in_local_project(project)
-        filename_map = {}
+    @staticmethod
+    def is_category_synced(project: Project, category: str, remote_category_hashes: dict[str, str] = None) -> bool:
+        """Check if a category subtree hash matches the remote one and every file in it is known to the server"""
+        if not remote_category_hashes or category not in remote_category_hashes:
+            return False
+        if project.category_hashes.get(category) != remote_category_hashes[category]:
+            return False
+        return all(file.remote_id for file in project.project_files.get(category, []))
 
-        for cat in self.settings["project_folders"]:
-            for i, file in enumerate(project.project_files[cat]):
-                if not file.remote_id:
-                    file = await self.upload_chunk(file, project, cat)
-                    project.project_files[cat][i].remote_id = file.remote_id
-                    yield file
+    async def upload_file(self, project: Project, remote_category_hashes: dict[str, str] = None):
+        """Get remote file lists. Check if file exists on server using ProjectFile.remote_id, if not, upload file, if they are, check if hash matches, if not, upload file.
+        Categories whose subtree hash matches remote_category_hashes are skipped entirely"""
+        changed = [cat for cat in self.settings["project_folders"] if
+                   not self.is_category_synced(project, cat, remote_category_hashes)]
+        if not changed:
+            return
+        result = await self.remove_remote_file_not_in_local_project(project, changed)
+        semaphore = asyncio.Semaphore(self.concurrency)
 
-    async def upload_chunk(self, file: ProjectFile, project: Project, category: str, offset: int = 0):
-        """Upload file in chunks"""
-        async with httpx.AsyncClient(headers={"X-API-Key": f"{self.api_key}"}) as client:
-            d = await client.post(f"{self.host}/api/files/chunked",
-                                  json={
-                                      "filename": file.filename,
-                                      "size": os.path.getsize(
-                                          os.path.join(project.project_data_path, *file.path, file.filename)),
-                                      "data_hash": file.sha1,
-                                      "file_category": category
-                                  })
-            upload_id = d.json()["upload_id"]
-            with open(os.path.join(project.project_data_path, *file.path, file.filename),
-                      "rb") as f:
-                # read the file in chunk of d.chunk_size and upload it
+        async def upload(cat: str, i: int, file: ProjectFile):
+            async with semaphore:
+                file = await self.upload_chunk(file, project, cat)
+                project.project_files[cat][i].remote_id = file.remote_id
+                return file
+
+        tasks = [asyncio.create_task(upload(cat, i, file)) for cat in changed for i, file in
+                 enumerate(project.project_files.get(cat, [])) if not file.remote_id]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def read_ahead(self, chunks: Iterator[tuple[int, bytes]]):
+        """Pull (position, chunk) pairs from a blocking iterator in a thread, keeping at most chunks_in_flight chunks
+        read ahead of the upload"""
+        queue = asyncio.Queue(maxsize=self.chunks_in_flight)
+
+        async def producer():
+            try:
                 while True:
-                    chunk = f.read(d.json()["chunk_size"])
-                    if not chunk:
+                    item = await asyncio.to_thread(next, chunks, None)
+                    if item is None:
                         break
-                    chunk_file = BytesIO(chunk)
+                    await queue.put(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put(e)
+                return
+            await queue.put(None)
+
+        task = asyncio.create_task(producer())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            task.cancel()
+
+    async def read_chunks(self, file_path: str, chunk_size: int, offset: int = 0):
+        """Read a file from offset in chunks of chunk_size, keeping at most chunks_in_flight chunks read ahead of the upload"""
+        def file_chunks():
+            with open(file_path, "rb") as f:
+                f.seek(offset)
+                position = offset
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    yield position, chunk
+                    position += len(chunk)
+
+        async for item in self.read_ahead(file_chunks()):
+            yield item
+
+    async def create_upload(self, filename: str, size: int, sha1: str, category: str = "") -> tuple[str, int]:
+        """Start a chunked upload on the server and return its upload id and chunk size"""
+        d = await self.client.post(f"{self.host}/api/files/chunked",
+                                   json={
+                                       "filename": filename,
+                                       "size": size,
+                                       "data_hash": sha1,
+                                       "file_category": category
+                                   })
+        return d.json()["upload_id"], d.json()["chunk_size"]
+
+    async def create_chunked_upload(self, file: ProjectFile, file_path: str, category: str) -> tuple[str, int]:
+        """Start a chunked upload of a project file on the server and return its upload id and chunk size"""
+        return await self.create_upload(file.filename, os.path.getsize(file_path), file.sha1, category)
+
+    async def upload_stream(self, source: TableSource, category: str = "",
+                            progress: Callable[[int, int], None] | None = None) -> str:
+        """Upload a table as a stream through the chunked upload protocol and return the upload id.
+        The stream is measured before it is sent, memory use does not depend on the size of the table"""
+        try:
+            size, sha1 = await asyncio.to_thread(source.measure)
+            upload_id, chunk_size = await self.create_upload(source.filename, size, sha1, category)
+            offset = 0
+            restarts = 0
+            while True:
+                # the server acknowledges chunks in offset order, the stream is produced again from the offset it reports
+                restart = False
+                async with contextlib.aclosing(self.read_ahead(rechunk(source.pieces(), chunk_size, offset))) as chunks:
+                    async for position, chunk in chunks:
+                        result = await self.client.post(f"{self.host}/api/files/chunked/{upload_id}",
+                                                        data={"offset": position}, files={"chunk": BytesIO(chunk)})
+                        result.raise_for_status()
+                        if result.json()["status"] == "complete":
+                            break
+                        offset = result.json()["offset"]
+                        if progress:
+                            progress(offset, size)
+                        if offset != position + len(chunk):
+                            restart = True
+                            break
+                if not restart:
+                    return upload_id
+                restarts += 1
+                if restarts > MAX_UPLOAD_RESTARTS:
+                    raise ValueError(f"Upload of {source.filename} restarted {MAX_UPLOAD_RESTARTS} times without completing")
+        finally:
+            # the compressed copy of the table is sent on every restart and only removed here
+            source.close()
+
+    async def submit_raw_data(self, source: TableSource, index_col: str, sample_cols: list[dict], metadata: dict = None,
+                              name: str = "", description: str = "",
+                              progress: Callable[[int, int], None] | None = None) -> httpx.Response:
+        """Stream a raw data table to the server and register it with its index and sample columns"""
+        upload_id = await self.upload_stream(source, progress=progress)
+        return await self.client.post(f"{self.host}/api/rawdata/", data={
+            "name": name,
+            "description": description,
+            "index_col": index_col,
+            "sample_cols": json.dumps(sample_cols),
+            "metadata": json.dumps(metadata or {}),
+            "file_type": source.file_type,
+            "compression": "gzip" if source.compress else "",
+            "upload_id": upload_id,
+        })
+
+    async def upload_chunk(self, file: ProjectFile, project: Project, category: str, offset: int = 0):
+        """Upload file in chunks, resuming from the upload journal if an earlier upload of the same file was interrupted"""
+        client = self.client
+        file_path = os.path.join(project.project_data_path, *file.path, file.filename)
+        journal_key = (project.remote_id, category, file.path, file.filename)
+        entry = self.db.get_upload_journal(*journal_key) if self.db else None
+        resumed = entry is not None and entry["sha1"] == file.sha1
+        if resumed:
+            upload_id, chunk_size, offset = entry["upload_id"], entry["chunk_size"], entry["offset"]
+        else:
+            upload_id, chunk_size = await self.create_chunked_upload(file, file_path, category)
+            if self.db:
+                self.db.save_upload_journal(*journal_key, file.sha1, upload_id, offset, chunk_size)
+        complete = False
+        restarts = 0
+        while not complete:
+            # the server acknowledges chunks in offset order, reading restarts if it reports a different offset
+            restart = False
+            async with contextlib.aclosing(self.read_chunks(file_path, chunk_size, offset)) as chunks:
+                async for position, chunk in chunks:
                     progress = await client.post(f"{self.host}/api/files/chunked/{upload_id}",
-                                                 data={"offset": offset}, files={"chunk": chunk_file})
+                                                 data={"offset": position}, files={"chunk": BytesIO(chunk)})
+                    if progress.is_error and resumed:
+                        # the server no longer knows the journaled upload so start again from byte zero
+                        upload_id, chunk_size = await self.create_chunked_upload(file, file_path, category)
+                        offset = 0
+                        resumed = False
+                        self.db.save_upload_journal(*journal_key, file.sha1, upload_id, offset, chunk_size)
+                        restart = True
+                        break
+                    progress.raise_for_status()
+                    resumed = False
                     if progress.json()["status"] == "complete":
                         break
-                    else:
-                        offset = progress.json()["offset"]
-                if file.remote_id:
-                    if category in ["unprocessed", "differential_analysis"] and (
-                            file.filename.endswith(".tsv") or file.filename.endswith(".txt") or file.filename.endswith(
-                            ".csv")):
-                        file = await client.post(f"{self.host}/api/files/chunked/{upload_id}/complete",
-                                                 json={"load_file_content": True, "file_id": file.remote_id})
-                    else:
-                        file = await client.post(f"{self.host}/api/files/chunked/{upload_id}/complete",
-                                                 json={"file_id": file.remote_id})
-                else:
-                    if category in ["unprocessed", "differential_analysis"] and (
-                            file.filename.endswith(".tsv") or file.filename.endswith(".txt") or file.filename.endswith(
-                            ".csv")):
-                        result = await client.post(f"{self.host}/api/files/chunked/{upload_id}/complete",
-                                                   json={"create_file": True, "load_file_content": True, "project_id": project.remote_id, "path": file.path})
-                    else:
-                        result = await client.post(f"{self.host}/api/files/chunked/{upload_id}/complete",
-                                                   json={"create_file": True, "project_id": project.remote_id, "path": file.path})
-                    file.remote_id = result.json()["id"]
-            return file
+                    offset = progress.json()["offset"]
+                    if self.db:
+                        self.db.save_upload_journal(*journal_key, file.sha1, upload_id, offset, chunk_size)
+                    if offset != position + len(chunk):
+                        restart = True
+                        break
+            complete = not restart
+            if restart:
+                restarts += 1
+                if restarts > MAX_UPLOAD_RESTARTS:
+                    # the journaled upload is not resumed again, the next save starts the file from byte zero
+                    if self.db:
+                        self.db.delete_upload_journal(*journal_key)
+                    raise ValueError(f"Upload of {file.filename} restarted {MAX_UPLOAD_RESTARTS} times without completing")
+        if file.remote_id:
+            if category in ["unprocessed", "differential_analysis"] and (
+                    file.filename.endswith(".tsv") or file.filename.endswith(".txt") or file.filename.endswith(
+                    ".csv")):
+                file = await client.post(f"{self.host}/api/files/chunked/{upload_id}/complete",
+                                         json={"load_file_content": True, "file_id": file.remote_id})
+            else:
+                file = await client.post(f"{self.host}/api/files/chunked/{upload_id}/complete",
+                                         json={"file_id": file.remote_id})
+        else:
+            if category in ["unprocessed", "differential_analysis"] and (
+                    file.filename.endswith(".tsv") or file.filename.endswith(".txt") or file.filename.endswith(
+                    ".csv")):
+                result = await client.post(f"{self.host}/api/files/chunked/{upload_id}/complete",
+                                           json={"create_file": True, "load_file_content": True, "project_id": project.remote_id, "path": file.path})
+            else:
+                result = await client.post(f"{self.host}/api/files/chunked/{upload_id}/complete",
+                                           json={"create_file": True, "project_id": project.remote_id, "path": file.path})
+            file.remote_id = result.json()["id"]
+        if self.db:
+            self.db.delete_upload_journal(*journal_key)
+        return file
 
     async def download_file(self, file: ProjectFile, project: Project):
-        """Download file from server"""
-        async with httpx.AsyncClient(headers={"X-API-Key": f"{self.api_key}", "accept": "*/*"}, follow_redirects=True) as client:
-            async with client.stream('GET', f'{self.host}/api/files/{file.remote_id}/download') as r:
-                with open(os.path.join(project.project_data_path, *file.path, file.filename), "wb") as f:
+        """Download file from server into a temporary file that is renamed into place once its sha1 is verified.
+        A partial temporary file left by an interrupted download is resumed with a Range request.
+        Files whose sha1 is found in the local hash index are linked or copied from disk instead"""
+        file_path = os.path.join(project.project_data_path, *file.path, file.filename)
+        if self.hash_index and file.sha1:
+            existing = self.hash_index.find(file.sha1)
+            if existing:
+                if os.path.abspath(existing) != os.path.abspath(file_path):
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    link_or_copy(existing, file_path)
+                return file
+        partial_folder = os.path.join(project.project_path, ".partial")
+        os.makedirs(partial_folder, exist_ok=True)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        partial_path = os.path.join(partial_folder, f"{file.remote_id}.part")
+        sha1_hash = hashlib.sha1()
+        offset = 0
+        if os.path.exists(partial_path):
+            with open(partial_path, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    sha1_hash.update(chunk)
+                    offset += len(chunk)
+        headers = {"accept": "*/*"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        async with self.client.stream('GET', f'{self.host}/api/files/{file.remote_id}/download',
+                                      headers=headers) as r:
+            # 416 means the partial file already holds the whole content
+            if not (offset and r.status_code == 416):
+                r.raise_for_status()
+                if offset and r.status_code != 206:
+                    # the server ignored the range so the download starts over
+                    offset = 0
+                    sha1_hash = hashlib.sha1()
+                with open(partial_path, "ab" if offset else "wb") as f:
                     async for chunk in r.aiter_bytes():
                         f.write(chunk)
-            #r = await client.get(f'{self.host}/api/files/{file.remote_id}/download')
-            #with open(os.path.join(project.project_data_path, *file.path, file.filename), "wb") as f:
-            #    f.write(r.content)
-            #r = requests.get(f'{self.host}/api/files/{file.remote_id}/download', headers={"X-API-Key": f"{self.api_key}"}, allow_redirects=True)
-            #with open(os.path.join(project.project_data_path, *file.path, file.filename), "wb") as f:
-            #    print(r.status_code)
-            #    f.write(r.content)
+                        sha1_hash.update(chunk)
+        if file.sha1 and sha1_hash.hexdigest() != file.sha1:
+            os.remove(partial_path)
+            raise ValueError(f"sha1 mismatch for downloaded file {file.filename}")
+        os.replace(partial_path, file_path)
+        return file
+
+    async def download_files(self, project: Project, categories: list[str] = None, jobs: int = None):
+        """Download project files of the given categories concurrently, yielding each file once it is downloaded"""
+        semaphore = asyncio.Semaphore(jobs or self.concurrency)
+
+        async def download(file: ProjectFile):
+            async with semaphore:
+                return await self.download_file(file, project)
+
+        if categories is None:
+            categories = list(project.project_files)
+        tasks = [asyncio.create_task(download(file)) for cat in categories for file in project.project_files[cat]]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
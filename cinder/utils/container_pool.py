@@ -0,0 +1,140 @@
+import json
+import os
+import shlex
+import threading
+import uuid
+
+from python_on_whales.exceptions import DockerException
+
+# folder of the project data folder through which batched and pooled jobs report their log and exit code
+JOB_FOLDER = ".cinder_jobs"
+
+POOL_LABEL = "cinder.pool"
+
+
+def pin_image(client, image: str, pull: bool = True) -> str:
+    """Pull an image if it is not present yet and return its repo digest, so every job runs the same build even if
+    the tag moves"""
+    if not client.image.exists(image):
+        if not pull:
+            return image
+        client.image.pull(image, quiet=True)
+    digests = client.image.inspect(image).repo_digests
+    return digests[0] if digests else image
+
+
+def image_entrypoint(client, image: str) -> list[str]:
+    """Entrypoint of an image, the coral arguments are appended to it"""
+    return list(client.image.inspect(image).config.entrypoint or [])
+
+
+def job_files(data_path: str, job_id: int) -> dict[str, str]:
+    """Host paths of the log, exit code and cancel marker files of a batched or pooled job"""
+    folder = os.path.join(data_path, JOB_FOLDER)
+    return {kind: os.path.join(folder, f"{job_id}.{kind}") for kind in ("log", "exit", "cancel")}
+
+
+def job_script(job_id: int, command: list[str]) -> str:
+    """Shell line running one job in a container with the project data folder at /data. The exit code is written
+    through a temporary file so a reader never sees a partial one, a job with a cancel marker is skipped and gets
+    cancelled as its exit code"""
+    prefix = f"/data/{JOB_FOLDER}/{job_id}"
+    run = " ".join(shlex.quote(part) for part in command)
+    return (f"if [ -e {prefix}.cancel ]; then echo cancelled > {prefix}.exit.tmp; "
+            f"else {run} > {prefix}.log 2>&1; echo $? > {prefix}.exit.tmp; fi; mv {prefix}.exit.tmp {prefix}.exit")
+
+
+def batch_script(jobs: list[tuple[int, list[str]]]) -> list[str]:
+    """Command running several jobs one after another in a single container invocation"""
+    return ["sh", "-c", "; ".join([f"mkdir -p /data/{JOB_FOLDER}"] + [job_script(i, c) for i, c in jobs])]
+
+
+class ContainerPool:
+    """Long lived idle containers of the coral image with a project data folder mounted at /data. Jobs are fed to
+    them with docker exec, so a job no longer pays for creating and starting a container. Containers are kept
+    between sessions and adopted again by the next pool"""
+
+    def __init__(self, client, size: int = 2):
+        self.client = client
+        self.size = size
+        self.lock = threading.Lock()
+        self.keys: dict[str, tuple] = {}
+        self.idle: list[str] = []
+
+    def adopt(self, busy: set[str] = frozenset()):
+        """Take over the pool containers left running by an earlier session, busy ones run recovered jobs"""
+        for container in self.client.container.list(filters={"label": POOL_LABEL}):
+            key = tuple(json.loads(container.config.labels[POOL_LABEL]))
+            with self.lock:
+                if container.name in self.keys:
+                    continue
+                self.keys[container.name] = key
+                if container.name not in busy:
+                    self.idle.append(container.name)
+
+    def acquire(self, data_path: str, image: str, cpus: float, memory: int) -> str:
+        """Return an idle container for the data folder, image and limits, starting one if there is none. The
+        oldest idle container of another kind makes room when the pool is full"""
+        key = (data_path, image, float(cpus), int(memory))
+        with self.lock:
+            for name in self.idle:
+                if self.keys[name] == key:
+                    self.idle.remove(name)
+                    return name
+            evict = self.idle.pop(0) if len(self.keys) >= self.size and self.idle else None
+            if evict:
+                del self.keys[evict]
+            name = f"cinder-warm-{uuid.uuid4().hex[:8]}"
+            self.keys[name] = key
+        if evict:
+            self.remove(evict)
+        try:
+            self.client.run(image=image, entrypoint="sleep", command=["infinity"], volumes=[(data_path, "/data")],
+                            name=name, detach=True, cpus=cpus, memory=f"{memory}m" if memory else None,
+                            labels={POOL_LABEL: json.dumps(list(key))})
+        except DockerException:
+            with self.lock:
+                del self.keys[name]
+            raise
+        return name
+
+    def execute(self, name: str, command: list[str]):
+        """Start a command in a pool container without waiting for it"""
+        self.client.container.execute(name, command, detach=True)
+
+    def running(self, name: str) -> bool:
+        try:
+            return self.client.container.inspect(name).state.running
+        except DockerException:
+            return False
+
+    def release(self, name: str):
+        """Return a container to the idle containers, a container that stopped is dropped"""
+        if not self.running(name):
+            self.discard(name)
+            return
+        with self.lock:
+            if name in self.keys and name not in self.idle:
+                self.idle.append(name)
+
+    def discard(self, name: str):
+        with self.lock:
+            self.keys.pop(name, None)
+            if name in self.idle:
+                self.idle.remove(name)
+        self.remove(name)
+
+    def remove(self, name: str):
+        try:
+            self.client.container.remove(name, force=True)
+        except DockerException:
+            pass
+
+    def close(self):
+        """Remove the idle containers, busy ones are left to finish their jobs"""
+        with self.lock:
+            idle, self.idle = self.idle, []
+            for name in idle:
+                del self.keys[name]
+        for name in idle:
+            self.remove(name)
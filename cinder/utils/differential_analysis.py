@@ -0,0 +1,208 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import dataclass, asdict, field
+
+from cinder.utils.blob_store import atomic_write
+from cinder.utils.hash_index import link_or_copy
+from cinder.utils.hashing import HashCache, sha1_file
+
+CORAL_IMAGE = "noatgnu/coral:0.0.1"
+
+# project data folder of each input of an analysis
+INPUT_FOLDERS = {
+    "unprocessed_file": "unprocessed",
+    "annotation_file": "sample_annotation",
+    "comparison_matrix_file": "comparison_matrix",
+}
+
+
+@dataclass
+class DifferentialAnalysis:
+    """Inputs and parameters of one noatgnu/coral differential analysis run, file names are relative to their
+    project data folders"""
+    unprocessed_file: str
+    annotation_file: str
+    comparison_matrix_file: str
+    output_file: str
+    index_cols: str
+    column_na_filter_threshold: float = 0.7
+    row_na_filter_threshold: float = 0.7
+    imputation_method: str = "knn"
+    normalization_method: str = "quantiles.robust"
+    aggregation_method: str = "MsCoreUtils::robustSummary"
+    aggregation_column: str = ""
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def command(self, data_root: str = "/data") -> list[str]:
+        """Command line of the coral container with the project data folder mounted at data_root"""
+        command = ["-u", os.path.join(data_root, "unprocessed", self.unprocessed_file),
+                   "-a", os.path.join(data_root, "sample_annotation", self.annotation_file),
+                   "-c", os.path.join(data_root, "comparison_matrix", self.comparison_matrix_file),
+                   "-o", os.path.join(data_root, "differential_analysis", self.output_file),
+                   "-x", self.index_cols,
+                   "-f", str(self.column_na_filter_threshold),
+                   "-r", str(self.row_na_filter_threshold),
+                   "-i", self.imputation_method,
+                   "-n", self.normalization_method]
+        if self.aggregation_column != "":
+            command += ["-g", self.aggregation_method, "-t", self.aggregation_column]
+        return command
+
+    def record_path(self, data_path: str) -> str:
+        """Path of the json record written next to the output in the project data folder"""
+        return os.path.join(data_path, "differential_analysis", f"{self.output_file}.json")
+
+    def output_paths(self, data_path: str) -> list[str]:
+        """Paths written by coral for this analysis, the output itself and any files sharing its name"""
+        output = os.path.join(data_path, "differential_analysis", self.output_file)
+        paths = [output] if os.path.exists(output) else []
+        paths += [p for p in sorted(glob.glob(f"{glob.escape(output)}.*")) if p != self.record_path(data_path)]
+        return paths
+
+    def canonical_parameters(self, docker_image: str) -> dict:
+        """Parameters that decide the result, the output name does not and numbers are compared by value"""
+        parameters = {k: float(v) if isinstance(v, (int, float)) else v for k, v in self.to_dict().items()
+                      if k != "output_file" and k not in INPUT_FOLDERS}
+        parameters["docker_image"] = docker_image
+        return parameters
+
+
+def input_hash(data_path: str, folder: str, filename: str, hash_cache: HashCache = None) -> str:
+    """Return the sha1 of an input file, taken from the project hash cache when the file is unchanged"""
+    file_path = os.path.join(data_path, folder, filename)
+    sha1 = None
+    if hash_cache is not None:
+        sha1 = hash_cache.get(f"{folder}/{filename}", os.stat(file_path))
+    return sha1 or sha1_file(file_path)
+
+
+def input_hashes(data_path: str, analysis: DifferentialAnalysis, hash_cache: HashCache = None) -> dict[str, str]:
+    """Return the sha1 of each input of an analysis"""
+    return {name: input_hash(data_path, folder, getattr(analysis, name), hash_cache)
+            for name, folder in INPUT_FOLDERS.items()}
+
+
+def analysis_key(analysis: DifferentialAnalysis, docker_image: str, inputs: dict[str, str]) -> str:
+    """Content address of an analysis result, the sha1 of the input hashes and the canonical parameters"""
+    canonical = json.dumps({"inputs": inputs, "parameters": analysis.canonical_parameters(docker_image)},
+                           sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def write_analysis_record(data_path: str, analysis: DifferentialAnalysis, docker_image: str, key: str = None,
+                          inputs: dict[str, str] = None):
+    """Record how a differential analysis output was made in a json file next to it"""
+    with atomic_write(analysis.record_path(data_path)) as f:
+        json.dump({"index_column": analysis.index_cols, "meta_data_columns": [], "docker_image": docker_image,
+                   "parameters": analysis.to_dict(), "command": analysis.command(), "key": key,
+                   "inputs": inputs or {}}, f, indent=2)
+
+
+def read_record_key(data_path: str, analysis: DifferentialAnalysis) -> str | None:
+    """Key in the record next to an analysis output, None if there is no readable record"""
+    try:
+        with open(analysis.record_path(data_path), "rt") as f:
+            return json.load(f).get("key")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def copy_output(source: str, destination: str) -> str:
+    return link_or_copy(source, destination, hardlink=False)
+
+
+def remove_outputs(data_path: str, analysis: DifferentialAnalysis):
+    """Remove the output files and record of an analysis before they are written again. Outputs placed by an
+    earlier version could be hardlinks shared with another project, which an in place write would change too"""
+    for path in analysis.output_paths(data_path) + [analysis.record_path(data_path)]:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+
+@dataclass
+class StaleOutput:
+    """An analysis output whose inputs changed or disappeared since it was made"""
+    output_file: str
+    changed: list[str] = field(default_factory=list)
+    missing: list[str] = field(default_factory=list)
+
+
+class AnalysisCache:
+    """Content addressed cache of differential analysis results. Results are found by the sha1 of their inputs and
+    canonical parameters in the analysis_results table of the local database and reused from whichever project
+    folder holds them"""
+
+    def __init__(self, db, hash_cache: HashCache = None):
+        self.db = db
+        self.hash_cache = hash_cache
+
+    def key(self, data_path: str, analysis: DifferentialAnalysis, docker_image: str) -> tuple[str, dict[str, str]]:
+        inputs = input_hashes(data_path, analysis, self.hash_cache)
+        return analysis_key(analysis, docker_image, inputs), inputs
+
+    def lookup(self, key: str) -> tuple[str, DifferentialAnalysis] | None:
+        """Return the data folder and analysis of a stored result whose output files still exist and whose record
+        next to them still carries the key, a result overwritten by a later run no longer does"""
+        for data_path, parameters in self.db.find_analysis_results(key):
+            analysis = DifferentialAnalysis(**parameters)
+            if analysis.output_paths(data_path) and read_record_key(data_path, analysis) == key:
+                return data_path, analysis
+        return None
+
+    def reuse(self, key: str, inputs: dict[str, str], project_id: int, data_path: str,
+              analysis: DifferentialAnalysis, docker_image: str) -> bool:
+        """Place the stored result of key at the output of analysis, return False if there is none"""
+        hit = self.lookup(key)
+        if hit is None:
+            return False
+        source_data_path, source = hit
+        if (source_data_path, source.output_file) != (data_path, analysis.output_file):
+            source_output = os.path.join(source_data_path, "differential_analysis", source.output_file)
+            output = os.path.join(data_path, "differential_analysis", analysis.output_file)
+            remove_outputs(data_path, analysis)
+            # copies, or reflinks where the file system has them, never hardlinks, so a later run of either
+            # project writing its output in place cannot change the other project's result
+            for path in source.output_paths(source_data_path):
+                destination = output + path[len(source_output):]
+                if os.path.isdir(path):
+                    shutil.copytree(path, destination, copy_function=copy_output)
+                else:
+                    copy_output(path, destination)
+        self.store(key, inputs, project_id, data_path, analysis, docker_image)
+        return True
+
+    def store(self, key: str, inputs: dict[str, str], project_id: int, data_path: str,
+              analysis: DifferentialAnalysis, docker_image: str):
+        """Write the record of a finished analysis and add it to the cache"""
+        write_analysis_record(data_path, analysis, docker_image, key, inputs)
+        self.db.save_analysis_result(key, project_id, data_path, analysis)
+
+    def stale(self, data_path: str) -> list[StaleOutput]:
+        """Compare the input hashes in the records of a project's analysis outputs with the current inputs"""
+        stale = []
+        for record_path in sorted(glob.glob(os.path.join(glob.escape(data_path), "differential_analysis", "*.json"))):
+            try:
+                with open(record_path, "rt") as f:
+                    record = json.load(f)
+                analysis = DifferentialAnalysis(**record["parameters"])
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            if not record.get("inputs"):
+                continue
+            result = StaleOutput(analysis.output_file)
+            for name, folder in INPUT_FOLDERS.items():
+                filename = getattr(analysis, name)
+                if not os.path.exists(os.path.join(data_path, folder, filename)):
+                    result.missing.append(filename)
+                elif input_hash(data_path, folder, filename, self.hash_cache) != record["inputs"].get(name):
+                    result.changed.append(filename)
+            if result.changed or result.missing:
+                stale.append(result)
+        return stale
@@ -0,0 +1,87 @@
+import os
+import shutil
+
+from cinder.utils.hashing import HashCache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request number of FICLONE on Linux, used to create copy-on-write reflinks on btrfs and xfs
+FICLONE = 0x40049409
+
+
+def reflink(source: str, destination: str):
+    """Create a copy-on-write clone of source at destination, raising OSError if the filesystem cannot do it"""
+    if fcntl is None:
+        raise OSError("reflink is not supported on this platform")
+    with open(source, "rb") as s, open(destination, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def link_or_copy(source: str, destination: str, hardlink: bool = True) -> str:
+    """Place an identical copy of source at destination using a reflink, a hardlink or a plain copy, in that order of preference.
+    Without hardlink the destination never shares its inode with source, so writing one in place cannot change the other.
+    Return the method that was used"""
+    temp_path = f"{destination}.link"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    method = "reflink"
+    try:
+        reflink(source, temp_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        try:
+            if not hardlink:
+                raise OSError("hardlinks not allowed")
+            os.link(source, temp_path)
+            method = "hardlink"
+        except OSError:
+            shutil.copyfile(source, temp_path)
+            method = "copy"
+    os.replace(temp_path, destination)
+    return method
+
+
+class LocalHashIndex:
+    """Content-addressed index of sha1 to on-disk file paths built from the hash caches of local projects"""
+
+    def __init__(self):
+        self.paths: dict[str, list[tuple[str, dict]]] = {}
+
+    @classmethod
+    def from_database(cls, db) -> "LocalHashIndex":
+        """Build the index from the hash caches of every project in the local project database"""
+        index = cls()
+        for location in db.get_project_locations():
+            index.add_project(location)
+        return index
+
+    def add_project(self, project_path: str, project_data_path: str = None):
+        """Add the files recorded in the hash cache of a project folder"""
+        if project_data_path is None:
+            project_data_path = os.path.join(project_path, "data")
+        cache_path = os.path.join(project_path, "project.sha1.cache")
+        if not os.path.exists(cache_path):
+            return
+        for relative_path, entry in HashCache(cache_path).entries.items():
+            file_path = os.path.join(project_data_path, *relative_path.split("/"))
+            self.add(entry["sha1"], file_path, entry)
+
+    def add(self, sha1: str, file_path: str, entry: dict = None):
+        """Add a file with known sha1, entry holds the size, mtime_ns and inode the hash was calculated for"""
+        self.paths.setdefault(sha1, []).append((file_path, entry))
+
+    def find(self, sha1: str) -> str | None:
+        """Return the path of a file with the given sha1 that has not changed since it was hashed"""
+        for file_path, entry in self.paths.get(sha1, []):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            if entry is None or (entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns and entry[
+                    "inode"] == stat.st_ino):
+                return file_path
+        return None
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+
+HASH_CHUNK_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+
+def sha1_file(file: str, chunk_size: int = HASH_CHUNK_SIZE, mmap_threshold: int = MMAP_THRESHOLD) -> str:
+    """Calculate sha1 hash of a file using large reads, memory mapping files at or above mmap_threshold bytes"""
+    sha1_hash = hashlib.sha1()
+    with open(file, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if mmap_threshold and size >= mmap_threshold:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                view = memoryview(m)
+                try:
+                    # hashlib releases the GIL for large updates so feed the mapping in slices
+                    for offset in range(0, size, chunk_size):
+                        sha1_hash.update(view[offset:offset + chunk_size])
+                finally:
+                    view.release()
+        else:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha1_hash.update(chunk)
+    return sha1_hash.hexdigest()
+
+
+def hash_files(files: list[str], max_workers: int | None = None,
+                progress: Callable[[int, int], None] | None = None) -> dict[str, str]:
+    """Calculate sha1 hashes of many files concurrently in a thread pool and return a mapping of file to sha1.
+    progress is called with the number of hashed files and the total after each file, an exception raised from it
+    cancels the files that have not started hashing yet"""
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+    result = {}
+    if len(files) <= 1 or max_workers <= 1:
+        for file in files:
+            result[file] = sha1_file(file)
+            if progress:
+                progress(len(result), len(files))
+        return result
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(files)))
+    try:
+        futures = {executor.submit(sha1_file, file): file for file in files}
+        for future in as_completed(futures):
+            result[futures[future]] = future.result()
+            if progress:
+                progress(len(result), len(files))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return result
+
+
+def tree_hash(entries: list[tuple[str, str]]) -> str:
+    """Combine (name, digest) pairs into a single digest that does not depend on the order of the entries"""
+    sha1_hash = hashlib.sha1()
+    for name, digest in sorted(entries):
+        sha1_hash.update(f"{name}\0{digest}\n".encode("utf-8"))
+    return sha1_hash.hexdigest()
+
+
+class HashCache:
+    """Persistent cache of file sha1 hashes keyed by relative path, size, mtime and inode"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        """Load cache entries from disk, starting empty if the cache file is missing or unreadable"""
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "rt") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def save(self):
+        """Write cache entries to disk through a temporary file so an interrupted save keeps the old cache"""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wt") as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
+
+    def get(self, relative_path: str, stat: os.stat_result) -> str | None:
+        """Return cached sha1 if the file stat still matches the cached entry"""
+        entry = self.entries.get(relative_path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns and entry[
+                "inode"] == stat.st_ino:
+            self.hits += 1
+            return entry["sha1"]
+        self.misses += 1
+        return None
+
+    def put(self, relative_path: str, stat: os.stat_result, sha1: str):
+        """Store sha1 of a file together with its stat"""
+        self.entries[relative_path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "inode": stat.st_ino,
+            "sha1": sha1
+        }
+
+    def prune(self, relative_paths: set[str]):
+        """Remove entries of files that are no longer present"""
+        for relative_path in list(self.entries):
+            if relative_path not in relative_paths:
+                del self.entries[relative_path]
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,460 @@
+import os
+import threading
+import time
+from typing import Callable
+
+from python_on_whales import docker
+from python_on_whales.exceptions import DockerException
+
+from cinder.utils.common import Job, Project, ProjectDatabase, app_dir
+from cinder.utils.container_pool import JOB_FOLDER, ContainerPool, batch_script, image_entrypoint, job_files, \
+    pin_image
+from cinder.utils.differential_analysis import CORAL_IMAGE, AnalysisCache, DifferentialAnalysis, remove_outputs
+from cinder.utils.hashing import HashCache
+
+FINISHED_STATUSES = ("done", "cached", "failed", "cancelled")
+
+# container: a container per job, or per batch of jobs when batch_size is above 1
+# warm: jobs are executed in long lived pool containers
+EXECUTION_MODES = ("container", "warm")
+
+# seconds between checks of the log and exit code files of batched and pooled jobs
+POLL_INTERVAL = 0.5
+
+# seconds after which a job claimed by a scheduler that never recorded its container is queued again
+CLAIM_TIMEOUT = 900
+
+
+def container_name(job_id: int) -> str:
+    return f"cinder-job-{job_id}"
+
+
+def batch_container_name(job_id: int) -> str:
+    return f"cinder-batch-{job_id}"
+
+
+class JobScheduler:
+    """Run queued differential analysis jobs in coral containers, as many containers at a time as max_jobs,
+    max_cpus and max_memory (MB) allow. Consecutive jobs of the same project and limits are grouped into batches of
+    up to batch_size jobs that run one after another in a single container, and in warm mode batches are executed
+    in long lived pool containers instead of new ones. Job state lives in the jobs table so a restarted scheduler
+    reattaches to jobs that kept running, collects the ones that finished and queues again the ones that
+    disappeared. A job is claimed in the table before it starts, so several schedulers sharing the database never
+    run the same job, and with own_jobs_only a scheduler only runs the jobs submitted through it"""
+
+    def __init__(self, db: ProjectDatabase, max_jobs: int = 2, max_cpus: float = None, max_memory: int = None,
+                 client=docker, log_dir: str = None,
+                 on_update: Callable[[Job], None] | None = None,
+                 on_log: Callable[[Job, str], None] | None = None, use_cache: bool = True,
+                 mode: str = "container", batch_size: int = 1, pin: bool = True, pool_size: int = None,
+                 images: list[str] = (), own_jobs_only: bool = False):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode {mode}")
+        self.db = db
+        self.max_jobs = max_jobs
+        self.max_cpus = max_cpus or os.cpu_count() or 1
+        self.max_memory = max_memory
+        self.client = client
+        self.log_dir = log_dir or os.path.join(app_dir.user_log_dir, "jobs")
+        self.on_update = on_update
+        self.on_log = on_log
+        self.use_cache = use_cache
+        self.mode = mode
+        self.batch_size = max(1, batch_size)
+        self.pin = pin
+        self.images = list(images)
+        self.pool = ContainerPool(client, pool_size or max_jobs) if mode == "warm" else None
+        self.job_ids: set[int] | None = set() if own_jobs_only else None
+        # cache keys and input hashes of the jobs started by this scheduler, taken before their container starts
+        self.inputs: dict[int, tuple[str, dict[str, str]]] = {}
+        # running batches by the id of their first job, a single job is a batch of one
+        self.batches: dict[int, list[Job]] = {}
+        self.batch_of: dict[int, int] = {}
+        self.pinned: dict[str, str] = {}
+        self.entrypoints: dict[str, list[str]] = {}
+        self.lock = threading.Lock()
+        self.image_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.dispatcher: threading.Thread | None = None
+
+    @classmethod
+    def from_settings(cls, db: ProjectDatabase, settings: dict, **kwargs) -> "JobScheduler":
+        job_settings = settings.get("jobs", {})
+        return cls(db, max_jobs=job_settings.get("max_jobs", 2), max_cpus=job_settings.get("max_cpus"),
+                   max_memory=job_settings.get("max_memory"), mode=job_settings.get("mode", "container"),
+                   batch_size=job_settings.get("batch_size", 1), pin=job_settings.get("pin_image", True),
+                   pool_size=job_settings.get("pool_size"),
+                   images=[job_settings.get("docker_image", CORAL_IMAGE)], **kwargs)
+
+    def submit(self, project: Project, analysis: DifferentialAnalysis, cpus: float = 2, memory: int = 4096,
+               docker_image: str = CORAL_IMAGE) -> Job:
+        """Queue an analysis of a project, a job asking for more than the caps is capped to them"""
+        cpus = min(cpus, self.max_cpus)
+        if self.max_memory:
+            memory = min(memory, self.max_memory)
+        job = self.db.create_job(project.project_id, project.project_data_path, analysis, docker_image, cpus, memory)
+        if self.job_ids is not None:
+            self.job_ids.add(job.job_id)
+        self.notify(job)
+        self.wakeup.set()
+        return job
+
+    def cancel(self, job_id: int):
+        """Cancel a queued job or stop a running one. A job running in a batch or pool container cannot be stopped
+        on its own, it runs to the end and its result is dropped"""
+        with self.lock:
+            job = self.db.get_job(job_id)
+            if job.status not in ("queued", "starting", "running"):
+                return
+            if job.status == "queued":
+                self.db.update_job(job_id, status="cancelled", finished_at=True)
+                self.notify(self.db.get_job(job_id))
+                return
+            self.db.update_job(job_id, status="cancelled")
+        if job.container.startswith("cinder-job-"):
+            try:
+                self.client.container.stop(job.container)
+            except DockerException:
+                pass
+        else:
+            # jobs of a batch that have not started yet are skipped by the batch script
+            os.makedirs(os.path.join(job.data_path, JOB_FOLDER), exist_ok=True)
+            open(job_files(job.data_path, job_id)["cancel"], "w").close()
+
+    def owns(self, job: Job) -> bool:
+        return self.job_ids is None or job.job_id in self.job_ids
+
+    def notify(self, job: Job):
+        if self.on_update:
+            self.on_update(job)
+
+    def image(self, tag: str) -> str:
+        """Image reference the jobs of a tag run with. With pinning this is the digest the tag pointed to when it was
+        first used in this session, pulled if it was not present"""
+        if not self.pin:
+            return tag
+        with self.image_lock:
+            if tag not in self.pinned:
+                self.pinned[tag] = pin_image(self.client, tag)
+            return self.pinned[tag]
+
+    def entrypoint(self, image: str) -> list[str]:
+        with self.image_lock:
+            if image not in self.entrypoints:
+                self.entrypoints[image] = image_entrypoint(self.client, image)
+            return self.entrypoints[image]
+
+    def prepare(self):
+        """Pull and pin the configured images ahead of the first job"""
+        for image in self.images:
+            try:
+                self.image(image)
+            except DockerException:
+                pass
+
+    def start(self):
+        """Recover the jobs left by a previous run and start dispatching queued jobs"""
+        self.recover()
+        self.stopping.clear()
+        if self.pin and self.images:
+            threading.Thread(target=self.prepare, name="cinder-image-pull", daemon=True).start()
+        self.dispatcher = threading.Thread(target=self.dispatch, name="cinder-job-dispatcher", daemon=True)
+        self.dispatcher.start()
+
+    def stop(self, close_pool: bool = False):
+        """Stop dispatching, running jobs keep running and are reattached by the next start. Idle pool containers
+        stay warm for the next session unless close_pool is set"""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.dispatcher:
+            self.dispatcher.join()
+        if close_pool and self.pool:
+            self.pool.close()
+
+    def recover(self):
+        groups: dict[str, list[Job]] = {}
+        for job in self.db.get_jobs(("running",)):
+            if job.job_id not in self.batch_of and self.owns(job):
+                groups.setdefault(job.container, []).append(job)
+        if self.pool:
+            self.pool.adopt(busy=set(groups))
+        for container, jobs in groups.items():
+            exists = bool(container) and self.client.container.exists(container)
+            if container.startswith("cinder-job-"):
+                recovered = jobs if exists else []
+            else:
+                # jobs that wrote their exit code are collected even if their container is gone
+                recovered = [j for j in jobs if exists or os.path.exists(job_files(j.data_path, j.job_id)["exit"])]
+            for job in jobs:
+                if job not in recovered:
+                    self.db.update_job(job.job_id, status="queued", container="")
+                    self.notify(self.db.get_job(job.job_id))
+            if not recovered:
+                continue
+            self.register(recovered)
+            if container.startswith("cinder-job-"):
+                threading.Thread(target=self.guard, args=(recovered, self.follow, recovered[0]), daemon=True).start()
+            else:
+                threading.Thread(target=self.guard, args=(recovered, self.follow_files, recovered, container),
+                                 daemon=True).start()
+
+    def register(self, batch: list[Job]):
+        with self.lock:
+            self.batches[batch[0].job_id] = batch
+            for job in batch:
+                self.batch_of[job.job_id] = batch[0].job_id
+
+    def idle(self) -> bool:
+        """Whether no job is running or queued"""
+        with self.lock:
+            return not self.batches and not any(self.owns(j) for j in self.db.get_jobs(("queued",)))
+
+    def fits(self, job: Job) -> bool:
+        if len(self.batches) >= self.max_jobs:
+            return False
+        if not self.batches:
+            # a lone job always runs, its own limits are capped at submit
+            return True
+        cpus = sum(b[0].cpus for b in self.batches.values())
+        memory = sum(b[0].memory for b in self.batches.values())
+        if cpus + job.cpus > self.max_cpus:
+            return False
+        if self.max_memory and memory + job.memory > self.max_memory:
+            return False
+        return True
+
+    @staticmethod
+    def batchable(first: Job, job: Job) -> bool:
+        return (first.data_path, first.docker_image, first.cpus, first.memory) == (
+            job.data_path, job.docker_image, job.cpus, job.memory)
+
+    def dispatch(self):
+        while not self.stopping.is_set():
+            self.wakeup.clear()
+            self.release_stale_claims()
+            queued = [j for j in self.db.get_jobs(("queued",)) if self.owns(j)]
+            # batches start in queue order, a batch that does not fit holds back the ones behind it
+            while queued:
+                batch = [queued.pop(0)]
+                while queued and len(batch) < self.batch_size and self.batchable(batch[0], queued[0]):
+                    batch.append(queued.pop(0))
+                with self.lock:
+                    if not self.fits(batch[0]):
+                        break
+                    # jobs another scheduler claimed or that were cancelled since they were read are left out
+                    batch = [j for j in batch if self.db.claim_job(j.job_id)]
+                if not batch:
+                    continue
+                self.register(batch)
+                threading.Thread(target=self.run, args=(batch,), daemon=True).start()
+            self.wakeup.wait(5)
+
+    def release_stale_claims(self):
+        """Queue again the jobs claimed by a scheduler that stopped before starting them"""
+        for job_id in self.db.get_stale_claims(CLAIM_TIMEOUT):
+            with self.lock:
+                if job_id in self.batch_of or not self.db.requeue_job(job_id):
+                    continue
+            self.notify(self.db.get_job(job_id))
+
+    def analysis_cache(self, job: Job) -> AnalysisCache:
+        """Result cache reading input hashes from the hash cache of the job's project, which is read only here"""
+        hash_cache_path = os.path.join(os.path.dirname(job.data_path), "project.sha1.cache")
+        return AnalysisCache(self.db, HashCache(hash_cache_path) if os.path.exists(hash_cache_path) else None)
+
+    def run(self, batch: list[Job]):
+        ready = []
+        for job in batch:
+            try:
+                cache = self.analysis_cache(job)
+                key, inputs = cache.key(job.data_path, job.analysis, job.docker_image)
+                if self.use_cache and cache.reuse(key, inputs, job.project_id, job.data_path, job.analysis,
+                                                  job.docker_image):
+                    self.finish(job, "cached")
+                    continue
+            except Exception as e:
+                # a broken record or database error fails the job instead of leaving it holding its slot
+                self.finish(job, "failed", error=str(e))
+                continue
+            if self.db.get_job(job.job_id).status == "cancelled":
+                self.finish(job, "cancelled")
+                continue
+            self.inputs[job.job_id] = (key, inputs)
+            ready.append(job)
+        if not ready:
+            return
+        if self.mode == "container" and len(ready) == 1:
+            self.guard(ready, self.run_container, ready[0])
+        else:
+            self.guard(ready, self.run_batch, ready)
+
+    def guard(self, jobs: list[Job], target, *args):
+        """Run target, failing the jobs it left unfinished if it raises so they do not hold their slot forever"""
+        try:
+            target(*args)
+        except Exception as e:
+            with self.lock:
+                unfinished = [j for j in jobs if j.job_id in self.batch_of]
+            for job in unfinished:
+                self.finish(job, "failed", error=str(e))
+
+    def run_container(self, job: Job):
+        job.container = container_name(job.job_id)
+        job.log_path = os.path.join(self.log_dir, f"{job.job_id}.log")
+        try:
+            # a container left by a scheduler that stopped before recording the start is picked up as it is
+            if not self.client.container.exists(job.container):
+                remove_outputs(job.data_path, job.analysis)
+                self.client.run(image=self.image(job.docker_image), command=job.analysis.command(),
+                                volumes=[(job.data_path, "/data")], name=job.container, detach=True,
+                                cpus=job.cpus, memory=f"{job.memory}m" if job.memory else None,
+                                labels={"cinder.job": str(job.job_id)})
+        except DockerException as e:
+            self.finish(job, "failed", error=str(e))
+            return
+        # a job cancelled while its container was being created keeps its status and is stopped
+        cancelled = self.db.get_job(job.job_id).status == "cancelled"
+        self.db.update_job(job.job_id, status="cancelled" if cancelled else "running", container=job.container,
+                           log_path=job.log_path, started_at=True)
+        self.notify(self.db.get_job(job.job_id))
+        if cancelled:
+            try:
+                self.client.container.stop(job.container)
+            except DockerException:
+                pass
+        self.follow(job)
+
+    def run_batch(self, jobs: list[Job]):
+        """Run jobs one after another in one container invocation, a new container or a warm pool container, which
+        reports the log and exit code of each job through files in the mounted data folder"""
+        first = jobs[0]
+        os.makedirs(os.path.join(first.data_path, JOB_FOLDER), exist_ok=True)
+        for job in jobs:
+            remove_outputs(job.data_path, job.analysis)
+            for path in job_files(job.data_path, job.job_id).values():
+                if os.path.exists(path):
+                    os.remove(path)
+        try:
+            image = self.image(first.docker_image)
+            command = batch_script([(j.job_id, self.entrypoint(image) + j.analysis.command()) for j in jobs])
+            if self.pool:
+                container = self.pool.acquire(first.data_path, image, first.cpus, first.memory)
+                self.pool.execute(container, command)
+            else:
+                container = batch_container_name(first.job_id)
+                self.client.run(image=image, entrypoint=command[0], command=command[1:],
+                                volumes=[(first.data_path, "/data")], name=container, detach=True, cpus=first.cpus,
+                                memory=f"{first.memory}m" if first.memory else None,
+                                labels={"cinder.job": str(first.job_id)})
+        except DockerException as e:
+            for job in jobs:
+                self.finish(job, "failed", error=str(e))
+            return
+        for job in jobs:
+            job.container = container
+            job.log_path = job_files(job.data_path, job.job_id)["log"]
+            if self.db.get_job(job.job_id).status == "cancelled":
+                continue
+            self.db.update_job(job.job_id, status="running", container=container, log_path=job.log_path,
+                               started_at=True)
+            self.notify(self.db.get_job(job.job_id))
+        self.follow_files(jobs, container)
+
+    def follow(self, job: Job):
+        """Stream the container log to the job log file until the container exits, then collect the result. The log
+        is written from the start so a reattached job gets the whole log again"""
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            with open(job.log_path, "wt") as f:
+                for _, line in self.client.container.logs(job.container, follow=True, stream=True):
+                    text = line.decode("utf-8", errors="replace")
+                    f.write(text)
+                    f.flush()
+                    if self.on_log:
+                        self.on_log(job, text)
+            exit_code = self.client.container.wait(job.container)
+            self.client.container.remove(job.container)
+        except DockerException as e:
+            self.finish(job, "failed", error=str(e))
+            return
+        self.collect(job, exit_code)
+
+    def container_running(self, container: str) -> bool:
+        try:
+            return self.client.container.inspect(container).state.running
+        except DockerException:
+            return False
+
+    def tail(self, job: Job, position: int) -> int:
+        """Pass the log written since position to on_log and return the new position"""
+        if not os.path.exists(job.log_path):
+            return position
+        with open(job.log_path, "rb") as f:
+            f.seek(position)
+            data = f.read()
+        if data and self.on_log:
+            self.on_log(job, data.decode("utf-8", errors="replace"))
+        return position + len(data)
+
+    def follow_files(self, jobs: list[Job], container: str):
+        """Follow the log and exit code files of the jobs of a batch in the order they run"""
+        results = []
+        for job in jobs:
+            files = job_files(job.data_path, job.job_id)
+            position = 0
+            while not os.path.exists(files["exit"]):
+                position = self.tail(job, position)
+                if not self.container_running(container) and not os.path.exists(files["exit"]):
+                    break
+                time.sleep(POLL_INTERVAL)
+            self.tail(job, position)
+            if os.path.exists(files["exit"]):
+                with open(files["exit"], "rt") as f:
+                    exit_code = f.read().strip()
+                results.append((job, int(exit_code) if exit_code.lstrip("-").isdigit() else None, ""))
+            else:
+                results.append((job, None, "container stopped before the job finished"))
+            if job is not jobs[-1]:
+                self.collect(*results.pop())
+        # the container is handed back before the last job frees the slot of the batch
+        if container.startswith("cinder-warm-"):
+            if self.pool:
+                self.pool.release(container)
+        else:
+            try:
+                self.client.container.wait(container)
+                self.client.container.remove(container)
+            except DockerException:
+                pass
+        self.collect(*results.pop())
+
+    def collect(self, job: Job, exit_code: int | None, error: str = ""):
+        """Record the result of a job whose container or script finished"""
+        if error:
+            self.finish(job, "failed", exit_code=exit_code, error=error)
+        elif self.db.get_job(job.job_id).status == "cancelled" or exit_code is None:
+            self.finish(job, "cancelled", exit_code=exit_code)
+        elif exit_code == 0:
+            cache = self.analysis_cache(job)
+            if job.job_id in self.inputs:
+                key, inputs = self.inputs.pop(job.job_id)
+            else:
+                # reattached after a restart, the inputs are taken as they are now
+                key, inputs = cache.key(job.data_path, job.analysis, job.docker_image)
+            cache.store(key, inputs, job.project_id, job.data_path, job.analysis, job.docker_image)
+            self.finish(job, "done", exit_code=exit_code)
+        else:
+            self.finish(job, "failed", exit_code=exit_code, error=f"container exited with {exit_code}")
+
+    def finish(self, job: Job, status: str, exit_code: int = None, error: str = ""):
+        self.inputs.pop(job.job_id, None)
+        with self.lock:
+            self.db.update_job(job.job_id, status=status, exit_code=exit_code, error=error, finished_at=True)
+            batch_id = self.batch_of.pop(job.job_id, None)
+            if batch_id in self.batches:
+                self.batches[batch_id] = [j for j in self.batches[batch_id] if j.job_id != job.job_id]
+                if not self.batches[batch_id]:
+                    del self.batches[batch_id]
+        self.notify(self.db.get_job(job.job_id))
+        self.wakeup.set()
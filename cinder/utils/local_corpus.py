@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import uuid
+from collections import Counter
+from urllib.parse import parse_qsl
+
+import httpx
+
+# size of the pieces a download is streamed and throttled in
+DOWNLOAD_PIECE_SIZE = 64 * 1024
+
+ROUTES = [
+    ("POST", re.compile(r"^/api/projects/?$"), "create_project"),
+    ("GET", re.compile(r"^/api/projects/(\d+)/?$"), "get_project"),
+    ("PATCH", re.compile(r"^/api/projects/(\d+)/?$"), "update_project"),
+    ("GET", re.compile(r"^/api/projects/(\d+)/files/?$"), "project_files"),
+    ("DELETE", re.compile(r"^/api/files/(\d+)/?$"), "delete_file"),
+    ("GET", re.compile(r"^/api/files/(\d+)/download/?$"), "download_file"),
+    ("POST", re.compile(r"^/api/files/chunked/?$"), "create_upload"),
+    ("POST", re.compile(r"^/api/files/chunked/([\w-]+)/complete/?$"), "complete_upload"),
+    ("POST", re.compile(r"^/api/files/chunked/([\w-]+)/?$"), "upload_chunk"),
+    ("POST", re.compile(r"^/api/rawdata/?$"), "create_raw_data"),
+]
+
+
+def parse_multipart(body: bytes, content_type: str) -> tuple[dict[str, str], dict[str, bytes]]:
+    """Split a multipart/form-data body into its fields and files"""
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode()
+    fields, files = {}, {}
+    for part in body.split(b"--" + boundary)[1:-1]:
+        head, _, content = part[2:].partition(b"\r\n\r\n")
+        content = content[:-2]
+        disposition = next((line for line in head.decode("utf-8").split("\r\n")
+                            if line.lower().startswith("content-disposition")), "")
+        name = re.search(r'\bname="([^"]*)"', disposition)
+        if name is None:
+            continue
+        if re.search(r'\bfilename="', disposition):
+            files[name.group(1)] = content
+        else:
+            fields[name.group(1)] = content.decode("utf-8")
+    return fields, files
+
+
+class ThrottledFile(httpx.AsyncByteStream):
+    """Body of a download read from disk in pieces, each piece waits for its share of the link bandwidth"""
+
+    def __init__(self, corpus: "LocalCorpus", path: str, offset: int = 0):
+        self.corpus = corpus
+        self.path = path
+        self.offset = offset
+
+    async def __aiter__(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            for piece in iter(lambda: f.read(DOWNLOAD_PIECE_SIZE), b""):
+                await self.corpus.throttle(len(piece))
+                self.corpus.bytes_sent += len(piece)
+                yield piece
+
+
+class LocalCorpus(httpx.AsyncBaseTransport):
+    """In-process stand-in of the Corpus REST API used by CorpusServer, for measuring and checking sync without a
+    real deployment. Pass it as the transport of a CorpusServer. Every request waits latency seconds and every body
+    waits for its turn on one link of bandwidth bytes per second shared by all requests. File contents are kept
+    under storage_dir so they do not count towards the memory of the client. Requests are counted per endpoint"""
+
+    def __init__(self, storage_dir: str, latency: float = 0.0, bandwidth: float = None,
+                 chunk_size: int = 1024 * 1024, api_key: str = None):
+        self.storage_dir = storage_dir
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.chunk_size = chunk_size
+        self.api_key = api_key
+        os.makedirs(os.path.join(storage_dir, "files"), exist_ok=True)
+        os.makedirs(os.path.join(storage_dir, "uploads"), exist_ok=True)
+        self.projects: dict[int, dict] = {}
+        self.files: dict[int, dict] = {}
+        self.uploads: dict[str, dict] = {}
+        self.raw_data: dict[int, dict] = {}
+        self.next_id = 1
+        self._link_free_at = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.requests = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def new_id(self) -> int:
+        self.next_id += 1
+        return self.next_id - 1
+
+    def file_path(self, file_id: int) -> str:
+        return os.path.join(self.storage_dir, "files", str(file_id))
+
+    async def throttle(self, size: int):
+        """Wait until size bytes went through the shared link"""
+        if not self.bandwidth or not size:
+            return
+        now = asyncio.get_running_loop().time()
+        self._link_free_at = max(now, self._link_free_at) + size / self.bandwidth
+        await asyncio.sleep(self._link_free_at - now)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        self.bytes_received += len(body)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        await self.throttle(len(body))
+        if self.api_key is not None and request.headers.get("X-API-Key") != self.api_key:
+            return httpx.Response(401, json={"detail": "Invalid API key"})
+        for method, pattern, name in ROUTES:
+            match = pattern.match(request.url.path)
+            if match and request.method == method:
+                self.requests[name] += 1
+                response = await getattr(self, name)(request, body, *match.groups())
+                if not isinstance(response.stream, ThrottledFile):
+                    content = response.read()
+                    self.bytes_sent += len(content)
+                    await self.throttle(len(content))
+                return response
+        self.requests["not_found"] += 1
+        return httpx.Response(404, json={"detail": "Not found"})
+
+    @staticmethod
+    def form(request: httpx.Request, body: bytes) -> tuple[dict[str, str], dict[str, bytes]]:
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            return parse_multipart(body, content_type)
+        return dict(parse_qsl(body.decode("utf-8"))), {}
+
+    def project_response(self, project: dict) -> dict:
+        return {k: project[k] for k in ("id", "name", "description", "global_id", "hash", "metadata")}
+
+    async def create_project(self, request: httpx.Request, body: bytes) -> httpx.Response:
+        data = json.loads(body)
+        metadata = data.get("metadata") or {}
+        project = {
+            "id": self.new_id(), "name": data.get("name", ""), "description": data.get("description", ""),
+            "global_id": data.get("global_id", ""), "hash": data.get("hash", ""),
+            "metadata": json.loads(metadata) if isinstance(metadata, str) else metadata}
+        self.projects[project["id"]] = project
+        return httpx.Response(201, json=self.project_response(project))
+
+    async def get_project(self, request: httpx.Request, body: bytes, project_id: str) -> httpx.Response:
+        project = self.projects.get(int(project_id))
+        if project is None:
+            return httpx.Response(404, json={"detail": "Not found"})
+        return httpx.Response(200, json=self.project_response(project))
+
+    async def update_project(self, request: httpx.Request, body: bytes, project_id: str) -> httpx.Response:
+        project = self.projects.get(int(project_id))
+        if project is None:
+            return httpx.Response(404, json={"detail": "Not found"})
+        for key, value in json.loads(body).items():
+            if key == "metadata" and isinstance(value, str):
+                value = json.loads(value)
+            if key in project and key != "id":
+                project[key] = value
+        return httpx.Response(200, json=self.project_response(project))
+
+    async def project_files(self, request: httpx.Request, body: bytes, project_id: str) -> httpx.Response:
+        return httpx.Response(200, json=[
+            {"id": f["id"], "filename": f["filename"], "name": f["filename"], "path": f["path"],
+             "file_category": f["file_category"], "hash": f["hash"]}
+            for f in self.files.values() if f["project_id"] == int(project_id)])
+
+    async def delete_file(self, request: httpx.Request, body: bytes, file_id: str) -> httpx.Response:
+        if self.files.pop(int(file_id), None) is None:
+            return httpx.Response(404, json={"detail": "Not found"})
+        os.remove(self.file_path(int(file_id)))
+        return httpx.Response(204)
+
+    async def download_file(self, request: httpx.Request, body: bytes, file_id: str) -> httpx.Response:
+        file = self.files.get(int(file_id))
+        if file is None:
+            return httpx.Response(404, json={"detail": "Not found"})
+        size = os.path.getsize(self.file_path(file["id"]))
+        range_match = re.match(r"bytes=(\d+)-$", request.headers.get("Range", ""))
+        if range_match is None:
+            return httpx.Response(200, headers={"Content-Length": str(size)},
+                                  stream=ThrottledFile(self, self.file_path(file["id"])))
+        offset = int(range_match.group(1))
+        if offset >= size:
+            return httpx.Response(416, headers={"Content-Range": f"bytes */{size}"})
+        return httpx.Response(206, headers={"Content-Length": str(size - offset),
+                                            "Content-Range": f"bytes {offset}-{size - 1}/{size}"},
+                              stream=ThrottledFile(self, self.file_path(file["id"]), offset))
+
+    async def create_upload(self, request: httpx.Request, body: bytes) -> httpx.Response:
+        data = json.loads(body)
+        upload_id = str(uuid.uuid4())
+        path = os.path.join(self.storage_dir, "uploads", upload_id)
+        open(path, "wb").close()
+        self.uploads[upload_id] = {
+            "filename": data["filename"], "size": int(data["size"]), "data_hash": data.get("data_hash"),
+            "file_category": data.get("file_category", ""), "path": path, "offset": 0,
+            "sha1": hashlib.sha1(), "complete": False}
+        return httpx.Response(200, json={"upload_id": upload_id, "chunk_size": self.chunk_size})
+
+    async def upload_chunk(self, request: httpx.Request, body: bytes, upload_id: str) -> httpx.Response:
+        """Append a chunk at the offset the upload reached, a chunk at another offset is ignored and the expected
+        offset returned so the client resends from there"""
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return httpx.Response(404, json={"detail": "Unknown upload"})
+        fields, files = self.form(request, body)
+        chunk = files.get("chunk", b"")
+        if int(fields.get("offset", 0)) == upload["offset"] and not upload["complete"]:
+            if upload["offset"] + len(chunk) > upload["size"]:
+                return httpx.Response(400, json={"detail": "Chunk past the end of the upload"})
+            with open(upload["path"], "ab") as f:
+                f.write(chunk)
+            upload["sha1"].update(chunk)
+            upload["offset"] += len(chunk)
+            if upload["offset"] == upload["size"]:
+                if upload["data_hash"] and upload["sha1"].hexdigest() != upload["data_hash"]:
+                    return httpx.Response(400, json={"detail": "Hash mismatch"})
+                upload["complete"] = True
+        return httpx.Response(200, json={"status": "complete" if upload["complete"] else "incomplete",
+                                         "offset": upload["offset"]})
+
+    async def complete_upload(self, request: httpx.Request, body: bytes, upload_id: str) -> httpx.Response:
+        """Turn a finished upload into a new project file or the new content of an existing one"""
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return httpx.Response(404, json={"detail": "Unknown upload"})
+        if not upload["complete"]:
+            return httpx.Response(400, json={"detail": "Upload is incomplete"})
+        data = json.loads(body)
+        if data.get("file_id"):
+            file = self.files.get(int(data["file_id"]))
+            if file is None:
+                return httpx.Response(404, json={"detail": "Not found"})
+        elif data.get("create_file"):
+            file = {"id": self.new_id(), "project_id": data.get("project_id"), "path": list(data.get("path") or [])}
+            self.files[file["id"]] = file
+        else:
+            return httpx.Response(400, json={"detail": "Either file_id or create_file is required"})
+        file.update(filename=upload["filename"], file_category=upload["file_category"],
+                    hash=upload["sha1"].hexdigest())
+        shutil.move(upload["path"], self.file_path(file["id"]))
+        del self.uploads[upload_id]
+        return httpx.Response(200, json=dict(file))
+
+    async def create_raw_data(self, request: httpx.Request, body: bytes) -> httpx.Response:
+        fields, _ = self.form(request, body)
+        upload = self.uploads.get(fields.get("upload_id", ""))
+        if upload is None or not upload["complete"]:
+            return httpx.Response(400, json={"detail": "Unknown or incomplete upload"})
+        raw_data = {"id": self.new_id(), **fields, "size": upload["size"], "hash": upload["sha1"].hexdigest()}
+        os.remove(upload["path"])
+        del self.uploads[fields["upload_id"]]
+        self.raw_data[raw_data["id"]] = raw_data
+        return httpx.Response(201, json=raw_data)
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import tempfile
+import zlib
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from cinder.utils.hashing import HASH_CHUNK_SIZE, sha1_file
+
+
+def iter_file(file_path: str, block_size: int = HASH_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the bytes of a file in blocks"""
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            yield block
+
+
+def gzip_stream(pieces: Iterator[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip compress a stream of bytes. The gzip header carries no timestamp so the same input always gives
+    the same output"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def rechunk(pieces: Iterator[bytes], chunk_size: int, offset: int = 0) -> Iterator[tuple[int, bytes]]:
+    """Regroup a stream of bytes into (position, chunk) pairs of exactly chunk_size bytes, the last one may be
+    shorter. Bytes before offset are skipped so an interrupted stream can be continued"""
+    buffer = bytearray()
+    position = 0
+    for piece in pieces:
+        if position + len(piece) <= offset:
+            position += len(piece)
+            continue
+        if position < offset:
+            piece = piece[offset - position:]
+            position = offset
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            yield position, bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+            position += chunk_size
+    if buffer:
+        yield position, bytes(buffer)
+
+
+@dataclass
+class TableSource:
+    """A table file to upload as a stream, optionally gzip compressed. A compressed stream is written to a temporary
+    file while it is measured and sent from there, so the file is compressed once. close removes that file"""
+    file_path: str
+    sep: str
+    compress: bool = False
+    compressed_path: str | None = field(default=None, init=False, repr=False)
+
+    @property
+    def filename(self) -> str:
+        name = os.path.basename(self.file_path)
+        if self.compress:
+            name = f"{name}.gz"
+        return name
+
+    @property
+    def file_type(self) -> str:
+        if self.sep == ",":
+            return "csv"
+        return "tsv"
+
+    def pieces(self) -> Iterator[bytes]:
+        """Yield the bytes that are uploaded"""
+        if self.compressed_path is not None:
+            return iter_file(self.compressed_path)
+        if self.compress:
+            return gzip_stream(iter_file(self.file_path))
+        return iter_file(self.file_path)
+
+    def measure(self) -> tuple[int, str]:
+        """Return the size and sha1 of the uploaded bytes, compressing the file into a temporary file on the way"""
+        if not self.compress:
+            return os.path.getsize(self.file_path), sha1_file(self.file_path)
+        if self.compressed_path is not None:
+            return os.path.getsize(self.compressed_path), sha1_file(self.compressed_path)
+        size = 0
+        sha1_hash = hashlib.sha1()
+        fd, temp_path = tempfile.mkstemp(suffix=".gz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for piece in gzip_stream(iter_file(self.file_path)):
+                    f.write(piece)
+                    size += len(piece)
+                    sha1_hash.update(piece)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.compressed_path = temp_path
+        return size, sha1_hash.hexdigest()
+
+    def close(self):
+        if self.compressed_path is not None:
+            if os.path.exists(self.compressed_path):
+                os.remove(self.compressed_path)
+            self.compressed_path = None
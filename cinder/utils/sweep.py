@@ -0,0 +1,143 @@
+import itertools
+import os
+import re
+import time
+from dataclasses import replace
+from typing import Callable
+
+import pandas as pd
+
+from cinder.utils.common import Job, Project, ProjectDatabase
+from cinder.utils.differential_analysis import DifferentialAnalysis
+from cinder.utils.jobs import FINISHED_STATUSES, JobScheduler
+from cinder.utility import detect_delimiter_from_extension
+
+# parameters of a differential analysis that can be swept, with the type of their values
+SWEEP_PARAMETERS = {
+    "column_na_filter_threshold": float,
+    "row_na_filter_threshold": float,
+    "imputation_method": str,
+    "normalization_method": str,
+    "aggregation_method": str,
+}
+
+# column names of the statistics in coral outputs, the first match is used
+P_VALUE_PATTERN = re.compile(r"^(?:adj\.?p\.?val|padj|p\.adj|adj[._ ]p[._ ]?value|q[._ ]?value|fdr)$", re.IGNORECASE)
+RAW_P_VALUE_PATTERN = re.compile(r"^(?:p\.?value|pval|p)$", re.IGNORECASE)
+FOLD_CHANGE_PATTERN = re.compile(r"^(?:logfc|log2fc|log2foldchange|log2[._ ]fold[._ ]change|foldchange)$", re.IGNORECASE)
+COMPARISON_PATTERN = re.compile(r"^(?:comparison|comparison_label|contrast|label)$", re.IGNORECASE)
+
+
+def parse_grid(items: list[str]) -> dict[str, list]:
+    """Parse name=value1,value2 items into a parameter grid"""
+    grid = {}
+    for item in items:
+        name, _, values = item.partition("=")
+        name = name.strip()
+        if name not in SWEEP_PARAMETERS:
+            raise ValueError(f"{name} cannot be swept, choose from {', '.join(SWEEP_PARAMETERS)}")
+        if not values:
+            raise ValueError(f"No values given for {name}")
+        grid[name] = [SWEEP_PARAMETERS[name](v.strip()) for v in values.split(",")]
+    return grid
+
+
+def sweep_output_name(base: str, settings: dict) -> str:
+    """Output name of one combination, the base output followed by its settings"""
+    suffix = "_".join(str(v) for v in settings.values())
+    return f"{base}__{re.sub(r'[^A-Za-z0-9._-]+', '-', suffix)}"
+
+
+def expand_grid(base: DifferentialAnalysis, grid: dict[str, list]) -> list[DifferentialAnalysis]:
+    """Return one analysis per combination of the grid values, the other parameters are taken from base"""
+    analyses = []
+    for combination in itertools.product(*grid.values()):
+        settings = dict(zip(grid, combination))
+        analyses.append(replace(base, output_file=sweep_output_name(base.output_file, settings), **settings))
+    return analyses
+
+
+def submit_sweep(scheduler: JobScheduler, project: Project, base: DifferentialAnalysis, grid: dict[str, list],
+                 **kwargs) -> list[Job]:
+    """Queue every combination of the grid as a job of the scheduler. The jobs share their project data folder
+    and limits so the scheduler batches them into shared containers when batching or the warm pool is on"""
+    return [scheduler.submit(project, analysis, **kwargs) for analysis in expand_grid(base, grid)]
+
+
+def wait_for_jobs(db: ProjectDatabase, job_ids: list[int], interval: float = 1.0,
+                  on_poll: Callable[[list[Job]], None] | None = None) -> list[Job]:
+    """Block until all the jobs finished and return them"""
+    while True:
+        jobs = [db.get_job(i) for i in job_ids]
+        if on_poll:
+            on_poll(jobs)
+        if all(j.status in FINISHED_STATUSES for j in jobs):
+            return jobs
+        time.sleep(interval)
+
+
+def read_output(data_path: str, analysis: DifferentialAnalysis) -> pd.DataFrame | None:
+    """Read the result tables of an analysis into one table, None if it has no readable output"""
+    tables = []
+    for path in analysis.output_paths(data_path):
+        files = [path] if os.path.isfile(path) else [
+            os.path.join(root, f) for root, _, names in os.walk(path) for f in sorted(names)
+            if detect_delimiter_from_extension(f)]
+        for file in files:
+            sep = detect_delimiter_from_extension(file) or "\t"
+            try:
+                tables.append(pd.read_csv(file, sep=sep))
+            except (ValueError, UnicodeDecodeError, pd.errors.ParserError):
+                continue
+    if not tables:
+        return None
+    return pd.concat(tables, ignore_index=True)
+
+
+def find_column(columns: list[str], *patterns: re.Pattern) -> str | None:
+    for pattern in patterns:
+        for column in columns:
+            if pattern.match(str(column)):
+                return column
+    return None
+
+
+def count_hits(result: pd.DataFrame, p_value: float, log2_fold_change: float) -> pd.DataFrame:
+    """Count tested rows and significant hits of a result table, per comparison if it has a comparison column"""
+    columns = list(result.columns)
+    p_column = find_column(columns, P_VALUE_PATTERN, RAW_P_VALUE_PATTERN)
+    fc_column = find_column(columns, FOLD_CHANGE_PATTERN)
+    comparison_column = find_column(columns, COMPARISON_PATTERN)
+    frame = pd.DataFrame({"comparison": result[comparison_column].astype(str) if comparison_column else ""},
+                         index=result.index)
+    p = pd.to_numeric(result[p_column], errors="coerce") if p_column else pd.Series(float("nan"), index=result.index)
+    fc = pd.to_numeric(result[fc_column], errors="coerce") if fc_column else pd.Series(0.0, index=result.index)
+    significant = (p < p_value) & (fc.abs() >= log2_fold_change if fc_column else True)
+    frame["tested"] = p.notna()
+    frame["significant"] = significant
+    frame["up"] = significant & (fc > 0)
+    frame["down"] = significant & (fc < 0)
+    counts = frame.groupby("comparison", sort=True)[["tested", "significant", "up", "down"]].sum()
+    counts["p_value_column"] = p_column or ""
+    return counts.reset_index()
+
+
+def summarize_sweep(jobs: list[Job], grid: dict[str, list], p_value: float = 0.05,
+                    log2_fold_change: float = 1.0) -> pd.DataFrame:
+    """One row per combination and comparison with the number of significant hits, indexed by the swept
+    parameters and the comparison"""
+    rows = []
+    for job in jobs:
+        settings = {name: getattr(job.analysis, name) for name in grid}
+        result = read_output(job.data_path, job.analysis) if job.status in ("done", "cached") else None
+        if result is None:
+            rows.append({**settings, "comparison": "", "status": job.status, "output": job.analysis.output_file})
+            continue
+        for count in count_hits(result, p_value, log2_fold_change).to_dict("records"):
+            rows.append({**settings, **count, "status": job.status, "output": job.analysis.output_file})
+    summary = pd.DataFrame(rows)
+    for column in ["tested", "significant", "up", "down"]:
+        if column not in summary:
+            summary[column] = pd.NA
+        summary[column] = summary[column].astype("Int64")
+    return summary.set_index(list(grid) + ["comparison"]).sort_index()
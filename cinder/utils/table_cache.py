@@ -0,0 +1,111 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.feather as feather
+except ImportError:
+    pyarrow = None
+    feather = None
+
+
+def read_table_header(file_path: str, sep: str, sample_rows: int = 5) -> pd.DataFrame:
+    """Read only the header and the first sample_rows rows of a table, enough to fill column pickers"""
+    return pd.read_csv(file_path, sep=sep, nrows=sample_rows)
+
+
+def downcast_numeric(df: pd.DataFrame) -> pd.DataFrame:
+    """Downcast float columns to float32 and integer columns to the smallest dtype that holds their values"""
+    for column in df.select_dtypes("float64").columns:
+        df[column] = df[column].astype("float32")
+    for column in df.select_dtypes("integer").columns:
+        df[column] = pd.to_numeric(df[column], downcast="integer")
+    return df
+
+
+def read_table_columns(file_path: str, sep: str, columns: list[str], sample: pd.DataFrame = None,
+                       downcast: bool = True) -> pd.DataFrame:
+    """Read only the given columns of a table. With downcast, columns that are floats in the sample rows are parsed
+    straight into float32 and the rest is downcast after parsing"""
+    dtype = None
+    if downcast and sample is not None:
+        dtype = {c: "float32" for c in sample[columns].select_dtypes("float").columns}
+    try:
+        df = pd.read_csv(file_path, sep=sep, usecols=columns, dtype=dtype)
+    except ValueError:
+        # a column looked numeric in the sample rows but holds text further down
+        df = pd.read_csv(file_path, sep=sep, usecols=columns)
+    df = df[columns]
+    if downcast:
+        df = downcast_numeric(df)
+    return df
+
+
+class TableCache:
+    """Columnar cache of parsed project tables keyed by the sha1 of the source file. Every column read from a table is
+    stored in its own uncompressed Feather file, so adding columns never rewrites the ones cached before and cached
+    columns are memory mapped instead of read into memory. Without pyarrow installed tables are always parsed from the
+    source file"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @property
+    def enabled(self) -> bool:
+        return feather is not None
+
+    def table_path(self, sha1: str) -> str:
+        return os.path.join(self.root, sha1[:2], sha1)
+
+    def column_path(self, sha1: str, column: str) -> str:
+        return os.path.join(self.table_path(sha1), f"{hashlib.sha1(column.encode('utf-8')).hexdigest()}.feather")
+
+    def read_column(self, sha1: str, column: str) -> pd.Series | None:
+        """Read one cached column, None if it is not cached or its file is unreadable"""
+        path = self.column_path(sha1, column)
+        if not os.path.exists(path):
+            return None
+        try:
+            return feather.read_table(path, memory_map=True).to_pandas()[column]
+        except (OSError, KeyError, pyarrow.ArrowException):
+            os.remove(path)
+            return None
+
+    def load_columns(self, file_path: str, sha1: str, sep: str, columns: list[str], sample: pd.DataFrame = None,
+                     downcast: bool = True) -> pd.DataFrame:
+        """Load only the given columns, from the cache where present. Columns that are not cached yet are parsed from
+        the source file in one pass and cached, so a file is never parsed in full just to show a few columns"""
+        if not self.enabled or not sha1:
+            return read_table_columns(file_path, sep, columns, sample, downcast)
+        loaded = {column: self.read_column(sha1, column) for column in dict.fromkeys(columns)}
+        missing = [column for column, values in loaded.items() if values is None]
+        if missing:
+            # cached columns keep full precision, downcasting is applied on the way out
+            parsed = read_table_columns(file_path, sep, missing, downcast=False)
+            for column in missing:
+                loaded[column] = parsed[column]
+                self.write(self.column_path(sha1, column), parsed[[column]])
+        df = pd.concat([loaded[column] for column in columns], axis=1)
+        return downcast_numeric(df) if downcast else df
+
+    def write(self, path: str, df: pd.DataFrame) -> bool:
+        """Write a table through a temporary file of its own, tables that Arrow cannot represent are not cached"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            feather.write_feather(df, temp_path, compression="uncompressed")
+        except (pyarrow.ArrowException, ValueError, TypeError):
+            os.remove(temp_path)
+            return False
+        os.replace(temp_path, path)
+        return True
+
+    def invalidate(self, sha1: str):
+        """Remove the cached columns of a file content that is no longer current"""
+        if sha1:
+            shutil.rmtree(self.table_path(sha1), ignore_errors=True)
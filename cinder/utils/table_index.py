@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+
+class TableIndex:
+    """Hash index from the values of a table's index column to row positions, with incremental substring search
+    over the distinct values for the index value picker"""
+
+    def __init__(self, values: pd.Series):
+        self.column = values.name
+        keys = values.astype(str)
+        # the first row of a duplicated index value is the one that is plotted
+        first = ~keys.duplicated(keep="first")
+        self.keys = keys[first].reset_index(drop=True)
+        self.positions: dict[str, int] = dict(zip(self.keys, np.flatnonzero(first.to_numpy())))
+        self._lower_keys = self.keys.str.lower()
+        self._last_term = ""
+        self._last_matches = np.arange(len(self.keys))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get(self, value: str) -> int | None:
+        """Return the row position of an index value"""
+        return self.positions.get(value)
+
+    def search(self, term: str, limit: int = 50) -> list[str]:
+        """Return up to limit index values containing term, ignoring case. When term extends the previous search
+        only the previous matches are scanned"""
+        term = term.lower()
+        if self._last_term in term:
+            candidates = self._last_matches
+        else:
+            candidates = np.arange(len(self.keys))
+        if term:
+            candidates = candidates[self._lower_keys.iloc[candidates].str.contains(term, regex=False).to_numpy()]
+        self._last_term = term
+        self._last_matches = candidates
+        return self.keys.iloc[candidates[:limit]].tolist()